@@ -3,10 +3,21 @@ CLI de Administración de Clientes para ComparApp SaaS
 Permite crear, listar, activar/desactivar y eliminar clientes
 """
 
+import argparse
+import csv
 import pymysql
-import secrets
+import re
 import sys
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import cache
+import esquema
+import maestro
+import migraciones
+import tokens
+import uso
 
 # ============================================
 # CONFIGURACIÓN
@@ -22,6 +33,11 @@ DB_CONFIG = {
 
 ADMIN_DB = 'comparapp_admin'
 
+_hilo = threading.local()
+
+_tokens_listos = False
+_tokens_lock = threading.Lock()
+
 
 # ============================================
 # FUNCIONES DE BASE DE DATOS
@@ -55,9 +71,26 @@ def ejecutar_query(query, params=None, database=ADMIN_DB, fetch=True):
 # FUNCIONES DE ADMINISTRACIÓN
 # ============================================
 
-def generar_token():
-    """Genera token seguro de 32 caracteres"""
-    return secrets.token_urlsafe(32)
+def asegurar_tokens():
+    """
+    Crea tokens_clientes y pasa a hash los tokens en claro que queden
+    Se ejecuta una vez por corrida, antes de dar de alta o rotar tokens
+    """
+    global _tokens_listos
+    with _tokens_lock:
+        if _tokens_listos:
+            return
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                migrados = tokens.migrar_texto_plano(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+        if migrados:
+            cache.invalidar('clientes')
+            print(f"🔐 {migrados} tokens en texto plano pasados a hash")
+        _tokens_listos = True
 
 
 def listar_clientes():
@@ -84,7 +117,182 @@ def listar_clientes():
     print("=" * 100 + "\n")
 
 
-def crear_cliente(nombre, subdominio):
+def _descartar_transaccion(conn):
+    """
+    Deshace lo que haya quedado sin commit en la conexión del hilo, así el
+    próximo cliente que provisione no lo confirma junto con el suyo. Si la
+    conexión quedó rota se cierra y el hilo abre otra.
+    """
+    try:
+        conn.rollback()
+    except Exception:
+        _hilo.conn = None
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _conexion_hilo():
+    """
+    Conexión sin base por defecto, reutilizada por todos los clientes que
+    provisiona un mismo hilo (las sentencias usan nombres `bd`.tabla)
+    """
+    conn = getattr(_hilo, 'conn', None)
+    if conn is None or not conn.open:
+        conn = pymysql.connect(**DB_CONFIG)
+        _hilo.conn = conn
+    return conn
+
+
+def provisionar_cliente(nombre, subdominio, catalogo_maestro=None):
+    """
+    Crea BD, tabla products y registro en clientes para un cliente
+    Es repetible: si el subdominio ya existe no hace nada
+    Retorna dict con subdominio, db_name, token y estado; si el cliente quedó
+    creado pero sus migraciones fallaron, también error_migracion
+    """
+    if not subdominio.isalnum():
+        raise ValueError("El subdominio solo puede contener letras y números")
+    
+    db_name = f"cliente_{subdominio}"
+    asegurar_tokens()
+    conn = _conexion_hilo()
+    
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM `{ADMIN_DB}`.clientes WHERE subdominio = %s", (subdominio,))
+            if cursor.fetchone():
+                return {'subdominio': subdominio, 'db_name': db_name, 'token': None, 'estado': 'existente'}
+            
+            if esquema.TENANCY_MODE == 'compartido':
+                return _provisionar_compartido(conn, nombre, subdominio, db_name, catalogo_maestro)
+            
+            for sentencia in esquema.ddl_cliente(db_name):
+                cursor.execute(sentencia)
+            
+            if catalogo_maestro:
+                cursor.execute(esquema.sql_copiar_catalogo(catalogo_maestro, db_name))
+            
+            cursor.execute(
+                f"INSERT INTO `{ADMIN_DB}`.clientes (nombre, subdominio, db_name, activo) "
+                "VALUES (%s, %s, %s, 1)",
+                (nombre, subdominio, db_name)
+            )
+            cliente_id = cursor.lastrowid
+            token = tokens.emitir(cursor, cliente_id)
+        conn.commit()
+    except Exception:
+        # Sin esto, la fila de clientes sin token quedaría en la transacción
+        # abierta y se confirmaría con el próximo cliente de este hilo
+        _descartar_transaccion(conn)
+        raise
+    
+    # El esquema base queda al día con las migraciones vigentes. El cliente y
+    # su token ya están confirmados: un fallo acá se informa junto con el token
+    # (que no se puede volver a mostrar) y `migrar` lo retoma después
+    try:
+        migraciones.asegurar_tabla_versiones(conn)
+        error = migraciones.migrar_cliente(
+            conn, {'id': cliente_id, 'subdominio': subdominio, 'db_name': db_name}
+        )['error']
+    except Exception as e:
+        _descartar_transaccion(conn)
+        error = str(e)
+    
+    return {'subdominio': subdominio, 'db_name': db_name, 'token': token, 'estado': 'creado',
+            'error_migracion': error}
+
+
+def _provisionar_compartido(conn, nombre, subdominio, db_name, catalogo_maestro=None):
+    """
+    Alta en modo compartido: sin BD propia, solo la vista sobre la tabla única
+    La vista necesita el id del cliente y CREATE VIEW confirma implícitamente
+    la fila de clientes: el token y el catálogo van después, en una sola
+    transacción, y si fallan se deshace el alta entera
+    """
+    with conn.cursor() as cursor:
+        for sentencia in esquema.ddl_compartido():
+            cursor.execute(sentencia)
+        
+        cursor.execute(
+            f"INSERT INTO `{ADMIN_DB}`.clientes (nombre, subdominio, db_name, activo) "
+            "VALUES (%s, %s, %s, 1)",
+            (nombre, subdominio, db_name)
+        )
+        cliente_id = cursor.lastrowid
+        
+        try:
+            cursor.execute(esquema.ddl_vista_cliente(cliente_id))
+            token = tokens.emitir(cursor, cliente_id)
+            if catalogo_maestro:
+                cursor.execute(esquema.sql_consolidar_cliente(catalogo_maestro, cliente_id))
+            conn.commit()
+        except Exception:
+            _deshacer_alta_compartida(conn, cliente_id)
+            raise
+    
+    return {'subdominio': subdominio, 'db_name': db_name, 'token': token, 'estado': 'creado'}
+
+
+def _deshacer_alta_compartida(conn, cliente_id):
+    """
+    Borra el cliente a medio crear (sus tokens caen por la cascada) y su vista,
+    así un reintento lo vuelve a crear en lugar de devolverlo sin token
+    """
+    try:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM `{ADMIN_DB}`.clientes WHERE id = %s", (cliente_id,))
+            cursor.execute(f"DROP VIEW IF EXISTS `{esquema.SHARED_DB}`.{esquema.vista_cliente(cliente_id)}")
+        conn.commit()
+    except Exception as e:
+        print(f"⚠️  No se pudo deshacer el alta del cliente {cliente_id}: {e}")
+
+
+def consolidar_cliente(cliente):
+    """
+    Copia los productos de cliente_<x> a la tabla compartida y crea su vista
+    No borra la BD original; se puede re-ejecutar para traer filas nuevas
+    """
+    conn = _conexion_hilo()
+    origen = esquema.validar_nombre_bd(cliente['db_name'])
+    with conn.cursor() as cursor:
+        cursor.execute(esquema.ddl_vista_cliente(cliente['id']))
+        cursor.execute(esquema.sql_consolidar_cliente(origen, cliente['id']))
+        copiados = cursor.rowcount
+        cursor.execute(f"SELECT COUNT(*) AS total FROM `{origen}`.products")
+        total_origen = cursor.fetchone()['total']
+        cursor.execute(
+            f"SELECT COUNT(*) AS total FROM `{esquema.SHARED_DB}`.{esquema.vista_cliente(cliente['id'])}"
+        )
+        total_destino = cursor.fetchone()['total']
+    conn.commit()
+    
+    return {'subdominio': cliente['subdominio'], 'copiados': copiados,
+            'origen': total_origen, 'destino': total_destino}
+
+
+def provisionar_lote(clientes, paralelo=4, catalogo_maestro=None):
+    """
+    Provisiona muchos clientes en paralelo (p. ej. las sucursales de una cadena)
+    clientes: lista de (nombre, subdominio)
+    """
+    def tarea(nombre, subdominio):
+        try:
+            return provisionar_cliente(nombre, subdominio, catalogo_maestro)
+        except Exception as e:
+            return {'subdominio': subdominio, 'db_name': f"cliente_{subdominio}",
+                    'token': None, 'estado': f'error: {e}'}
+    
+    with ThreadPoolExecutor(max_workers=paralelo) as executor:
+        resultados = list(executor.map(lambda c: tarea(*c), clientes))
+    
+    cache.invalidar('clientes')
+    return resultados
+
+
+def crear_cliente(nombre, subdominio, catalogo_maestro=None):
     """Crea un nuevo cliente con su base de datos"""
     
     # Validar subdominio
@@ -92,82 +300,71 @@ def crear_cliente(nombre, subdominio):
         print("❌ El subdominio solo puede contener letras y números")
         return False
     
-    # Generar nombres
-    db_name = f"cliente_{subdominio}"
-    token = generar_token()
-    
     print(f"\n🔨 Creando cliente '{nombre}'...")
     print(f"   Subdominio: {subdominio}.comparappargentina.com")
-    print(f"   Base de datos: {db_name}")
+    print(f"   Base de datos: cliente_{subdominio}")
     
     try:
-        # 1. Crear base de datos
-        conn = pymysql.connect(**DB_CONFIG)
-        with conn.cursor() as cursor:
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name} CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-        conn.close()
-        print("   ✅ Base de datos creada")
+        resultado = provisionar_cliente(nombre, subdominio, catalogo_maestro)
         
-        # 2. Crear tabla products
-        query_tabla = """
-            CREATE TABLE IF NOT EXISTS products (
-                id VARCHAR(36) PRIMARY KEY,
-                reference VARCHAR(255) NOT NULL,
-                code VARCHAR(255) NOT NULL UNIQUE,
-                codetype VARCHAR(50) DEFAULT 'EAN-13',
-                name VARCHAR(255) NOT NULL,
-                pricebuy DECIMAL(10,2) DEFAULT 0.00,
-                pricesell DECIMAL(10,2) DEFAULT 0.00,
-                category VARCHAR(50) DEFAULT '000',
-                taxcat VARCHAR(50) DEFAULT '002',
-                stockcost DECIMAL(10,2) DEFAULT 0.00,
-                stockvolume DECIMAL(10,3) DEFAULT 0.000,
-                stockunits DECIMAL(10,3) DEFAULT 0.000,
-                supplier VARCHAR(50) DEFAULT '0',
-                texttip TEXT,
-                warranty TINYINT(1) DEFAULT 0,
-                INDEX idx_code (code),
-                INDEX idx_reference (reference)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        """
-        ejecutar_query(query_tabla, database=db_name, fetch=False)
-        print("   ✅ Tabla products creada")
+        if resultado['estado'] == 'existente':
+            print(f"\n❌ El subdominio '{subdominio}' ya está registrado\n")
+            return False
         
-        # 3. Registrar cliente en admin
-        query_cliente = """
-            INSERT INTO clientes (nombre, subdominio, db_name, token, activo)
-            VALUES (%s, %s, %s, %s, 1)
-        """
-        ejecutar_query(query_cliente, (nombre, subdominio, db_name, token), fetch=False)
+        print("   ✅ Base de datos y tabla products creadas")
+        if catalogo_maestro:
+            print(f"   ✅ Catálogo copiado desde {catalogo_maestro}")
         print("   ✅ Cliente registrado")
         
         print("\n" + "=" * 80)
         print("✅ CLIENTE CREADO EXITOSAMENTE")
         print("=" * 80)
         print(f"\n📌 URL: https://{subdominio}.comparappargentina.com")
-        print(f"🔑 TOKEN: {token}")
+        print(f"🔑 TOKEN: {resultado['token']}")
         print("\n⚠️  GUARDA ESTE TOKEN - Es necesario para acceder al sistema\n")
+        if resultado.get('error_migracion'):
+            print(f"⚠️  Migraciones pendientes: {resultado['error_migracion']}")
+            print(f"   Reintentar con: python3 admin_cliente.py migrar --cliente {subdominio}\n")
         print("=" * 80 + "\n")
         
-        return True
+        return not resultado.get('error_migracion')
         
     except Exception as e:
         print(f"\n❌ Error al crear cliente: {e}\n")
         return False
 
 
-def cambiar_token(cliente_id):
-    """Genera nuevo token para un cliente"""
-    nuevo_token = generar_token()
-    
-    query = "UPDATE clientes SET token = %s WHERE id = %s"
-    success = ejecutar_query(query, (nuevo_token, cliente_id), fetch=False)
+def cambiar_token(cliente_id, gracia=None):
+    """
+    Emite un token nuevo; los anteriores siguen valiendo `gracia` segundos
+    (default TOKEN_ROTATION_GRACE) para actualizar los escáneres sin cortes
+    """
+    gracia = tokens.TOKEN_CONFIG['gracia'] if gracia is None else gracia
+    try:
+        asegurar_tokens()
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT id FROM clientes WHERE id = %s", (cliente_id,))
+                if not cursor.fetchone():
+                    print(f"\n❌ Cliente ID {cliente_id} no encontrado\n")
+                    return
+                nuevo_token = tokens.rotar(cursor, cliente_id, gracia)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"\n❌ Error al actualizar token: {e}\n")
+        return
     
-    if success:
-        print(f"\n✅ Token actualizado para cliente ID {cliente_id}")
-        print(f"🔑 Nuevo token: {nuevo_token}\n")
+    cache.invalidar('clientes')
+    print(f"\n✅ Token actualizado para cliente ID {cliente_id}")
+    print(f"🔑 Nuevo token: {nuevo_token}")
+    if gracia:
+        print(f"⏳ Los tokens anteriores siguen valiendo {gracia // 3600}h {gracia % 3600 // 60}min")
     else:
-        print(f"\n❌ Error al actualizar token\n")
+        print("⛔ Los tokens anteriores quedaron revocados")
+    print("\n⚠️  GUARDA ESTE TOKEN - No se vuelve a mostrar\n")
 
 
 def activar_desactivar(cliente_id, activar=True):
@@ -179,6 +376,7 @@ def activar_desactivar(cliente_id, activar=True):
     success = ejecutar_query(query, (valor, cliente_id), fetch=False)
     
     if success:
+        cache.invalidar('clientes')
         emoji = "✅" if activar else "❌"
         print(f"\n{emoji} Cliente ID {cliente_id} {accion}do\n")
     else:
@@ -219,6 +417,7 @@ def eliminar_cliente(cliente_id):
         # Eliminar de admin
         query = "DELETE FROM clientes WHERE id = %s"
         ejecutar_query(query, (cliente_id,), fetch=False)
+        cache.invalidar('clientes')
         print(f"   ✅ Cliente eliminado del sistema")
         
         print("\n✅ Cliente eliminado exitosamente\n")
@@ -228,17 +427,32 @@ def eliminar_cliente(cliente_id):
 
 
 def ver_token(cliente_id):
-    """Muestra el token de un cliente"""
-    query = "SELECT nombre, token FROM clientes WHERE id = %s"
+    """
+    Muestra los tokens vigentes de un cliente
+    Solo se guarda el hash: se ven el prefijo y el vencimiento, no el token
+    """
+    query = "SELECT nombre FROM clientes WHERE id = %s"
     cliente = ejecutar_query(query, (cliente_id,))
     
     if not cliente:
         print(f"\n❌ Cliente ID {cliente_id} no encontrado\n")
         return
     
-    cliente = cliente[0]
-    print(f"\n🔑 Token del cliente '{cliente['nombre']}':")
-    print(f"   {cliente['token']}\n")
+    asegurar_tokens()
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            vigentes = tokens.listar(cursor, cliente_id)
+    finally:
+        conn.close()
+    
+    print(f"\n🔑 Tokens vigentes del cliente '{cliente[0]['nombre']}':")
+    for t in vigentes:
+        vence = f"vence {t['expira']}" if t['expira'] else "sin vencimiento"
+        print(f"   {t['prefijo']}…   creado {t['creado']}   {vence}")
+    if not vigentes:
+        print("   (ninguno: usá 'Cambiar token' para emitir uno)")
+    print("\n   Un token perdido no se puede recuperar: rotalo para emitir uno nuevo\n")
 
 
 # ============================================
@@ -252,8 +466,8 @@ def mostrar_menu():
     print("=" * 60)
     print("\n1. 📋 Listar clientes")
     print("2. ➕ Crear nuevo cliente")
-    print("3. 🔑 Ver token de cliente")
-    print("4. 🔄 Cambiar token de cliente")
+    print("3. 🔑 Ver tokens de cliente")
+    print("4. 🔄 Cambiar token de cliente (con período de gracia)")
     print("5. ✅ Activar cliente")
     print("6. ❌ Desactivar cliente")
     print("7. 🗑️  Eliminar cliente")
@@ -323,7 +537,348 @@ def main():
         input("\nPresiona Enter para continuar...")
 
 
+def provisionar_desde_archivo(args):
+    """Alta masiva no interactiva desde un CSV con columnas nombre,subdominio"""
+    with open(args.archivo, newline='', encoding='utf-8') as f:
+        clientes = [(fila['nombre'].strip(), fila['subdominio'].strip().lower())
+                    for fila in csv.DictReader(f)]
+    
+    print(f"\n🔨 Provisionando {len(clientes)} clientes ({args.paralelo} en paralelo)...")
+    inicio = datetime.now()
+    resultados = provisionar_lote(clientes, args.paralelo, args.catalogo_maestro)
+    segundos = (datetime.now() - inicio).total_seconds()
+    
+    print("\n" + "=" * 100)
+    print(f"{'SUBDOMINIO':<25} {'BASE DE DATOS':<30} {'ESTADO':<40}")
+    print("=" * 100)
+    for r in resultados:
+        print(f"{r['subdominio']:<25} {r['db_name']:<30} {r['estado']:<40}")
+    print("=" * 100)
+    
+    creados = [r for r in resultados if r['estado'] == 'creado']
+    print(f"\n✅ {len(creados)} creados en {segundos:.1f}s\n")
+    
+    sin_migrar = [r for r in creados if r.get('error_migracion')]
+    for r in sin_migrar:
+        print(f"⚠️  {r['subdominio']}: migraciones pendientes ({r['error_migracion']})")
+    if sin_migrar:
+        print("   Reintentar con: python3 admin_cliente.py migrar\n")
+    
+    if args.salida and creados:
+        with open(args.salida, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['subdominio', 'db_name', 'token'])
+            writer.writeheader()
+            for r in creados:
+                writer.writerow({k: r[k] for k in ('subdominio', 'db_name', 'token')})
+        print(f"🔑 Tokens guardados en {args.salida}\n")
+    
+    ok = all(r['estado'] in ('creado', 'existente') for r in resultados)
+    return 0 if ok and not sin_migrar else 1
+
+
+def migrar(args):
+    """Aplica migraciones pendientes a todas las BDs de clientes"""
+    if esquema.TENANCY_MODE == 'compartido':
+        print("\n⚠️  Modo compartido: las migraciones aplican a BDs por cliente.")
+        print(f"   El esquema de {esquema.SHARED_DB}.products se define en esquema.py\n")
+        return 0
+    
+    conectar = lambda: pymysql.connect(**DB_CONFIG)
+    
+    modo = " (simulación)" if args.dry_run else ""
+    print(f"\n🔨 Migrando clientes a la versión {migraciones.VERSION_ACTUAL}{modo}, {args.paralelo} en paralelo...")
+    resultados = migraciones.migrar_todos(conectar, args.paralelo, args.cliente, args.dry_run)
+    
+    print("\n" + "=" * 100)
+    print(f"{'SUBDOMINIO':<25} {'DESDE':<8} {'HASTA':<8} {'PENDIENTES':<12} {'ESTADO':<40}")
+    print("=" * 100)
+    for r in resultados:
+        estado = f"❌ {r['error']}" if r['error'] else "✅"
+        print(f"{r['subdominio']:<25} {str(r['desde']):<8} {str(r['hasta']):<8} {str(r['pendientes']):<12} {estado[:40]:<40}")
+    print("=" * 100 + "\n")
+    
+    return 1 if any(r['error'] for r in resultados) else 0
+
+
+def consolidar(args):
+    """Migra clientes con BD propia a la tabla products compartida"""
+    conn = _conexion_hilo()
+    with conn.cursor() as cursor:
+        for sentencia in esquema.ddl_compartido():
+            cursor.execute(sentencia)
+        query = f"SELECT id, subdominio, db_name FROM `{ADMIN_DB}`.clientes"
+        params = None
+        if args.cliente:
+            query += " WHERE subdominio = %s"
+            params = (args.cliente,)
+        cursor.execute(query + " ORDER BY id", params)
+        clientes = cursor.fetchall()
+    conn.commit()
+    
+    print(f"\n🔨 Consolidando {len(clientes)} clientes en {esquema.SHARED_DB}.products...")
+    
+    def tarea(cliente):
+        try:
+            return consolidar_cliente(cliente)
+        except Exception as e:
+            return {'subdominio': cliente['subdominio'], 'copiados': None,
+                    'origen': None, 'destino': None, 'error': str(e)}
+    
+    with ThreadPoolExecutor(max_workers=args.paralelo) as executor:
+        resultados = list(executor.map(tarea, clientes))
+    
+    print("\n" + "=" * 100)
+    print(f"{'SUBDOMINIO':<25} {'COPIADOS':<10} {'ORIGEN':<10} {'DESTINO':<10} {'ESTADO':<40}")
+    print("=" * 100)
+    ok = True
+    for r in resultados:
+        if r.get('error'):
+            estado = f"❌ {r['error']}"
+        elif r['origen'] != r['destino']:
+            estado = "⚠️  Cantidades distintas"
+        else:
+            estado = "✅"
+        ok = ok and estado == "✅"
+        print(f"{r['subdominio']:<25} {str(r['copiados']):<10} {str(r['origen']):<10} {str(r['destino']):<10} {estado[:40]:<40}")
+    print("=" * 100)
+    
+    if ok:
+        print("\n✅ Listo. Para usar la tabla compartida: TENANCY_MODE=compartido y reiniciar la app.")
+        print("   Las BDs cliente_* no se borran; volvé a correr este comando justo antes del cambio.\n")
+    return 0 if ok else 1
+
+
+def reporte_uso(args):
+    """Requests por cliente desde uso_por_hora (sin tocar logs_acceso)"""
+    try:
+        desde, hasta = uso.rango(args.desde, args.hasta, dias_default=args.dias)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(uso.DDL_USO_POR_HORA)
+        
+        def consultar(query, params):
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+        
+        filas = uso.reporte_clientes(consultar, desde, hasta)
+    finally:
+        conn.close()
+    
+    print(f"\n📊 Requests del {desde.date()} al {(hasta - timedelta(days=1)).date()}")
+    print("=" * 50)
+    print(f"{'ID':<6} {'SUBDOMINIO':<25} {'REQUESTS':>15}")
+    print("=" * 50)
+    for f in filas:
+        print(f"{f['cliente_id']:<6} {f['subdominio']:<25} {f['requests']:>15,}")
+    print("=" * 50)
+    print(f"{'':<6} {'TOTAL':<25} {sum(f['requests'] for f in filas):>15,}\n")
+    return 0
+
+
+def podar_logs(args):
+    """Aplica la retención a logs_acceso y uso_por_hora (pensado para cron)"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(uso.DDL_USO_POR_HORA)
+        conn.commit()
+        
+        def escribir(query, params):
+            with conn.cursor() as cursor:
+                filas = cursor.execute(query, params)
+            conn.commit()
+            return filas
+        
+        borradas = uso.podar(escribir, pausa=args.pausa)
+        with conn.cursor() as cursor:
+            tokens_vencidos = tokens.purgar_vencidos(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    print(f"🧹 logs_acceso: {borradas['logs_acceso']} filas de más de "
+          f"{uso.USO_CONFIG['retencion_crudos_dias']} días")
+    print(f"🧹 uso_por_hora: {borradas['uso_por_hora']} filas de más de "
+          f"{uso.USO_CONFIG['retencion_uso_dias']} días")
+    print(f"🧹 tokens_clientes: {tokens_vencidos} tokens vencidos")
+    return 0
+
+
+def importar_maestro(args):
+    """Agrega al catálogo maestro los productos de una o más BDs de cliente"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(maestro.DDL_MAESTRO)
+            for origen in args.desde:
+                cursor.execute(maestro.sql_importar(origen))
+                print(f"📦 {origen}: {cursor.rowcount} productos nuevos en el maestro")
+                conn.commit()
+            cursor.execute(maestro.QUERY_FIRMA)
+            total = cursor.fetchone()['total']
+    finally:
+        conn.close()
+    print(f"\n✅ Catálogo maestro: {total} productos")
+    print("   Los workers lo ven en menos de MASTER_CATALOG_CHECK_INTERVAL segundos\n")
+    return 0
+
+
+def deduplicar_maestro(args):
+    """
+    Cuenta (o borra con --aplicar) las copias sin uso del maestro en cada cliente:
+    sin precio ni stock propios, con MASTER_CATALOG=1 se resuelven igual
+    """
+    conn = _conexion_hilo()
+    with conn.cursor() as cursor:
+        cursor.execute(maestro.DDL_MAESTRO)
+        query = f"SELECT id, subdominio, db_name FROM `{ADMIN_DB}`.clientes"
+        params = None
+        if args.cliente:
+            query += " WHERE subdominio = %s"
+            params = (args.cliente,)
+        cursor.execute(query + " ORDER BY id", params)
+        clientes = cursor.fetchall()
+    
+    accion = "Borrando" if args.aplicar else "Contando (simulación)"
+    print(f"\n🔍 {accion} copias sin uso del maestro en {len(clientes)} clientes...")
+    print("\n" + "=" * 60)
+    print(f"{'SUBDOMINIO':<25} {'REDUNDANTES':>15} {'ESTADO':<18}")
+    print("=" * 60)
+    total, ok = 0, True
+    for cliente in clientes:
+        try:
+            with conn.cursor() as cursor:
+                if args.aplicar:
+                    cursor.execute(maestro.sql_borrar_redundantes(cliente))
+                    filas = cursor.rowcount
+                else:
+                    cursor.execute(maestro.sql_contar_redundantes(cliente))
+                    filas = cursor.fetchone()['total']
+            conn.commit()
+            total += filas
+            print(f"{cliente['subdominio']:<25} {filas:>15,} {'✅':<18}")
+        except Exception as e:
+            conn.rollback()
+            ok = False
+            print(f"{cliente['subdominio']:<25} {'-':>15} {('❌ ' + str(e))[:18]:<18}")
+    print("=" * 60)
+    print(f"{'TOTAL':<25} {total:>15,}\n")
+    if not args.aplicar and total:
+        print("   Activá MASTER_CATALOG=1 en la app antes de borrar con --aplicar\n")
+    return 0 if ok else 1
+
+
+# Bloques de setup_database.sql que se generan desde esquema.py
+BLOQUE_ESQUEMA = re.compile(
+    r'(?P<inicio>-- >>> esquema\.py: (?P<db>\w+)\n)(?P<ddl>.*?)(?P<fin>-- <<< esquema\.py\n)', re.S
+)
+
+
+def esquema_sql(args):
+    """
+    Regenera en el archivo el DDL de los clientes de ejemplo desde esquema.py
+    Con --verificar no escribe: sale con 1 si el archivo quedó desactualizado
+    """
+    with open(args.archivo, encoding='utf-8') as f:
+        texto = f.read()
+    nuevo, bloques = BLOQUE_ESQUEMA.subn(
+        lambda m: m['inicio'] + esquema.script_cliente(m['db']) + m['fin'], texto
+    )
+    if not bloques:
+        print(f"❌ {args.archivo} no tiene bloques '-- >>> esquema.py: <bd>'")
+        return 1
+    if nuevo == texto:
+        print(f"✅ {args.archivo}: {bloques} bloques al día con esquema.py (versión {esquema.SCHEMA_VERSION})")
+        return 0
+    if args.verificar:
+        print(f"❌ {args.archivo} no coincide con esquema.py: python3 admin_cliente.py esquema-sql")
+        return 1
+    with open(args.archivo, 'w', encoding='utf-8') as f:
+        f.write(nuevo)
+    print(f"📝 {args.archivo}: {bloques} bloques regenerados desde esquema.py")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Administración de clientes de ComparApp")
+    sub = parser.add_subparsers(dest='comando')
+    
+    prov = sub.add_parser('provisionar', help="Alta masiva de clientes desde un CSV")
+    prov.add_argument('archivo', help="CSV con columnas nombre,subdominio")
+    prov.add_argument('--paralelo', type=int, default=4, help="Clientes en paralelo (default 4)")
+    prov.add_argument('--catalogo-maestro', help="BD desde la que copiar products (ej: cliente_demo)")
+    prov.add_argument('--salida', help="CSV donde guardar los tokens generados")
+    
+    mig = sub.add_parser('migrar', help="Aplicar migraciones de esquema a todos los clientes")
+    mig.add_argument('--paralelo', type=int, default=4, help="Clientes en paralelo (default 4)")
+    mig.add_argument('--cliente', help="Migrar solo este subdominio")
+    mig.add_argument('--dry-run', action='store_true', help="Solo mostrar migraciones pendientes")
+    
+    cons = sub.add_parser('consolidar', help="Mover clientes a la tabla products compartida")
+    cons.add_argument('--paralelo', type=int, default=4, help="Clientes en paralelo (default 4)")
+    cons.add_argument('--cliente', help="Consolidar solo este subdominio")
+    
+    rep = sub.add_parser('uso', help="Requests por cliente (desde las estadísticas por hora)")
+    rep.add_argument('--desde', help="YYYY-MM-DD")
+    rep.add_argument('--hasta', help="YYYY-MM-DD, inclusive (default: hoy)")
+    rep.add_argument('--dias', type=int, default=30, help="Días hacia atrás si no se indica --desde")
+    
+    tok = sub.add_parser('rotar-token', help="Emitir un token nuevo para un cliente")
+    tok.add_argument('cliente_id', type=int)
+    tok.add_argument('--gracia', type=int, help="Segundos de validez de los tokens anteriores "
+                                                "(default TOKEN_ROTATION_GRACE; 0 = revocar ya)")
+    
+    sub.add_parser('migrar-tokens', help="Pasar a hash los tokens guardados en texto plano")
+    
+    poda = sub.add_parser('podar-logs', help="Borrar logs_acceso y uso_por_hora fuera de la retención")
+    poda.add_argument('--pausa', type=float, default=0.2, help="Segundos entre lotes de borrado")
+    
+    mae = sub.add_parser('maestro-importar', help="Agregar productos de BDs de cliente al catálogo maestro")
+    mae.add_argument('desde', nargs='+', help="BDs de origen (ej: cliente_demo)")
+    
+    dedup = sub.add_parser('maestro-deduplicar',
+                           help="Copias del maestro sin precio ni stock en los clientes")
+    dedup.add_argument('--cliente', help="Solo este subdominio")
+    dedup.add_argument('--aplicar', action='store_true', help="Borrarlos (sin esto solo se cuentan)")
+    
+    esq = sub.add_parser('esquema-sql', help="Regenerar el DDL de setup_database.sql desde esquema.py")
+    esq.add_argument('archivo', nargs='?', default='setup_database.sql')
+    esq.add_argument('--verificar', action='store_true', help="Solo comprobar que esté al día")
+    
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.comando == 'provisionar':
+        sys.exit(provisionar_desde_archivo(args))
+    if args.comando == 'migrar':
+        sys.exit(migrar(args))
+    if args.comando == 'consolidar':
+        sys.exit(consolidar(args))
+    if args.comando == 'rotar-token':
+        cambiar_token(args.cliente_id, args.gracia)
+        sys.exit(0)
+    if args.comando == 'migrar-tokens':
+        asegurar_tokens()
+        sys.exit(0)
+    if args.comando == 'uso':
+        sys.exit(reporte_uso(args))
+    if args.comando == 'podar-logs':
+        sys.exit(podar_logs(args))
+    if args.comando == 'maestro-importar':
+        sys.exit(importar_maestro(args))
+    if args.comando == 'maestro-deduplicar':
+        sys.exit(deduplicar_maestro(args))
+    if args.comando == 'esquema-sql':
+        sys.exit(esquema_sql(args))
+    
     try:
         main()
     except KeyboardInterrupt:
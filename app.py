@@ -5,19 +5,40 @@ Backend Flask que imprime DIRECTAMENTE a impresora WiFi
 Compatible con iOS, Android, Safari, Chrome - TODOS
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
 from flask_cors import CORS
-import pymysql
 import uuid
 import os
 import socket
-from contextlib import contextmanager
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
 from typing import Dict, List, Optional, Any
 
+import cache
+import esquema
+import etiquetas
+import formatos
+import limites
+import maestro
+import perfil
+import repositorio
+import stock
+import tokens
+import uso
+from auth_middleware import (DB_CONFIG, VALID_TOKENS, admin, cliente_unico, repo_unico,
+                             repositorio_cliente, repositorio_de, requiere_auth)
+from catalogo import CATALOG_CONFIG, firma_catalogo, obtener_catalogo
+from limites import CONSULTA, PESADA, limitar, turno_pesado
+from etiquetas import ESCPOSCommands, generar_etiqueta, generar_etiquetas
+from trabajos import ColaTrabajos, PENDIENTE, IMPRIMIENDO, IMPRESO, ERROR, ENVIADA, CONFIRMADA, FALLIDA
+
 
 app = Flask(__name__)
 CORS(app)
+# Perfil por request: log de lentos y header Server-Timing (SERVER_TIMING=1)
+perfil.instalar(app, cliente=limites.clave_cliente)
 
 # Configuración de impresora WiFi
 PRINTER_CONFIG = {
@@ -26,128 +47,106 @@ PRINTER_CONFIG = {
     'timeout': 3
 }
 
-DB_CONFIG = {
-    'host': os.getenv("DB_HOST", "mariadb"),
-    'user': os.getenv("DB_USER", "unicenta"),
-    'password': os.getenv("DB_PASSWORD", "unicenta123"),
-    'database': os.getenv("DB_NAME", "unicentaopos"),
-    'port': int(os.getenv("DB_PORT", 3306)),
-    'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
-}
+# TTL de la cache compartida de productos (0 = desactivada)
+CACHE_PRODUCTOS_TTL = int(os.getenv("CACHE_PRODUCTOS_TTL", 0))
 
-VALID_TOKENS = {
-    'tk_prod_abc123def456ghi789jkl012mno345': {
-        'cliente': 'tienda1',
-        'nombre': 'Tienda Demo'
-    }
+# Segundos que se reutiliza la firma del catálogo para responder 304 sin ir a la BD
+CATALOG_VERSION_TTL = int(os.getenv("CATALOG_VERSION_TTL", 5))
+
+# Calentamiento del worker antes de aceptar tráfico (gunicorn post_worker_init)
+WARMUP_CONFIG = {
+    # Clientes más activos (uso_por_hora) cuyos pools se abren al arrancar; 0 = ninguno
+    'clientes': int(os.getenv("WARMUP_TENANTS", 0)),
+    'horas': int(os.getenv("WARMUP_TENANTS_HOURS", 24)),
+    'conexiones_cliente': int(os.getenv("WARMUP_TENANT_CONNECTIONS", 1)),
 }
 
+def invalidar_catalogos(config, clientes):
+    """Después de aplicar stock en la BD de config: las copias cacheadas de sus catálogos quedan viejas"""
+    if esquema.TENANCY_MODE == 'compartido':
+        destinos = {repositorio.destino(config, cliente) for cliente in clientes}
+    else:
+        destinos = {repositorio.destino(config)}
+    for destino in destinos:
+        cache.invalidar(f"catalogo:{destino}")
 
-def validate_token(token: str) -> bool:
-    """Valida si un token es válido"""
-    return token in VALID_TOKENS
+def bd_principal() -> repositorio.Repositorio:
+    """BD sin la que la app no atiende: la de productos en modo unico, comparapp_admin en los demás"""
+    return repo_unico if esquema.TENANCY_MODE == 'unico' else admin
 
-def require_auth(f):
-    """Decorador para rutas que requieren autenticación"""
-    from functools import wraps
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization', '')
-        
-        if not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Token no proporcionado'}), 401
-        
-        token = auth_header.replace('Bearer ', '').strip()
-        
-        if not validate_token(token):
-            return jsonify({'error': 'Token inválido o expirado'}), 401
-        
-        request.cliente_info = VALID_TOKENS[token]
-        return f(*args, **kwargs)
-    
-    return decorated_function
+def libro_stock():
+    """
+    Libro de stock de la BD del cliente autenticado: los escaneos van al libro
+    y un hilo por worker los aplica a stockunits
+    """
+    config = repositorio_cliente().config
+    return stock.libro_de(config, al_aplicar=partial(invalidar_catalogos, config))
 
+def catalogo_actual():
+    """
+    Catálogo en memoria de los datos del cliente autenticado, o None si el modo
+    snapshot está apagado. Va por destino: los clientes de una misma BD comparten copia
+    """
+    if not CATALOG_CONFIG['habilitado']:
+        return None
+    repo = repositorio_cliente()
+    return obtener_catalogo(repo.destino, repo.consultar, repo.tabla)
 
-@contextmanager
-def get_db_connection():
-    """Context manager para manejar conexiones a la base de datos"""
-    connection = pymysql.connect(**DB_CONFIG)
-    try:
-        yield connection
-    except Exception as e:
-        connection.rollback()
-        raise e
-    finally:
-        connection.close()
-
-def execute_query(query: str, params: tuple = None, fetch_one: bool = False) -> Any:
-    """Ejecuta una consulta SQL y retorna los resultados"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            return cursor.fetchone() if fetch_one else cursor.fetchall()
-
-def execute_update(query: str, params: tuple = None) -> bool:
-    """Ejecuta una consulta de actualización (INSERT, UPDATE, DELETE)"""
+def espacio_catalogo() -> str:
+    """Espacio de cache del catálogo del cliente autenticado (por destino, como el snapshot)"""
+    return f"catalogo:{repositorio_cliente().destino}"
+
+def version_catalogo() -> str:
+    """
+    Versión del catálogo del cliente (firma de la tabla products)
+    Se cachea CATALOG_VERSION_TTL segundos y se invalida con cada guardado/borrado
+    """
+    repo = repositorio_cliente()
+    calcular = lambda: '%d-%d' % firma_catalogo(repo.consultar, repo.tabla)
+    if CATALOG_VERSION_TTL <= 0:
+        return calcular()
+    return cache.obtener_o_calcular(espacio_catalogo(), 'version', calcular, ttl=CATALOG_VERSION_TTL)
+
+def config_impresora() -> Dict:
+    """
+    Configuración de impresora vigente
+    Los cambios hechos vía /api/imprimir/config viven en la cache, así todos
+    los workers imprimen a la misma impresora cuando la cache es compartida
+    """
+    config = dict(PRINTER_CONFIG)
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query, params)
-            conn.commit()
-        return True
+        guardada = cache.obtener('impresora', 'config')
+        if guardada:
+            config.update(guardada)
     except Exception as e:
-        print(f"❌ Error en execute_update: {str(e)}")
-        return False
+        print(f"⚠️  Error al leer config de impresora: {e}")
+    return config
 
 # ============================================
 # SISTEMA DE IMPRESIÓN WIFI/RED
 # ============================================
 
-class ESCPOSCommands:
-    """Comandos ESC/POS para impresoras térmicas"""
-    
-    INIT = b'\x1b\x40'
-    LINE_FEED = b'\x0a'
-    CUT_PAPER = b'\x1d\x56\x41\x00'
-    
-    ALIGN_LEFT = b'\x1b\x61\x00'
-    ALIGN_CENTER = b'\x1b\x61\x01'
-    ALIGN_RIGHT = b'\x1b\x61\x02'
-    
-    TEXT_NORMAL = b'\x1d\x21\x00'
-    TEXT_DOUBLE_HEIGHT = b'\x1d\x21\x01'
-    TEXT_DOUBLE_WIDTH = b'\x1d\x21\x10'
-    TEXT_DOUBLE_BOTH = b'\x1d\x21\x11'
-    TEXT_LARGE = b'\x1d\x21\x22'
-    
-    BOLD_ON = b'\x1b\x45\x01'
-    BOLD_OFF = b'\x1b\x45\x00'
-    
-    BARCODE_HEIGHT = b'\x1d\x68\x50'
-    BARCODE_WIDTH = b'\x1d\x77\x02'
-    BARCODE_TEXT_BELOW = b'\x1d\x48\x02'
-    BARCODE_EAN13 = b'\x1d\x6b\x43'
-
-
 def enviar_a_impresora(comandos: bytes) -> tuple:
     """
     Envía comandos ESC/POS a impresora WiFi
     Retorna (success: bool, message: str)
     """
     try:
-        # Crear socket TCP
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(PRINTER_CONFIG['timeout'])
-        
-        # Conectar a impresora
-        sock.connect((PRINTER_CONFIG['ip'], PRINTER_CONFIG['port']))
+        config = config_impresora()
         
-        # Enviar comandos
-        sock.sendall(comandos)
-        
-        # Cerrar conexión
-        sock.close()
+        with perfil.medir('print'):
+            # Crear socket TCP
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(config['timeout'])
+            
+            # Conectar a impresora
+            sock.connect((config['ip'], config['port']))
+            
+            # Enviar comandos
+            sock.sendall(comandos)
+            
+            # Cerrar conexión
+            sock.close()
         
         return True, "Impresión exitosa"
         
@@ -159,81 +158,91 @@ def enviar_a_impresora(comandos: bytes) -> tuple:
         return False, f"Error inesperado: {str(e)}"
 
 
-def generar_etiqueta_producto(producto: Dict) -> bytes:
+# Registro de trabajos de impresión (SQLite compartido por los workers);
+# se abre en cada worker la primera vez que se usa, nunca en el master
+_cola_trabajos = None
+_cola_lock = threading.Lock()
+
+def cola_trabajos() -> ColaTrabajos:
+    global _cola_trabajos
+    if _cola_trabajos is None:
+        with _cola_lock:
+            if _cola_trabajos is None:
+                _cola_trabajos = ColaTrabajos()
+    return _cola_trabajos
+
+def imprimir_trabajo(trabajo_id: str) -> Dict:
     """
-    Genera comandos ESC/POS para imprimir etiqueta de producto
-    Optimizado para impresoras de 58mm
+    Envía a la impresora WiFi las etiquetas del trabajo que falten, de a una
+    por la misma conexión, registrando el estado de cada etiqueta
+    Los lotes grandes se renderizan en paralelo mientras se van enviando
+    Retorna el trabajo actualizado
     """
-    cmd = bytearray()
-    
-    # Inicializar
-    cmd.extend(ESCPOSCommands.INIT)
-    
-    # Título centrado
-    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
-    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
-    cmd.extend(ESCPOSCommands.BOLD_ON)
-    cmd.extend("ETIQUETA DE PRECIO\n".encode('utf-8'))
-    cmd.extend(ESCPOSCommands.BOLD_OFF)
-    cmd.extend(ESCPOSCommands.LINE_FEED)
-    
-    # Nombre del producto
-    nombre = producto.get('name', 'Sin nombre')[:28]
-    cmd.extend(ESCPOSCommands.ALIGN_LEFT)
-    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
-    cmd.extend(f"{nombre}\n".encode('utf-8'))
-    cmd.extend(ESCPOSCommands.LINE_FEED)
+    cola = cola_trabajos()
+    if not cola.tomar(trabajo_id, os.getpid()):
+        return cola.obtener(trabajo_id)
     
-    # Precio grande
-    precio = float(producto.get('pricesell', 0))
-    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
-    cmd.extend(ESCPOSCommands.TEXT_LARGE)
-    cmd.extend(ESCPOSCommands.BOLD_ON)
-    cmd.extend(f"$ {precio:,.2f}\n".encode('utf-8'))
-    cmd.extend(ESCPOSCommands.BOLD_OFF)
-    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
-    cmd.extend(ESCPOSCommands.LINE_FEED)
-    
-    # Código de barras
-    codigo = producto.get('code', '')
-    if codigo and len(codigo) in [12, 13]:
-        cmd.extend(ESCPOSCommands.ALIGN_CENTER)
-        cmd.extend(ESCPOSCommands.BARCODE_HEIGHT)
-        cmd.extend(ESCPOSCommands.BARCODE_WIDTH)
-        cmd.extend(ESCPOSCommands.BARCODE_TEXT_BELOW)
-        
-        if len(codigo) == 12:
-            codigo = '0' + codigo
-        
-        cmd.extend(ESCPOSCommands.BARCODE_EAN13)
-        cmd.extend(bytes([len(codigo)]))
-        cmd.extend(codigo.encode('ascii'))
-        cmd.extend(ESCPOSCommands.LINE_FEED)
-    else:
-        cmd.extend(ESCPOSCommands.ALIGN_CENTER)
-        cmd.extend(f"COD: {codigo}\n".encode('utf-8'))
-    
-    cmd.extend(ESCPOSCommands.LINE_FEED)
-    
-    # Fecha
-    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
-    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
-    fecha = datetime.now().strftime('%d/%m/%Y %H:%M')
-    cmd.extend(f"{fecha}\n".encode('utf-8'))
-    
-    # Saltos y corte
-    cmd.extend(ESCPOSCommands.LINE_FEED * 3)
-    cmd.extend(ESCPOSCommands.CUT_PAPER)
+    config = config_impresora()
+    error = None
+    try:
+        with perfil.medir('print'):
+            sock = socket.create_connection((config['ip'], config['port']), timeout=config['timeout'])
+        try:
+            pendientes = cola.etiquetas_pendientes(trabajo_id)
+            renderizadas = generar_etiquetas(producto for _, producto in pendientes)
+            for n, _ in pendientes:
+                with perfil.medir('render'):
+                    comandos = next(renderizadas)
+                cola.marcar_etiqueta(trabajo_id, n, ENVIADA)
+                try:
+                    with perfil.medir('print'):
+                        sock.sendall(comandos)
+                except Exception as e:
+                    cola.marcar_etiqueta(trabajo_id, n, FALLIDA, str(e))
+                    raise
+                cola.marcar_etiqueta(trabajo_id, n, CONFIRMADA)
+        finally:
+            sock.close()
+    except socket.timeout:
+        error = "Timeout: No se pudo conectar a la impresora"
+    except socket.error as e:
+        error = f"Error de conexión: {str(e)}"
+    except Exception as e:
+        error = f"Error inesperado: {str(e)}"
     
-    return bytes(cmd)
+    return cola.finalizar(trabajo_id, error)
+
+def reanudar_trabajos():
+    """Termina los trabajos que un worker caído dejó a medias (solo etiquetas faltantes)"""
+    for trabajo_id in cola_trabajos().recuperar():
+        trabajo = imprimir_trabajo(trabajo_id)
+        print(f"🖨️  Trabajo {trabajo_id} reanudado: {trabajo['estado']}")
 
+def respuesta_trabajo(trabajo: Dict, cantidad: int = None):
+    """Respuesta HTTP según el estado del trabajo"""
+    cuerpo = {
+        'success': trabajo['estado'] == IMPRESO,
+        'trabajo_id': trabajo['id'],
+        'estado': trabajo['estado'],
+        'etiquetas': trabajo['etiquetas'],
+        'cantidad': cantidad if cantidad is not None else trabajo['total_etiquetas']
+    }
+    if trabajo['estado'] == IMPRESO:
+        cuerpo['mensaje'] = f"{cuerpo['cantidad']} etiquetas impresas"
+        return jsonify(cuerpo)
+    if trabajo['estado'] in (IMPRIMIENDO, PENDIENTE):
+        cuerpo['error'] = 'El trabajo se está imprimiendo'
+        return jsonify(cuerpo), 409
+    cuerpo['error'] = trabajo['error']
+    return jsonify(cuerpo), 500
 
 # ============================================
 # RUTAS DE IMPRESIÓN
 # ============================================
 
 @app.route('/api/imprimir/etiqueta', methods=['POST'])
-@require_auth
+@requiere_auth
+@limitar(CONSULTA)
 def imprimir_etiqueta():
     """
     Imprime etiqueta directamente en impresora WiFi
@@ -256,13 +265,7 @@ def imprimir_etiqueta():
         
         # Opción 1: Buscar producto por código
         if data.get('codigo'):
-            query = """
-                SELECT code, name, pricesell, codetype
-                FROM products 
-                WHERE code = %s
-                LIMIT 1
-            """
-            producto = execute_query(query, (data['codigo'],), fetch_one=True)
+            producto = repositorio_cliente().por_codigo(data['codigo'])
             
             if not producto:
                 return jsonify({
@@ -279,8 +282,9 @@ def imprimir_etiqueta():
                 'error': 'Debe proporcionar código o datos del producto'
             }), 400
         
-        # Generar comandos
-        comandos = generar_etiqueta_producto(producto)
+        # Generar comandos (texto o raster según LABEL_MODE)
+        with perfil.medir('render'):
+            comandos = generar_etiqueta({**producto, 'cliente': g.cliente['subdominio']})
         
         # IMPRIMIR DIRECTAMENTE
         success, mensaje = enviar_a_impresora(comandos)
@@ -307,7 +311,9 @@ def imprimir_etiqueta():
 
 
 @app.route('/api/imprimir/lote', methods=['POST'])
-@require_auth
+@requiere_auth
+@limitar(PESADA)
+@turno_pesado(costo=lambda: len((request.json or {}).get('codigos', [])))
 def imprimir_lote():
     """
     Imprime múltiples etiquetas
@@ -316,6 +322,8 @@ def imprimir_lote():
     {
         "codigos": ["7790001234567", "7790001234568"]
     }
+    Header opcional Idempotency-Key: reenviar el mismo lote con la misma clave
+    no lo duplica; si se cortó a mitad, se imprimen solo las etiquetas faltantes
     """
     try:
         data = request.json
@@ -327,14 +335,19 @@ def imprimir_lote():
                 'error': 'Debe proporcionar al menos un código'
             }), 400
         
+        cola = cola_trabajos()
+        clave = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        if clave:
+            clave = f"{g.cliente['subdominio']}:{clave}"
+        
         # Buscar productos
-        placeholders = ','.join(['%s'] * len(codigos))
-        query = f"""
-            SELECT code, name, pricesell, codetype
-            FROM products 
-            WHERE code IN ({placeholders})
-        """
-        productos = execute_query(query, tuple(codigos))
+        productos = [{
+            'code': p['code'],
+            'name': p['name'],
+            'codetype': p['codetype'],
+            'pricesell': float(p['pricesell']) if p['pricesell'] else 0,
+            'cliente': g.cliente['subdominio']
+        } for p in repositorio_cliente().por_codigos(codigos)]
         
         if not productos:
             return jsonify({
@@ -342,36 +355,48 @@ def imprimir_lote():
                 'error': 'No se encontraron productos'
             }), 404
         
-        # Generar todas las etiquetas
-        comandos_total = bytearray()
-        for producto in productos:
-            comandos_total.extend(generar_etiqueta_producto(producto))
+        config = config_impresora()
+        trabajo, nuevo = cola.encolar(f"tcp:{config['ip']}:{config['port']}", productos, 1, clave)
+        if not nuevo and trabajo['estado'] == ERROR:
+            cola.reintentar(trabajo['id'])
+        if nuevo or trabajo['estado'] == ERROR:
+            trabajo = imprimir_trabajo(trabajo['id'])
         
-        # Imprimir todo
-        success, mensaje = enviar_a_impresora(bytes(comandos_total))
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'mensaje': f'{len(productos)} etiquetas impresas',
-                'cantidad': len(productos)
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': mensaje
-            }), 500
+        return respuesta_trabajo(trabajo)
         
     except Exception as e:
         print(f"❌ Error en imprimir_lote: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/imprimir/trabajos/<trabajo_id>', methods=['GET'])
+@requiere_auth
+def estado_trabajo(trabajo_id: str):
+    """Estado de un trabajo de impresión y de sus etiquetas"""
+    trabajo = cola_trabajos().obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'trabajo': trabajo})
+
+
+@app.route('/api/imprimir/trabajos/<trabajo_id>/reintentar', methods=['POST'])
+@requiere_auth
+def reintentar_trabajo(trabajo_id: str):
+    """Reimprime solo las etiquetas que no se confirmaron"""
+    cola = cola_trabajos()
+    if not cola.obtener(trabajo_id):
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    cola.reintentar(trabajo_id)
+    return respuesta_trabajo(imprimir_trabajo(trabajo_id))
+
+
 @app.route('/api/imprimir/test', methods=['GET'])
-@require_auth
+@requiere_auth
 def test_impresora():
     """Test de conexión con la impresora"""
     try:
+        config = config_impresora()
+        
         # Página de prueba simple
         cmd = bytearray()
         cmd.extend(ESCPOSCommands.INIT)
@@ -380,7 +405,7 @@ def test_impresora():
         cmd.extend("TEST OK\n".encode('utf-8'))
         cmd.extend(ESCPOSCommands.TEXT_NORMAL)
         cmd.extend(ESCPOSCommands.LINE_FEED)
-        cmd.extend(f"IP: {PRINTER_CONFIG['ip']}\n".encode('utf-8'))
+        cmd.extend(f"IP: {config['ip']}\n".encode('utf-8'))
         cmd.extend(f"{datetime.now().strftime('%d/%m/%Y %H:%M')}\n".encode('utf-8'))
         cmd.extend(ESCPOSCommands.LINE_FEED * 3)
         cmd.extend(ESCPOSCommands.CUT_PAPER)
@@ -391,8 +416,8 @@ def test_impresora():
             'success': success,
             'mensaje': mensaje,
             'impresora': {
-                'ip': PRINTER_CONFIG['ip'],
-                'port': PRINTER_CONFIG['port']
+                'ip': config['ip'],
+                'port': config['port']
             }
         })
         
@@ -404,26 +429,30 @@ def test_impresora():
 
 
 @app.route('/api/imprimir/config', methods=['GET', 'POST'])
-@require_auth
+@requiere_auth
 def configurar_impresora():
     """Obtener o actualizar configuración de impresora"""
+    config = config_impresora()
     if request.method == 'GET':
         return jsonify({
-            'ip': PRINTER_CONFIG['ip'],
-            'port': PRINTER_CONFIG['port'],
-            'timeout': PRINTER_CONFIG['timeout']
+            'ip': config['ip'],
+            'port': config['port'],
+            'timeout': config['timeout']
         })
     else:
         data = request.json
         if data.get('ip'):
-            PRINTER_CONFIG['ip'] = data['ip']
+            config['ip'] = data['ip']
         if data.get('port'):
-            PRINTER_CONFIG['port'] = int(data['port'])
+            config['port'] = int(data['port'])
+        
+        PRINTER_CONFIG.update(config)
+        cache.guardar('impresora', 'config', config, ttl=0)
         
         return jsonify({
             'success': True,
             'mensaje': 'Configuración actualizada',
-            'config': PRINTER_CONFIG
+            'config': config
         })
 
 
@@ -438,19 +467,18 @@ def index():
 @app.route('/health')
 def health():
     try:
-        version_query = 'SELECT VERSION() as version'
-        result = execute_query(version_query, fetch_one=True)
+        db_version = bd_principal().version_servidor()
         db_status = 'connected'
-        db_version = result['version']
     except Exception as e:
         db_status = 'disconnected'
         db_version = str(e)
     
     # Test impresora
+    config = config_impresora()
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(1)
-        sock.connect((PRINTER_CONFIG['ip'], PRINTER_CONFIG['port']))
+        sock.connect((config['ip'], config['port']))
         sock.close()
         printer_status = 'connected'
     except:
@@ -461,24 +489,18 @@ def health():
         'database': db_status,
         'db_version': db_version,
         'printer': printer_status,
-        'printer_ip': PRINTER_CONFIG['ip'],
+        'printer_ip': config['ip'],
         'timestamp': datetime.now().isoformat()
     })
 
-@app.route('/api/productos', methods=['GET'])
-@require_auth
-def listar_productos():
-    try:
-        query = """
-            SELECT id, reference, code, codetype, name, pricebuy, 
-                   pricesell, stockunits, category, supplier
-            FROM products 
-            ORDER BY name ASC
-            LIMIT 1000
-        """
-        productos = execute_query(query)
-        
-        return jsonify({
+COLUMNAS_LISTADO = ('id', 'code', 'codetype', 'reference', 'name', 'pricebuy',
+                    'pricesell', 'stockunits', 'category', 'supplier')
+COLUMNAS_NUMERICAS = ('pricebuy', 'pricesell', 'stockunits')
+
+def serializar_listado(productos, formato: str) -> bytes:
+    """Serializa el listado de productos en el formato negociado"""
+    if formato == formatos.FORMATO_JSON:
+        cuerpo = {
             'success': True,
             'productos': [{
                 'id': p['id'],
@@ -492,26 +514,107 @@ def listar_productos():
                 'category': p['category'],
                 'supplier': p['supplier']
             } for p in productos]
-        })
+        }
+    else:
+        cuerpo = {'success': True, **formatos.columnar(productos, COLUMNAS_LISTADO, COLUMNAS_NUMERICAS)}
+    return formatos.serializar(cuerpo, formato)
+
+@app.route('/api/productos', methods=['GET'])
+@requiere_auth
+@limitar(PESADA)
+def listar_productos():
+    """
+    Lista hasta 1000 productos ordenados por nombre
+    Formatos: JSON (default), ?formato=columnar o ?formato=msgpack (o vía Accept)
+    """
+    try:
+        formato = formatos.negociar_formato()
+        catalogo = catalogo_actual()
+        if catalogo:
+            # El snapshot es inmutable: se serializa una sola vez por formato
+            snapshot = catalogo.vigente()
+            cuerpo = snapshot.serializados.get(formato)
+            if cuerpo is None:
+                cuerpo = serializar_listado(snapshot.productos[:1000], formato)
+                snapshot.serializados[formato] = cuerpo
+            return formatos.respuesta(cuerpo, formato)
+        
+        # Sin snapshot: se compara la versión del catálogo antes de leer las filas
+        etag = formatos.etag_de(g.cliente['subdominio'], version_catalogo(), formato)
+        no_modificado = formatos.no_modificado(etag)
+        if no_modificado:
+            return no_modificado
+        
+        cuerpo = serializar_listado(repositorio_cliente().listar(1000), formato)
+        return formatos.respuesta(cuerpo, formato, etag)
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+COLUMNAS_EXPORT = ('id', 'code', 'reference', 'codetype', 'name',
+                   'pricebuy', 'pricesell', 'stockunits')
+
+@app.route('/api/catalogo/export', methods=['GET'])
+@requiere_auth
+@limitar(PESADA)
+def exportar_catalogo():
+    """
+    Catálogo completo en formato columnar para la copia offline del escáner
+    Responde 304 si el ETag enviado en If-None-Match sigue vigente
+    """
+    try:
+        formato = formatos.negociar_formato()
+        if formato == formatos.FORMATO_JSON:
+            formato = formatos.FORMATO_COLUMNAR
+        
+        catalogo = catalogo_actual()
+        if catalogo:
+            snapshot = catalogo.vigente()
+            cuerpo = snapshot.serializados.get(('export', formato))
+            if cuerpo is None:
+                cuerpo = formatos.serializar({
+                    'success': True,
+                    **formatos.columnar(snapshot.productos, COLUMNAS_EXPORT, COLUMNAS_NUMERICAS)
+                }, formato)
+                snapshot.serializados[('export', formato)] = cuerpo
+            return formatos.respuesta(cuerpo, formato)
+        
+        etag = formatos.etag_de(g.cliente['subdominio'], version_catalogo(), 'export', formato)
+        no_modificado = formatos.no_modificado(etag)
+        if no_modificado:
+            return no_modificado
+        
+        cuerpo = formatos.serializar({
+            'success': True,
+            **formatos.columnar(repositorio_cliente().exportar(COLUMNAS_EXPORT), COLUMNAS_EXPORT, COLUMNAS_NUMERICAS)
+        }, formato)
+        return formatos.respuesta(cuerpo, formato, etag)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/producto/<codigo>', methods=['GET'])
-@require_auth
+@requiere_auth
+@limitar(CONSULTA)
 def obtener_producto(codigo: str):
     try:
-        query = """
-            SELECT id, reference, code, codetype, name, pricebuy, pricesell, 
-                   category, taxcat, stockunits, supplier, texttip, warranty
-            FROM products 
-            WHERE code = %s OR reference = %s
-            LIMIT 1
-        """
-        producto = execute_query(query, (codigo, codigo), fetch_one=True)
+        catalogo = catalogo_actual()
+        if catalogo:
+            producto = catalogo.obtener(codigo)
+        elif CACHE_PRODUCTOS_TTL:
+            # {} cachea también los códigos inexistentes
+            producto = cache.obtener_o_calcular(
+                espacio_catalogo(), codigo,
+                lambda: repositorio_cliente().buscar(codigo) or {},
+                ttl=CACHE_PRODUCTOS_TTL
+            ) or None
+        else:
+            producto = repositorio_cliente().buscar(codigo)
+        # Lo que la tienda no cargó se resuelve contra el catálogo maestro (MASTER_CATALOG=1)
+        producto = maestro.resolver(codigo, producto, admin.consultar)
         
         if producto:
-            return jsonify({
+            return formatos.condicional(jsonify({
                 'encontrado': True,
                 'producto': {
                     'id': producto['id'],
@@ -521,21 +624,91 @@ def obtener_producto(codigo: str):
                     'name': producto['name'],
                     'pricebuy': float(producto['pricebuy']) if producto['pricebuy'] else 0,
                     'pricesell': float(producto['pricesell']) if producto['pricesell'] else 0,
-                    'stockunits': float(producto['stockunits']) if producto['stockunits'] else 0
+                    'stockunits': float(producto['stockunits']) if producto['stockunits'] else 0,
+                    'maestro': bool(producto.get('maestro'))
                 }
-            })
+            }))
         else:
             return jsonify({'encontrado': False}), 404
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Máximo de códigos por consulta en lote
+LOTE_MAXIMO = int(os.getenv("LOOKUP_BATCH_MAX", 500))
+
+@app.route('/api/productos/lote', methods=['POST'])
+@requiere_auth
+@limitar(PESADA)
+@turno_pesado(costo=lambda: len((request.json or {}).get('codigos', [])))
+def buscar_productos_lote():
+    """
+    Resuelve muchos códigos en un solo request (sesiones de auditoría)
+    
+    Body JSON:
+    {
+        "codigos": ["7790895000010", "PAN-LAC"]
+    }
+    Respuesta: {"productos": {"<codigo>": {...} | null}}
+    """
+    try:
+        data = request.json or {}
+        codigos = list(dict.fromkeys(str(c) for c in data.get('codigos', []) if c))
+        
+        if not codigos:
+            return jsonify({
+                'success': False,
+                'error': 'Debe proporcionar al menos un código'
+            }), 400
+        if len(codigos) > LOTE_MAXIMO:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo {LOTE_MAXIMO} códigos por consulta'
+            }), 400
+        
+        catalogo = catalogo_actual()
+        if catalogo:
+            encontrados = {c: catalogo.obtener(c) for c in codigos}
+        else:
+            encontrados = repositorio_cliente().buscar_lote(codigos)
+        encontrados = {c: maestro.resolver(c, p, admin.consultar) for c, p in encontrados.items()}
+        
+        return jsonify({
+            'success': True,
+            'productos': {
+                codigo: {
+                    'id': p['id'],
+                    'code': p['code'],
+                    'codetype': p['codetype'],
+                    'reference': p['reference'],
+                    'name': p['name'],
+                    'pricebuy': float(p['pricebuy']) if p['pricebuy'] else 0,
+                    'pricesell': float(p['pricesell']) if p['pricesell'] else 0,
+                    'stockunits': float(p['stockunits']) if p['stockunits'] else 0,
+                    'maestro': bool(p.get('maestro'))
+                } if p else None
+                for codigo, p in encontrados.items()
+            }
+        })
+        
+    except Exception as e:
+        print(f"❌ Error en buscar_productos_lote: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/producto', methods=['POST'])
-@require_auth
+@requiere_auth
+@limitar(CONSULTA)
 def guardar_producto():
     try:
         data = request.json
         
+        if data.get('code') and not data.get('name'):
+            # Un producto del maestro se puede dar de alta con solo el precio
+            del_maestro = maestro.resolver(data['code'], None, admin.consultar)
+            if del_maestro:
+                data['name'] = del_maestro['name']
+                data['reference'] = data.get('reference') or del_maestro['reference']
+        
         if not data.get('code') or not data.get('name'):
             return jsonify({
                 'success': False,
@@ -552,28 +725,36 @@ def guardar_producto():
         
         reference = data.get('reference', '').strip() or data['code']
         
-        check_query = 'SELECT id FROM products WHERE code = %s'
-        existe = execute_query(check_query, (data['code'],), fetch_one=True)
+        existe = repositorio_cliente().precio_actual(data['code'])
         
-        if existe:
-            update_query = """
-                UPDATE products 
-                SET reference=%s, name=%s, pricebuy=%s, pricesell=%s
-                WHERE code=%s
-            """
-            params = (reference, data['name'], pricebuy, pricesell, data['code'])
-        else:
-            new_id = str(uuid.uuid4())
-            update_query = """
-                INSERT INTO products 
-                (id, reference, code, name, pricebuy, pricesell)
-                VALUES (%s,%s,%s,%s,%s,%s)
-            """
-            params = (new_id, reference, data['code'], data['name'], pricebuy, pricesell)
+        # Detección de conflictos: el cliente (p. ej. una edición hecha sin
+        # conexión) informa el precio que vio; si cambió en el medio, no pisa
+        if existe and data.get('pricesell_anterior') is not None:
+            actual = float(existe['pricesell'] or 0)
+            if abs(actual - float(data['pricesell_anterior'])) > 0.005:
+                return jsonify({
+                    'success': False,
+                    'conflicto': True,
+                    'error': 'El precio fue modificado por otro usuario',
+                    'pricesell_actual': actual
+                }), 409
         
-        success = execute_update(update_query, params)
+        try:
+            if existe:
+                repositorio_cliente().actualizar(data['code'], reference, data['name'], pricebuy, pricesell)
+            else:
+                repositorio_cliente().insertar(str(uuid.uuid4()), reference, data['code'], data['name'],
+                              pricebuy, pricesell)
+            success = True
+        except Exception as e:
+            print(f"❌ Error al guardar producto: {str(e)}")
+            success = False
         
         if success:
+            cache.invalidar(espacio_catalogo())
+            catalogo = catalogo_actual()
+            if catalogo:
+                catalogo.aplicar_guardado(data['code'])
             return jsonify({'success': True, 'pricesell': pricesell})
         else:
             return jsonify({'success': False, 'error': 'Error al guardar'}), 500
@@ -582,21 +763,30 @@ def guardar_producto():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/producto/<codigo>', methods=['DELETE'])
-@require_auth
+@requiere_auth
+@limitar(CONSULTA)
 def eliminar_producto(codigo: str):
     try:
-        query = 'DELETE FROM products WHERE code = %s'
-        success = execute_update(query, (codigo,))
+        try:
+            repositorio_cliente().eliminar(codigo)
+            success = True
+        except Exception as e:
+            print(f"❌ Error al eliminar producto: {str(e)}")
+            success = False
+        if success:
+            cache.invalidar(espacio_catalogo())
+        catalogo = catalogo_actual()
+        if success and catalogo:
+            catalogo.aplicar_borrado(codigo)
         return jsonify({'success': success})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/categorias', methods=['GET'])
-@require_auth
+@requiere_auth
 def obtener_categorias():
     try:
-        query = 'SELECT id, name FROM categories ORDER BY name'
-        categorias = execute_query(query)
+        categorias = repositorio_cliente().categorias()
         if categorias:
             return jsonify([{'id': c['id'], 'name': c['name']} for c in categorias])
         else:
@@ -608,32 +798,258 @@ def obtener_categorias():
     except:
         return jsonify([{'id': '000', 'name': 'General'}])
 
+@app.route('/api/db/estadisticas', methods=['GET'])
+@requiere_auth
+def estadisticas_db():
+    """Estado de los pools y tiempos por sentencia de este worker"""
+    return jsonify({
+        'pools': repositorio.estado_pools(),
+        'consultas': repositorio.estadisticas(),
+        'maestro': maestro.obtener_indice(admin.consultar).estado() if maestro.MAESTRO_CONFIG['habilitado'] else None
+    })
+
 # ============================================
-# INICIALIZACIÓN
+# CONTEO DE STOCK
 # ============================================
 
-def print_startup_info():
-    print("=" * 70)
-    print("🚀 SISTEMA DE GESTIÓN - IMPRESIÓN WIFI UNIVERSAL")
-    print("=" * 70)
-    print(f"📍 Base de datos: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
-    print(f"🖨️  Impresora WiFi: {PRINTER_CONFIG['ip']}:{PRINTER_CONFIG['port']}")
+@app.route('/api/stock/escaneo', methods=['POST'])
+@requiere_auth
+@limitar(CONSULTA)
+def escanear_stock():
+    """
+    Registra movimientos de stock; stockunits se actualiza en segundo plano
     
+    Body JSON:
+    {
+        "codigo": "7790895000010",
+        "cantidad": 1,              // default 1; negativo para descontar
+        "clave": "uuid-del-escaneo", // opcional: un reenvío con la misma clave no suma dos veces
+        "dispositivo": "escaner-3"   // opcional
+    }
+    O, para sincronizar un escáner que contó sin conexión:
+    {
+        "movimientos": [{"codigo": "...", "cantidad": 6, "clave": "..."}, ...],
+        "dispositivo": "escaner-3"
+    }
+    """
     try:
-        count_query = 'SELECT COUNT(*) as total FROM products'
-        result = execute_query(count_query, fetch_one=True)
-        print(f"✅ BD: {result['total']} productos")
+        data = request.json or {}
+        crudos = data.get('movimientos')
+        individual = crudos is None
+        if individual:
+            crudos = [data]
+        if not isinstance(crudos, list) or not crudos:
+            return jsonify({
+                'success': False,
+                'error': 'Debe proporcionar un código o una lista de movimientos'
+            }), 400
+        
+        catalogo = catalogo_actual()
+        if catalogo:
+            buscar_lote = lambda codigos: {c: catalogo.obtener(c) for c in codigos}
+        else:
+            buscar_lote = repositorio_cliente().buscar_lote
+        
+        try:
+            movimientos, no_encontrados = stock.resolver_movimientos(crudos, buscar_lote)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if individual and no_encontrados:
+            return jsonify({'success': False, 'error': 'Producto no encontrado'}), 404
+        
+        dispositivo = str(data['dispositivo'])[:64] if data.get('dispositivo') else None
+        nuevos = libro_stock().registrar(movimientos, g.cliente['subdominio'], dispositivo)
+        
+        return jsonify({
+            'success': True,
+            'registrados': nuevos,
+            'duplicados': len(movimientos) - nuevos,
+            'no_encontrados': no_encontrados
+        })
+        
+    except Exception as e:
+        print(f"❌ Error en escanear_stock: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/stock/<codigo>', methods=['GET'])
+@requiere_auth
+@limitar(CONSULTA)
+def consultar_stock(codigo: str):
+    """Stock aplicado más los movimientos que el agregador todavía no sumó"""
+    try:
+        producto = repositorio_cliente().buscar(codigo)
+        if not producto:
+            return jsonify({'encontrado': False}), 404
+        
+        aplicado = float(producto['stockunits']) if producto['stockunits'] else 0
+        pendiente = libro_stock().pendiente(producto['id'])
+        return jsonify({
+            'encontrado': True,
+            'code': producto['code'],
+            'name': producto['name'],
+            'stockunits': aplicado,
+            'pendiente': pendiente,
+            'stock_estimado': round(aplicado + pendiente, 3)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stock/estado', methods=['GET'])
+@requiere_auth
+def estado_stock():
+    """Movimientos pendientes y métricas del agregador de este worker"""
+    return jsonify(libro_stock().estado())
+
+@app.route('/api/limites/estadisticas', methods=['GET'])
+@requiere_auth
+def estadisticas_limites():
+    """Requests permitidos/rechazados por presupuesto y cola de trabajos pesados de este worker"""
+    return jsonify(limites.estadisticas())
+
+@app.route('/api/uso', methods=['GET'])
+@requiere_auth
+def uso_cliente():
+    """
+    Requests del cliente del subdominio, desde las estadísticas por hora
+    Query: ?desde=2024-05-01&hasta=2024-05-31&agrupar=dia|hora|endpoint
+    (default: últimos 7 días por día)
+    """
+    if esquema.TENANCY_MODE == 'unico':
+        # Sin comparapp_admin no hay uso_por_hora que consultar
+        return jsonify({'success': False,
+                        'error': 'Estadísticas de uso no disponibles con TENANCY_MODE=unico'}), 404
+    try:
+        desde, hasta = uso.rango(request.args.get('desde'), request.args.get('hasta'))
+        agrupar = request.args.get('agrupar', 'dia')
+        filas = uso.reporte(admin.consultar, g.cliente_id, desde, hasta, agrupar)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({
+        'success': True,
+        'cliente': g.cliente['subdominio'],
+        'desde': desde.date().isoformat(),
+        'hasta': (hasta - timedelta(days=1)).date().isoformat(),
+        'agrupar': agrupar,
+        'total': sum(f['requests'] for f in filas),
+        'filas': [{**f, 'periodo': str(f['periodo'])} if 'periodo' in f else f for f in filas]
+    })
+
+# ============================================
+# INICIALIZACIÓN
+# ============================================
+
+def reiniciar_conexiones():
+    """Después de un fork: pools, cliente de cache y registro de trabajos propios de cada worker"""
+    global _cola_trabajos
+    repositorio.cerrar_todos()
+    cache.reiniciar_backend()
+    _cola_trabajos = None
+
+def calentar(conexiones: int = 4) -> Dict[str, float]:
+    """
+    Deja el worker listo antes del primer request: conexiones abiertas en el
+    pool, backend de cache creado, pools de los clientes más activos,
+    catálogos cargados (CATALOG_SNAPSHOT), índice del catálogo maestro
+    (MASTER_CATALOG) y Pillow importado en modo raster
+    Cada fase es independiente: si una falla se registra y se sigue con la
+    próxima. Retorna los milisegundos de cada fase.
+    """
+    clientes = []
+
+    def pools():
+        repositorio.calentar(bd_principal().config, conexiones)
+
+    def clientes_activos():
+        # Modo unico: los clientes de APP_TOKENS, que comparten el pool de DB_*
+        if esquema.TENANCY_MODE == 'unico':
+            clientes.extend(cliente_unico(info) for info in VALID_TOKENS.values())
+            return
+        if not WARMUP_CONFIG['clientes']:
+            return
+        clientes.extend(uso.clientes_mas_activos(admin.consultar, WARMUP_CONFIG['clientes'],
+                                                 WARMUP_CONFIG['horas']))
+        for cliente in clientes:
+            repositorio.calentar(repositorio_de(cliente).config,
+                                 WARMUP_CONFIG['conexiones_cliente'], cliente['subdominio'])
+
+    def catalogos():
+        if CATALOG_CONFIG['habilitado']:
+            for cliente in clientes:
+                repo = repositorio_de(cliente)
+                obtener_catalogo(repo.destino, repo.consultar, repo.tabla).vigente()
+
+    def catalogo_maestro():
+        if maestro.MAESTRO_CONFIG['habilitado']:
+            maestro.obtener_indice(admin.consultar).vigente()
+
+    def etiquetas_raster():
+        # Pillow y las bandas fijas de cada cliente se cargan acá y no en la primera impresión
+        if etiquetas.ETIQUETA_MODO == 'raster' and etiquetas.cargar_pil():
+            for cliente in clientes:
+                etiquetas.banda_encabezado(cliente['subdominio'])
+
+    fases = (('pools', pools), ('cache', cache.get_backend), ('clientes', clientes_activos),
+             ('catalogos', catalogos), ('maestro', catalogo_maestro), ('etiquetas', etiquetas_raster))
+    tiempos = {}
+    for nombre, fase in fases:
+        inicio = time.perf_counter()
+        try:
+            fase()
+        except Exception as e:
+            print(f"⚠️  Calentamiento '{nombre}' incompleto: {e}")
+        tiempos[nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+    return tiempos
+
+def iniciar_tareas_de_fondo():
+    """
+    Hilos que cada proceso necesita aunque no se caliente: retoma los trabajos
+    de impresión que quedaron a medias y, en modo unico, arranca el agregador
+    de stock, que aplica los movimientos pendientes de antes del reinicio (con
+    una BD por cliente, el de cada BD arranca con su primer request de stock)
+    """
+    threading.Thread(target=reanudar_trabajos, name='reanudar-trabajos', daemon=True).start()
+    if esquema.TENANCY_MODE == 'unico':
+        stock.libro_de(DB_CONFIG, al_aplicar=partial(invalidar_catalogos, DB_CONFIG))
+
+def verificar_conexiones(config: Dict):
+    """Conteo de productos y prueba de la impresora; puede tardar, va en segundo plano"""
+    try:
+        if esquema.TENANCY_MODE == 'unico':
+            print(f"✅ BD: {repo_unico.total()} productos")
+        else:
+            print(f"✅ BD: comparapp_admin {admin.version_servidor()}")
     except Exception as e:
         print(f"❌ BD: Error de conexión")
     
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(1)
-        sock.connect((PRINTER_CONFIG['ip'], PRINTER_CONFIG['port']))
+        sock.connect((config['ip'], config['port']))
         sock.close()
         print(f"✅ Impresora: Conectada")
     except:
         print(f"⚠️  Impresora: No conectada (configúrala después)")
+
+def print_startup_info():
+    print("=" * 70)
+    print("🚀 SISTEMA DE GESTIÓN - IMPRESIÓN WIFI UNIVERSAL")
+    print("=" * 70)
+    config = config_impresora()
+    bd = bd_principal().config
+    print(f"📍 Base de datos: {bd['host']}:{bd.get('port', 3306)} (TENANCY_MODE={esquema.TENANCY_MODE})")
+    print(f"🖨️  Impresora WiFi: {config['ip']}:{config['port']}")
+    print(f"🗃️  Cache: {cache.CACHE_CONFIG['backend']}")
+    if CATALOG_CONFIG['habilitado']:
+        print(f"⚡ Catálogo en memoria: activo (verificación cada {CATALOG_CONFIG['intervalo_verificacion']:.0f}s)")
+    
+    # El servidor no espera al conteo de la BD ni al timeout de la impresora
+    threading.Thread(target=verificar_conexiones, args=(config,), name='verificar-conexiones',
+                     daemon=True).start()
     
     print("=" * 70)
     print("🌐 Servidor: http://0.0.0.0:5000")
@@ -642,4 +1058,5 @@ def print_startup_info():
 
 if __name__ == '__main__':
     print_startup_info()
+    iniciar_tareas_de_fondo()
     app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,12 +1,20 @@
 """
 Middleware de autenticación para ComparApp SaaS
-Valida subdominios, tokens y estado de clientes
+Valida subdominios, tokens y estado de clientes, y da a cada request el
+repositorio de productos de su cliente. Con TENANCY_MODE=unico no hay
+comparapp_admin: una sola BD de productos (DB_*) y tokens fijos (APP_TOKENS).
 """
 
 from functools import wraps
 from flask import request, jsonify, g
+import os
 import pymysql
-from contextlib import contextmanager
+
+import esquema
+import perfil
+import repositorio
+import tokens
+import uso
 
 # ============================================
 # CONFIGURACIÓN
@@ -21,31 +29,37 @@ ADMIN_DB_CONFIG = {
     'cursorclass': pymysql.cursors.DictCursor
 }
 
+# BD de productos del modo unico
+DB_CONFIG = {
+    'host': os.getenv("DB_HOST", "mariadb"),
+    'user': os.getenv("DB_USER", "unicenta"),
+    'password': os.getenv("DB_PASSWORD", "unicenta123"),
+    'database': os.getenv("DB_NAME", "unicentaopos"),
+    'port': int(os.getenv("DB_PORT", 3306)),
+    'charset': 'utf8mb4',
+    'cursorclass': pymysql.cursors.DictCursor
+}
+
+# Tokens del modo unico, guardados como hash: APP_TOKENS="<hash>=<cliente>:<nombre>,..."
+# (el hash de un token sale de `python3 tokens.py <token>`). Sin APP_TOKENS
+# se acepta solo el token de demo
+VALID_TOKENS = tokens.tabla_tokens(os.getenv("APP_TOKENS") or (
+    f"{tokens.hash_token('tk_prod_abc123def456ghi789jkl012mno345')}=tienda1:Tienda Demo"
+))
+
 
 # ============================================
 # UTILIDADES DE BASE DE DATOS
 # ============================================
 
-@contextmanager
-def get_admin_connection():
-    """Conexión a la BD administrativa"""
-    conn = pymysql.connect(**ADMIN_DB_CONFIG)
-    try:
-        yield conn
-    finally:
-        conn.close()
+# Consultas propias del middleware (clientes, logs_acceso), con pool y tiempos
+admin = repositorio.Repositorio(ADMIN_DB_CONFIG)
 
+# Productos del modo unico: todos los tokens de APP_TOKENS comparten esta BD
+repo_unico = repositorio.RepositorioProductos(DB_CONFIG)
 
-@contextmanager
-def get_client_connection(db_name):
-    """Conexión a la BD de un cliente específico"""
-    config = ADMIN_DB_CONFIG.copy()
-    config['database'] = db_name
-    conn = pymysql.connect(**config)
-    try:
-        yield conn
-    finally:
-        conn.close()
+# Requests por (cliente, endpoint, hora), volcados en lote a uso_por_hora
+acumulador_uso = uso.AcumuladorUso(admin.escribir_lote)
 
 
 # ============================================
@@ -76,47 +90,36 @@ def extraer_subdominio(host):
     return None
 
 
-def obtener_cliente_por_subdominio(subdominio):
-    """Busca cliente por subdominio en la BD admin"""
-    if not subdominio:
-        return None
-    
-    query = """
-        SELECT id, nombre, subdominio, db_name, token, activo
-        FROM clientes
-        WHERE subdominio = %s
-        LIMIT 1
+def cliente_por_token(token_recibido):
     """
-    
-    with get_admin_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(query, (subdominio,))
-            return cursor.fetchone()
+    Cliente dueño del token (acepta 'Bearer ...'), o None
+    Se busca por el hash del token en tokens_clientes: un solo lookup indexado
+    """
+    return tokens.resolver(token_recibido, admin.consultar)
 
 
-def validar_token(cliente, token_recibido):
-    """Valida que el token coincida con el del cliente"""
-    if not cliente or not token_recibido:
-        return False
-    
-    # Remover "Bearer " si existe
-    if token_recibido.startswith('Bearer '):
-        token_recibido = token_recibido[7:]
-    
-    return cliente['token'] == token_recibido
+def cliente_unico(info):
+    """Cliente del modo unico a partir de su entrada de APP_TOKENS (sin fila en comparapp_admin)"""
+    return {'id': None, 'nombre': info['nombre'], 'subdominio': info['cliente'],
+            'db_name': DB_CONFIG['database'], 'activo': 1}
 
 
-def registrar_acceso(cliente_id, endpoint, ip):
-    """Registra acceso en logs (opcional)"""
+def registrar_acceso(cliente_id, endpoint, ip, plantilla=None):
+    """
+    Suma el request a las estadísticas de uso y, con ACCESS_LOG_RAW=1, lo
+    registra también en logs_acceso
+    `plantilla` es la regla de la ruta (/api/producto/<codigo>): agrupa en
+    las estadísticas todos los códigos bajo un mismo endpoint
+    """
+    acumulador_uso.registrar(cliente_id, plantilla or endpoint)
+    if not uso.USO_CONFIG['logs_crudos']:
+        return
     try:
         query = """
             INSERT INTO logs_acceso (cliente_id, endpoint, ip, timestamp)
             VALUES (%s, %s, %s, NOW())
         """
-        with get_admin_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query, (cliente_id, endpoint, ip))
-            conn.commit()
+        admin.escribir(query, (cliente_id, endpoint, ip), nombre='registrar_acceso')
     except Exception as e:
         print(f"Error al registrar acceso: {e}")
 
@@ -128,120 +131,117 @@ def registrar_acceso(cliente_id, endpoint, ip):
 def requiere_auth(f):
     """
     Decorador que valida autenticación antes de ejecutar endpoint
+    Deja en g el cliente (g.cliente, g.db_name, g.cliente_id); las rutas
+    toman sus productos de repositorio_cliente()
     
     Uso:
         @app.route('/api/productos')
         @requiere_auth
         def listar_productos():
-            # Acceso a g.cliente y g.db_name
-            pass
+            productos = repositorio_cliente().listar()
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # 1. Extraer subdominio
-        host = request.headers.get('Host', '')
-        subdominio = extraer_subdominio(host)
-        
-        if not subdominio:
-            return jsonify({
-                'error': 'Subdominio no detectado',
-                'mensaje': 'Accede desde tu subdominio: tucliente.comparappargentina.com'
-            }), 400
-        
-        # 2. Buscar cliente
-        cliente = obtener_cliente_por_subdominio(subdominio)
-        
-        if not cliente:
-            return jsonify({
-                'error': 'Cliente no encontrado',
-                'mensaje': f'El subdominio "{subdominio}" no está registrado'
-            }), 404
-        
-        # 3. Verificar si está activo
-        if not cliente['activo']:
-            return jsonify({
-                'error': 'Cliente inactivo',
-                'mensaje': 'Tu cuenta ha sido suspendida. Contacta a soporte.'
-            }), 403
-        
-        # 4. Validar token
-        token = request.headers.get('Authorization', '')
-        
-        if not validar_token(cliente, token):
-            return jsonify({
-                'error': 'Token inválido',
-                'mensaje': 'Autenticación fallida'
-            }), 401
-        
-        # 5. Registrar acceso (opcional)
-        ip = request.remote_addr
-        registrar_acceso(cliente['id'], request.path, ip)
-        
-        # 6. Guardar contexto en Flask g
-        g.cliente = cliente
-        g.db_name = cliente['db_name']
-        g.cliente_id = cliente['id']
-        
-        # 7. Ejecutar función original
+        # El tiempo de auth (con sus consultas) va al segmento 'auth' del perfil
+        with perfil.medir('auth'):
+            if esquema.TENANCY_MODE == 'unico':
+                rechazo = _autenticar_token_fijo()
+            else:
+                rechazo = _autenticar_subdominio()
+        if rechazo:
+            return rechazo
         return f(*args, **kwargs)
     
     return decorated_function
 
 
-def requiere_auth_opcional(f):
-    """
-    Decorador para endpoints públicos que pueden usar auth
+def _autenticar_token_fijo():
+    """Modo unico: el token tiene que estar en APP_TOKENS"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Token no proporcionado'}), 401
     
-    Uso para endpoints públicos de consulta de precios desde POS
-    """
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        host = request.headers.get('Host', '')
-        subdominio = extraer_subdominio(host)
-        
-        if subdominio:
-            cliente = obtener_cliente_por_subdominio(subdominio)
-            if cliente and cliente['activo']:
-                token = request.headers.get('Authorization', '')
-                if validar_token(cliente, token):
-                    g.cliente = cliente
-                    g.db_name = cliente['db_name']
-        
-        return f(*args, **kwargs)
+    info = tokens.buscar_en_tabla(VALID_TOKENS, auth_header)
+    if info is None:
+        return jsonify({'error': 'Token inválido o expirado'}), 401
     
-    return decorated_function
+    g.cliente = cliente_unico(info)
+    g.db_name = g.cliente['db_name']
+    g.cliente_id = None
+    return None
+
+
+def _autenticar_subdominio():
+    """Modos bd y compartido: token de tokens_clientes emitido para el subdominio del Host"""
+    # 1. Extraer subdominio
+    host = request.headers.get('Host', '')
+    subdominio = extraer_subdominio(host)
+    
+    if not subdominio:
+        return jsonify({
+            'error': 'Subdominio no detectado',
+            'mensaje': 'Accede desde tu subdominio: tucliente.comparappargentina.com'
+        }), 400
+    
+    # 2. Resolver el cliente por el hash del token
+    token = request.headers.get('Authorization', '')
+    cliente = cliente_por_token(token)
+    
+    # 3. El token tiene que ser del subdominio desde el que se accede
+    if not cliente or cliente['subdominio'] != subdominio:
+        return jsonify({
+            'error': 'Token inválido',
+            'mensaje': 'Autenticación fallida'
+        }), 401
+    
+    # 4. Verificar si está activo
+    if not cliente['activo']:
+        return jsonify({
+            'error': 'Cliente inactivo',
+            'mensaje': 'Tu cuenta ha sido suspendida. Contacta a soporte.'
+        }), 403
+    
+    # 5. Registrar acceso (opcional)
+    ip = request.remote_addr
+    registrar_acceso(cliente['id'], request.path, ip,
+                     request.url_rule.rule if request.url_rule else None)
+    
+    # 6. Guardar contexto en Flask g
+    g.cliente = cliente
+    g.db_name = cliente['db_name']
+    g.cliente_id = cliente['id']
+    return None
 
 
 # ============================================
 # UTILIDADES PARA CONSULTAS
 # ============================================
 
-def execute_client_query(query, params=None, fetch_one=False):
-    """
-    Ejecuta query en la BD del cliente actual (desde g.db_name)
-    """
-    if not hasattr(g, 'db_name'):
-        raise Exception("No hay cliente autenticado en el contexto")
-    
-    with get_client_connection(g.db_name) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            return cursor.fetchone() if fetch_one else cursor.fetchall()
+def config_cliente(db_name):
+    """Destino de la BD de productos de un cliente (la compartida en modo compartido)"""
+    config = ADMIN_DB_CONFIG.copy()
+    config['database'] = esquema.SHARED_DB if esquema.TENANCY_MODE == 'compartido' else db_name
+    return config
 
 
-def execute_client_update(query, params=None):
+def repositorio_de(cliente):
     """
-    Ejecuta UPDATE/INSERT/DELETE en la BD del cliente actual
+    Repositorio de productos de un cliente (fila de clientes o cliente_unico)
+    En modo compartido apunta a la BD compartida y `products` pasa a ser la
+    vista del cliente, que filtra por tenant_id
     """
-    if not hasattr(g, 'db_name'):
+    if esquema.TENANCY_MODE == 'unico':
+        return repo_unico
+    config = config_cliente(cliente['db_name'])
+    tenant_id = cliente['id'] if esquema.TENANCY_MODE == 'compartido' else None
+    return repositorio.RepositorioProductos(config, tenant_id=tenant_id, cliente=cliente['subdominio'])
+
+
+def repositorio_cliente():
+    """Repositorio de productos del cliente autenticado en este request"""
+    if 'cliente' not in g:
         raise Exception("No hay cliente autenticado en el contexto")
     
-    try:
-        with get_client_connection(g.db_name) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query, params)
-            conn.commit()
-        return True
-    except Exception as e:
-        print(f"Error en execute_client_update: {e}")
-        return False
\ No newline at end of file
+    if 'repositorio' not in g:
+        g.repositorio = repositorio_de(g.cliente)
+    return g.repositorio
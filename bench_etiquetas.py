@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark de etiquetas: modo texto vs. modo raster
+Mide tiempo de generación por etiqueta (raster en frío y con cache caliente)
+y bytes enviados, con el tiempo de transferencia estimado por tipo de enlace.
+
+Uso:
+    python3 bench_etiquetas.py --cantidad 500 --cliente tienda1
+"""
+
+import argparse
+import random
+import time
+
+import etiquetas
+
+# Bytes por segundo útiles de cada enlace
+ENLACES = {
+    'serie 9600': 960,
+    'serie 115200': 11520,
+    'USB 1.1': 1_000_000,
+    'red 100 Mbit': 10_000_000,
+}
+
+NOMBRES = [
+    'Coca Cola Sabor Original Botella Retornable 2.25L',
+    'Yerba Mate Suave con Palo Paquete 1kg',
+    'Leche Entera Larga Vida Sachet 1L',
+    'Galletitas Dulces Surtidas de Chocolate y Vainilla 400g',
+    'Aceite de Girasol 1.5L',
+]
+
+
+def productos_de_prueba(cantidad: int, cliente: str):
+    # Precios repetidos, como en un lote real de góndola
+    precios = [round(random.uniform(100, 5000), 2) for _ in range(max(1, cantidad // 5))]
+    return [{
+        'name': random.choice(NOMBRES),
+        'code': f"779{random.randint(0, 10**10 - 1):010d}",
+        'pricesell': random.choice(precios),
+        'cliente': cliente,
+    } for _ in range(cantidad)]
+
+
+def medir(funcion, productos):
+    inicio = time.perf_counter()
+    total_bytes = sum(len(funcion(p)) for p in productos)
+    ms = (time.perf_counter() - inicio) * 1000
+    return ms / len(productos), total_bytes / len(productos)
+
+
+def ejecutar(args):
+    if not etiquetas.cargar_pil():
+        raise SystemExit("❌ El modo raster requiere Pillow (pip install Pillow)")
+
+    random.seed(args.semilla)
+    productos = productos_de_prueba(args.cantidad, args.cliente)
+
+    resultados = {'texto': medir(etiquetas.generar_etiqueta_producto, productos)}
+
+    etiquetas.limpiar_cache_raster()
+    resultados['raster (frío)'] = medir(etiquetas.generar_etiqueta_raster, productos[:1])
+    resultados['raster (lote)'] = medir(etiquetas.generar_etiqueta_raster, productos)
+
+    print(f"\n🏷️  {args.cantidad} etiquetas, {etiquetas.RASTER_ANCHO} puntos de ancho\n")
+    encabezado = f"{'MODO':<16} {'MS/ETIQ':>9} {'BYTES':>8} " + ' '.join(f"{e:>14}" for e in ENLACES)
+    print(encabezado)
+    print("=" * len(encabezado))
+    for modo, (ms, tamanio) in resultados.items():
+        transferencias = ' '.join(f"{tamanio / bps * 1000:>11.1f} ms" for bps in ENLACES.values())
+        print(f"{modo:<16} {ms:>9.3f} {tamanio:>8.0f} {transferencias}")
+    print("=" * len(encabezado))
+    print("Las columnas de enlace estiman el tiempo de transferencia por etiqueta;")
+    print("el avance del papel es el mismo en ambos modos.\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de etiquetas texto vs. raster")
+    parser.add_argument('--cantidad', type=int, default=500)
+    parser.add_argument('--cliente', default=None, help="Usa logo y fuente de etiquetas_recursos/<cliente>")
+    parser.add_argument('--semilla', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ejecutar(parse_args())
@@ -0,0 +1,254 @@
+"""
+Capa de cache compartida entre workers
+Backend en memoria del proceso (por defecto) o Redis local para que todos los
+workers de gunicorn compartan la misma cache caliente.
+La invalidación es por sello de versión: cada espacio de nombres tiene un
+contador y las claves incluyen su valor, así invalidar es un único INCR.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+CACHE_CONFIG = {
+    'backend': os.getenv("CACHE_BACKEND", "memoria"),   # memoria | redis
+    'redis_url': os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    'prefijo': os.getenv("CACHE_PREFIX", "comparapp:"),
+    'ttl': int(os.getenv("CACHE_TTL", 300)),
+    'max_entradas': int(os.getenv("CACHE_MAX_ENTRIES", 50000)),
+}
+
+# Cada cuántos segundos el backend en memoria descarta los baldes ya llenos
+INTERVALO_BALDES = 60
+
+
+# ============================================
+# BACKENDS
+# ============================================
+
+class BackendMemoria:
+    """
+    Cache LRU con TTL dentro del proceso; no se comparte entre workers
+    Los token buckets también son del proceso: con N workers un cliente puede
+    llegar a N veces el límite configurado
+    """
+
+    compartido = False
+
+    def __init__(self, max_entradas: int):
+        self._datos = OrderedDict()
+        self._max = max_entradas
+        self._lock = threading.Lock()
+        self._buckets = {}      # clave -> (tokens, último cálculo, lleno desde)
+        self._barrido = time.monotonic()
+
+    def get(self, clave: str) -> Optional[str]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira and expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave: str, valor: str, ttl: Optional[int] = None):
+        expira = time.monotonic() + ttl if ttl else 0
+        with self._lock:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self._max:
+                self._datos.popitem(last=False)
+
+    def delete(self, clave: str):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def incr(self, clave: str) -> int:
+        with self._lock:
+            _, valor = self._datos.get(clave, (0, '0'))
+            nuevo = int(valor) + 1
+            self._datos[clave] = (0, str(nuevo))
+            return nuevo
+
+    def tomar_token(self, clave: str, tasa: float, rafaga: float, costo: float) -> Tuple[bool, float]:
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora - self._barrido > INTERVALO_BALDES:
+                self._barrer_baldes(ahora)
+            tokens, antes, _ = self._buckets.get(clave, (rafaga, ahora, ahora))
+            tokens = min(rafaga, tokens + (ahora - antes) * tasa)
+            permitido = tokens >= costo
+            if permitido:
+                tokens -= costo
+            self._buckets[clave] = (tokens, ahora, ahora + (rafaga - tokens) / tasa)
+            return (True, 0.0) if permitido else (False, (costo - tokens) / tasa)
+
+    def _barrer_baldes(self, ahora: float):
+        """Un balde que ya se rellenó equivale a uno nuevo: se descarta (como el EXPIRE de Redis)"""
+        self._barrido = ahora
+        for clave in [c for c, (_, _, lleno) in self._buckets.items() if lleno <= ahora]:
+            del self._buckets[clave]
+
+
+# Token bucket atómico: todos los workers descuentan del mismo balde
+LUA_TOKEN_BUCKET = """
+local tasa = tonumber(ARGV[1])
+local rafaga = tonumber(ARGV[2])
+local costo = tonumber(ARGV[3])
+local ahora = tonumber(ARGV[4])
+local datos = redis.call('HMGET', KEYS[1], 't', 'a')
+local tokens = tonumber(datos[1]) or rafaga
+local antes = tonumber(datos[2]) or ahora
+tokens = math.min(rafaga, tokens + math.max(0, ahora - antes) * tasa)
+local permitido = 0
+local espera = 0
+if tokens >= costo then
+    tokens = tokens - costo
+    permitido = 1
+else
+    espera = (costo - tokens) / tasa
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'a', ahora)
+redis.call('EXPIRE', KEYS[1], math.ceil(rafaga / tasa) + 1)
+return {permitido, tostring(espera)}
+"""
+
+
+class BackendRedis:
+    """Cache en un Redis local, compartida por todos los workers"""
+
+    compartido = True
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requiere el paquete 'redis' (pip install redis)")
+        self._redis = redis.Redis.from_url(url, decode_responses=True,
+                                           socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._token_bucket = self._redis.register_script(LUA_TOKEN_BUCKET)
+
+    def get(self, clave: str) -> Optional[str]:
+        return self._redis.get(clave)
+
+    def set(self, clave: str, valor: str, ttl: Optional[int] = None):
+        self._redis.set(clave, valor, ex=ttl or None)
+
+    def delete(self, clave: str):
+        self._redis.delete(clave)
+
+    def incr(self, clave: str) -> int:
+        return self._redis.incr(clave)
+
+    def tomar_token(self, clave: str, tasa: float, rafaga: float, costo: float) -> Tuple[bool, float]:
+        permitido, espera = self._token_bucket(keys=[clave], args=[tasa, rafaga, costo, time.time()])
+        return bool(int(permitido)), float(espera)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Crea el backend configurado la primera vez que se usa"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if CACHE_CONFIG['backend'] == 'redis':
+                    _backend = BackendRedis(CACHE_CONFIG['redis_url'])
+                else:
+                    _backend = BackendMemoria(CACHE_CONFIG['max_entradas'])
+    return _backend
+
+
+def reiniciar_backend():
+    """
+    Descarta el cliente Redis heredado del master después de un fork
+    (la cache en memoria se conserva: ya está caliente y es propia del proceso)
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is not None and _backend.compartido:
+            _backend = None
+
+
+def es_compartida() -> bool:
+    """True si la cache es visible para todos los workers"""
+    return get_backend().compartido
+
+
+# ============================================
+# API DE CACHE
+# ============================================
+
+def _clave(*partes) -> str:
+    return CACHE_CONFIG['prefijo'] + ':'.join(str(p) for p in partes)
+
+
+def version(espacio: str) -> int:
+    """Sello de versión vigente de un espacio de nombres"""
+    valor = get_backend().get(_clave('ver', espacio))
+    return int(valor) if valor else 0
+
+
+def invalidar(espacio: str):
+    """Invalida todas las claves de un espacio incrementando su versión"""
+    try:
+        get_backend().incr(_clave('ver', espacio))
+    except Exception as e:
+        print(f"⚠️  Error al invalidar cache '{espacio}': {e}")
+
+
+def obtener(espacio: str, clave: str) -> Any:
+    """Valor cacheado o None"""
+    valor = get_backend().get(_clave(espacio, version(espacio), clave))
+    return json.loads(valor) if valor is not None else None
+
+
+def guardar(espacio: str, clave: str, valor: Any, ttl: Optional[int] = None):
+    """Guarda un valor serializable a JSON (Decimal y fechas se guardan como texto)"""
+    datos = json.dumps(valor, default=str)
+    get_backend().set(_clave(espacio, version(espacio), clave), datos,
+                      CACHE_CONFIG['ttl'] if ttl is None else ttl)
+
+
+def tomar_token(espacio: str, clave: str, tasa: float, rafaga: float, costo: float = 1) -> Tuple[bool, float]:
+    """
+    Descuenta `costo` de un token bucket; retorna (permitido, segundos de espera)
+    Con Redis el balde es común a todos los workers
+    """
+    return get_backend().tomar_token(_clave('tb', espacio, clave), tasa, rafaga, costo)
+
+
+def obtener_o_calcular(espacio: str, clave: str, calcular: Callable[[], Any],
+                       ttl: Optional[int] = None) -> Any:
+    """
+    Retorna el valor cacheado o lo calcula y lo guarda
+    Si la cache falla se calcula directo: la cache nunca debe tumbar un request
+    """
+    try:
+        valor = obtener(espacio, clave)
+        if valor is not None:
+            return valor
+    except Exception as e:
+        print(f"⚠️  Error al leer cache '{espacio}': {e}")
+        return calcular()
+
+    valor = calcular()
+    if valor is not None:
+        try:
+            guardar(espacio, clave, valor, ttl)
+        except Exception as e:
+            print(f"⚠️  Error al escribir cache '{espacio}': {e}")
+    return valor
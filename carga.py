@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de ComparApp
+Simula escáneres consultando productos (con algún guardado) contra una
+instancia levantada y reporta requests/s y percentiles de latencia.
+
+Uso:
+    python3 carga.py --url http://localhost:5000 --token tk_... --codigos codigos.txt
+    python3 carga.py --concurrencia 32 --duracion 60 --escrituras 0.05
+    python3 carga.py --fila "gthread 9×8"       # además, fila para la tabla del readme
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import date
+
+
+def descripcion_cpu():
+    """Modelo de CPU y núcleos de esta máquina, para anotar junto a cada fila"""
+    modelo = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for linea in f:
+                if linea.startswith('model name'):
+                    modelo = linea.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{modelo} ({os.cpu_count()} núcleos)"
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def pedir(url, token, metodo='GET', cuerpo=None, timeout=10):
+    datos = json.dumps(cuerpo).encode('utf-8') if cuerpo is not None else None
+    req = urllib.request.Request(url, data=datos, method=metodo)
+    req.add_header('Authorization', f'Bearer {token}')
+    if datos is not None:
+        req.add_header('Content-Type', 'application/json')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def cargar_codigos(args):
+    if args.codigos:
+        with open(args.codigos, encoding='utf-8') as f:
+            return [linea.strip() for linea in f if linea.strip()]
+    # Sin archivo: se toman los códigos del listado
+    req = urllib.request.Request(f"{args.url}/api/productos?formato=columnar")
+    req.add_header('Authorization', f'Bearer {args.token}')
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())['columnas']['code']
+
+
+def ejecutar(args):
+    codigos = cargar_codigos(args)
+    if not codigos:
+        raise SystemExit("❌ No hay códigos para consultar")
+
+    latencias = []
+    estados = Counter()
+    lock = threading.Lock()
+    fin = time.monotonic() + args.duracion
+
+    def cliente():
+        propias, propios = [], Counter()
+        while time.monotonic() < fin:
+            codigo = random.choice(codigos)
+            inicio = time.perf_counter()
+            try:
+                if random.random() < args.escrituras:
+                    estado = pedir(f"{args.url}/api/producto", args.token, 'POST', {
+                        'code': codigo, 'name': f'Carga {codigo}',
+                        'pricebuy': 100, 'pricesell': round(random.uniform(100, 200), 2)
+                    })
+                else:
+                    estado = pedir(f"{args.url}/api/producto/{codigo}", args.token)
+            except Exception as e:
+                estado = type(e).__name__
+            propias.append((time.perf_counter() - inicio) * 1000)
+            propios[estado] += 1
+        with lock:
+            latencias.extend(propias)
+            estados.update(propios)
+
+    print(f"🔨 {args.concurrencia} clientes durante {args.duracion}s contra {args.url} "
+          f"({len(codigos)} códigos, {args.escrituras:.0%} escrituras)")
+    hilos = [threading.Thread(target=cliente) for _ in range(args.concurrencia)]
+    inicio = time.monotonic()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    total = time.monotonic() - inicio
+
+    print("=" * 50)
+    print(f"Requests:   {len(latencias)}  ({len(latencias) / total:.1f} req/s)")
+    print(f"p50:        {percentil(latencias, 50):.1f} ms")
+    print(f"p95:        {percentil(latencias, 95):.1f} ms")
+    print(f"p99:        {percentil(latencias, 99):.1f} ms")
+    print(f"Máximo:     {max(latencias):.1f} ms" if latencias else "Máximo:     -")
+    print(f"Estados:    {dict(estados)}")
+    print("=" * 50)
+
+    if args.fila:
+        errores = sum(n for estado, n in estados.items() if estado != 200)
+        print(f"| {args.fila} | {args.concurrencia} | {len(latencias) / total:.1f} | "
+              f"{percentil(latencias, 50):.1f} | {percentil(latencias, 95):.1f} | "
+              f"{percentil(latencias, 99):.1f} | {errores} | {descripcion_cpu()} | "
+              f"{len(codigos)} | {date.today().isoformat()} |")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prueba de carga de ComparApp")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--token', default='tk_prod_abc123def456ghi789jkl012mno345')
+    parser.add_argument('--codigos', help="Archivo con un código por línea (default: /api/productos)")
+    parser.add_argument('--concurrencia', type=int, default=16)
+    parser.add_argument('--duracion', type=int, default=30, help="Segundos")
+    parser.add_argument('--escrituras', type=float, default=0.0,
+                        help="Fracción de requests que guardan un producto (0-1); "
+                             "modifica precios: no usar contra una BD de producción")
+    parser.add_argument('--fila', metavar='CONFIGURACION',
+                        help="Imprime el resultado como fila de la tabla de resultados del readme")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ejecutar(parse_args())
@@ -0,0 +1,288 @@
+"""
+Snapshot en memoria del catálogo de productos por cliente
+Cada worker mantiene una copia compacta e inmutable de la tabla products,
+indexada por código y referencia, que se reemplaza atómicamente (copy-on-write).
+Los guardados de la API no copian el catálogo: se suman a una capa chica de
+cambios sobre el índice base, y la firma se ajusta con el CRC de cada fila.
+"""
+
+import heapq
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+CATALOG_CONFIG = {
+    'habilitado': os.getenv("CATALOG_SNAPSHOT", "0") == "1",
+    # Cada cuántos segundos se compara la firma del snapshot contra la BD
+    'intervalo_verificacion': float(os.getenv("CATALOG_CHECK_INTERVAL", 30)),
+    # Cambios locales acumulados antes de reconstruir el índice base
+    'max_cambios': int(os.getenv("CATALOG_OVERLAY_MAX", 256)),
+}
+
+COLUMNAS = (
+    'id', 'reference', 'code', 'codetype', 'name', 'pricebuy', 'pricesell',
+    'category', 'taxcat', 'stockunits', 'supplier', 'texttip', 'warranty'
+)
+
+# CRC de una fila; la firma de la tabla es el XOR de todos (BIT_XOR)
+_CRC_FILA = "CRC32(CONCAT_WS('|', id, code, reference, name, pricebuy, pricesell, stockunits))"
+
+# {tabla}: products o la vista del cliente en modo compartido (Repositorio.tabla)
+QUERY_CATALOGO = f"SELECT {', '.join(COLUMNAS)}, {_CRC_FILA} AS crc FROM {{tabla}}"
+
+QUERY_PRODUCTO = f"SELECT {', '.join(COLUMNAS)}, {_CRC_FILA} AS crc FROM {{tabla}} WHERE code = %s LIMIT 1"
+
+# Firma barata del contenido de la tabla: cambia ante cualquier INSERT/UPDATE/DELETE
+QUERY_FIRMA = f"""
+    SELECT COUNT(*) AS total, COALESCE(BIT_XOR({_CRC_FILA}), 0) AS firma
+    FROM {{tabla}}
+"""
+
+
+# ============================================
+# ESTRUCTURAS DEL SNAPSHOT
+# ============================================
+
+class ProductoCache:
+    """Fila de producto compacta; se accede igual que a un dict de DictCursor"""
+
+    __slots__ = COLUMNAS
+
+    def __init__(self, fila: Dict):
+        for columna in COLUMNAS:
+            valor = fila.get(columna)
+            if columna in ('pricebuy', 'pricesell', 'stockunits') and valor is not None:
+                valor = float(valor)
+            setattr(self, columna, valor)
+
+    def __getitem__(self, columna: str):
+        return getattr(self, columna)
+
+    def get(self, columna: str, default=None):
+        return getattr(self, columna, default)
+
+
+class IndiceBase:
+    """Productos de la última recarga, ordenados por nombre, con sus índices y CRC"""
+
+    __slots__ = ('productos', 'por_codigo', 'por_referencia', 'crc')
+
+    def __init__(self, productos: Tuple[ProductoCache, ...], crc: Dict[str, int]):
+        self.productos = productos
+        self.por_codigo = {p.code: p for p in productos}
+        self.por_referencia = {}
+        for p in productos:
+            if p.reference:
+                self.por_referencia.setdefault(p.reference, p)
+        self.crc = crc
+
+
+class CatalogoSnapshot:
+    """
+    Vista inmutable del catálogo; nunca se modifica una vez publicada
+    `cambios` tiene los guardados y borrados locales desde la última recarga
+    (code -> (producto o None si se borró, crc)); el índice base se comparte
+    entre todos los snapshots hasta que los cambios superan CATALOG_OVERLAY_MAX.
+    """
+
+    __slots__ = ('base', 'cambios', 'por_referencia_cambios', 'firma', 'creado',
+                 'serializados', '_productos')
+
+    def __init__(self, base: IndiceBase, firma: Tuple[int, int],
+                 cambios: Optional[Dict[str, Tuple[Optional[ProductoCache], Optional[int]]]] = None):
+        self.base = base
+        self.cambios = cambios or {}
+        self.por_referencia_cambios = {}
+        for producto, _ in self.cambios.values():
+            if producto is not None and producto.reference:
+                self.por_referencia_cambios.setdefault(producto.reference, producto)
+        self.firma = firma
+        self.creado = time.monotonic()
+        # Respuestas ya serializadas de este snapshot, por formato
+        self.serializados = {}
+        self._productos = None
+
+    @classmethod
+    def desde_filas(cls, filas) -> 'CatalogoSnapshot':
+        """Snapshot de una lectura completa; la firma sale de las mismas filas"""
+        productos = sorted((ProductoCache(f) for f in filas), key=_clave_orden)
+        crc = {f['code']: int(f['crc']) for f in filas}
+        firma = 0
+        for valor in crc.values():
+            firma ^= valor
+        return cls(IndiceBase(tuple(productos), crc), (len(crc), firma))
+
+    def obtener(self, codigo: str) -> Optional[ProductoCache]:
+        """Equivalente a WHERE code = %s OR reference = %s"""
+        if codigo in self.cambios:
+            producto = self.cambios[codigo][0]
+        else:
+            producto = self.base.por_codigo.get(codigo)
+        if producto is not None:
+            return producto
+        producto = self.por_referencia_cambios.get(codigo)
+        if producto is not None:
+            return producto
+        producto = self.base.por_referencia.get(codigo)
+        if producto is not None and producto.code not in self.cambios:
+            return producto
+        return None
+
+    @property
+    def productos(self) -> Tuple[ProductoCache, ...]:
+        """Productos ordenados por nombre, con los cambios aplicados (se arma una vez por snapshot)"""
+        if self._productos is None:
+            if not self.cambios:
+                self._productos = self.base.productos
+            else:
+                vigentes = (p for p in self.base.productos if p.code not in self.cambios)
+                nuevos = sorted((p for p, _ in self.cambios.values() if p is not None), key=_clave_orden)
+                self._productos = tuple(heapq.merge(vigentes, nuevos, key=_clave_orden))
+        return self._productos
+
+    def _crc(self, codigo: str) -> Optional[int]:
+        if codigo in self.cambios:
+            return self.cambios[codigo][1]
+        return self.base.crc.get(codigo)
+
+    def con_cambio(self, codigo: str, producto: Optional[ProductoCache],
+                   crc: Optional[int]) -> 'CatalogoSnapshot':
+        """
+        Retorna un snapshot nuevo con el producto guardado (o borrado si es None)
+        La firma avanza como lo haría BIT_XOR en la BD: sale el CRC anterior de
+        la fila y entra el nuevo. Si nadie más escribió, coincide con la de la BD
+        y la próxima verificación no recarga.
+        """
+        anterior = self._crc(codigo)
+        if anterior is None and producto is None:
+            return self
+        total, firma = self.firma
+        if anterior is not None:
+            total, firma = total - 1, firma ^ anterior
+        if producto is not None:
+            total, firma = total + 1, firma ^ crc
+
+        cambios = dict(self.cambios)
+        cambios[codigo] = (producto, crc)
+        if len(cambios) <= CATALOG_CONFIG['max_cambios']:
+            return CatalogoSnapshot(self.base, (total, firma), cambios)
+
+        # Demasiados cambios: se consolidan en un índice base nuevo (sin ir a la BD)
+        crcs = dict(self.base.crc)
+        for code, (_, valor) in cambios.items():
+            if valor is None:
+                crcs.pop(code, None)
+            else:
+                crcs[code] = valor
+        vista = CatalogoSnapshot(self.base, (total, firma), cambios)
+        return CatalogoSnapshot(IndiceBase(vista.productos, crcs), (total, firma))
+
+
+def firma_catalogo(ejecutar: Callable[..., Any], tabla: str = 'products') -> Tuple[int, int]:
+    """(cantidad de filas, CRC32 combinado): cambia con cualquier escritura"""
+    fila = ejecutar(QUERY_FIRMA.format(tabla=tabla), None, fetch_one=True)
+    return (int(fila['total']), int(fila['firma']))
+
+
+def _clave_orden(producto: ProductoCache):
+    # Aproxima el ORDER BY name de la collation utf8mb4_unicode_ci
+    return (producto.name or '').casefold()
+
+
+# ============================================
+# CATÁLOGO POR CLIENTE
+# ============================================
+
+class CatalogoCliente:
+    """
+    Mantiene el snapshot vigente de un cliente
+    Las lecturas no toman locks: leen la referencia publicada en self.snapshot
+    """
+
+    def __init__(self, ejecutar: Callable[..., Any], tabla: str = 'products'):
+        # ejecutar tiene la firma de Repositorio.consultar(query, params, fetch_one)
+        self._ejecutar = ejecutar
+        self._tabla = tabla
+        self._lock = threading.Lock()
+        self._ultima_verificacion = 0.0
+        self.snapshot: Optional[CatalogoSnapshot] = None
+
+    def _firma_bd(self) -> Tuple:
+        return firma_catalogo(self._ejecutar, self._tabla)
+
+    def recargar(self):
+        """Reconstruye el snapshot completo desde la BD"""
+        self.snapshot = CatalogoSnapshot.desde_filas(self._ejecutar(QUERY_CATALOGO.format(tabla=self._tabla), None))
+        self._ultima_verificacion = time.monotonic()
+
+    def vigente(self) -> CatalogoSnapshot:
+        """Retorna el snapshot, recargándolo si la firma en BD cambió"""
+        ahora = time.monotonic()
+        if self.snapshot is not None and \
+                ahora - self._ultima_verificacion < CATALOG_CONFIG['intervalo_verificacion']:
+            return self.snapshot
+
+        # Un solo hilo verifica; el resto sigue leyendo el snapshot anterior
+        if not self._lock.acquire(blocking=self.snapshot is None):
+            return self.snapshot
+        try:
+            if self.snapshot is None:
+                self.recargar()
+            elif time.monotonic() - self._ultima_verificacion >= CATALOG_CONFIG['intervalo_verificacion']:
+                if self._firma_bd() != self.snapshot.firma:
+                    self.recargar()
+                else:
+                    self._ultima_verificacion = time.monotonic()
+        finally:
+            self._lock.release()
+        return self.snapshot
+
+    def obtener(self, codigo: str) -> Optional[ProductoCache]:
+        """Equivalente a WHERE code = %s OR reference = %s"""
+        return self.vigente().obtener(codigo)
+
+    def listar(self, limite: int = 1000) -> Tuple[ProductoCache, ...]:
+        """Productos ordenados por nombre"""
+        return self.vigente().productos[:limite]
+
+    def aplicar_guardado(self, codigo: str):
+        """Relee un producto recién guardado y lo publica en un snapshot nuevo"""
+        fila = self._ejecutar(QUERY_PRODUCTO.format(tabla=self._tabla), (codigo,), fetch_one=True)
+        with self._lock:
+            if self.snapshot is None:
+                return
+            if fila:
+                self.snapshot = self.snapshot.con_cambio(codigo, ProductoCache(fila), int(fila['crc']))
+            else:
+                self.snapshot = self.snapshot.con_cambio(codigo, None, None)
+
+    def aplicar_borrado(self, codigo: str):
+        """Publica un snapshot nuevo sin el producto eliminado"""
+        with self._lock:
+            if self.snapshot is not None:
+                self.snapshot = self.snapshot.con_cambio(codigo, None, None)
+
+
+# ============================================
+# REGISTRO DE CATÁLOGOS
+# ============================================
+
+_catalogos: Dict[str, CatalogoCliente] = {}
+_catalogos_lock = threading.Lock()
+
+
+def obtener_catalogo(clave: str, ejecutar: Callable[..., Any], tabla: str = 'products') -> CatalogoCliente:
+    """Retorna (creándolo si hace falta) el catálogo en memoria de un cliente"""
+    catalogo = _catalogos.get(clave)
+    if catalogo is None:
+        with _catalogos_lock:
+            catalogo = _catalogos.get(clave)
+            if catalogo is None:
+                catalogo = CatalogoCliente(ejecutar, tabla)
+                _catalogos[clave] = catalogo
+    return catalogo
@@ -0,0 +1,160 @@
+"""
+Esquema canónico de las bases de datos de clientes
+Única fuente del DDL de cliente_<subdominio>; admin_cliente.py lo usa para
+provisionar clientes nuevos. También define el modo compartido, donde todos
+los clientes viven en una sola tabla products particionada por tenant_id.
+"""
+
+import os
+import re
+import textwrap
+
+# Versión del esquema que crea DDL_PRODUCTS
+SCHEMA_VERSION = 1
+
+COLUMNAS_PRODUCTS = (
+    'id', 'reference', 'code', 'codetype', 'name', 'pricebuy', 'pricesell',
+    'category', 'taxcat', 'stockcost', 'stockvolume', 'stockunits',
+    'supplier', 'texttip', 'warranty'
+)
+
+DDL_DATABASE = (
+    "CREATE DATABASE IF NOT EXISTS `{db}` "
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+)
+
+# Tabla de productos (compatible con Unicenta/Chromis)
+DDL_PRODUCTS = """
+    CREATE TABLE IF NOT EXISTS `{db}`.products (
+        id VARCHAR(36) PRIMARY KEY,
+        reference VARCHAR(255) NOT NULL,
+        code VARCHAR(255) NOT NULL UNIQUE,
+        codetype VARCHAR(50) DEFAULT 'EAN-13',
+        name VARCHAR(255) NOT NULL,
+        pricebuy DECIMAL(10,2) DEFAULT 0.00,
+        pricesell DECIMAL(10,2) DEFAULT 0.00,
+        category VARCHAR(50) DEFAULT '000',
+        taxcat VARCHAR(50) DEFAULT '002',
+        stockcost DECIMAL(10,2) DEFAULT 0.00,
+        stockvolume DECIMAL(10,3) DEFAULT 0.000,
+        stockunits DECIMAL(10,3) DEFAULT 0.000,
+        supplier VARCHAR(50) DEFAULT '0',
+        texttip TEXT,
+        warranty TINYINT(1) DEFAULT 0,
+        INDEX idx_code (code),
+        INDEX idx_reference (reference)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# ============================================
+# MODO COMPARTIDO (una tabla products para todos)
+# ============================================
+
+# bd: una base por cliente (cliente_<subdominio>) | compartido: tabla única con tenant_id
+# unico: una sola tienda, BD de DB_* y tokens de APP_TOKENS, sin comparapp_admin
+TENANCY_MODE = os.getenv("TENANCY_MODE", "bd")
+SHARED_DB = os.getenv("SHARED_DB_NAME", "comparapp_compartido")
+SHARED_PARTITIONS = int(os.getenv("SHARED_DB_PARTITIONS", 32))
+
+DDL_PRODUCTS_COMPARTIDO = """
+    CREATE TABLE IF NOT EXISTS `{db}`.products (
+        tenant_id INT NOT NULL DEFAULT 0,
+        id VARCHAR(36) NOT NULL,
+        reference VARCHAR(255) NOT NULL,
+        code VARCHAR(255) NOT NULL,
+        codetype VARCHAR(50) DEFAULT 'EAN-13',
+        name VARCHAR(255) NOT NULL,
+        pricebuy DECIMAL(10,2) DEFAULT 0.00,
+        pricesell DECIMAL(10,2) DEFAULT 0.00,
+        category VARCHAR(50) DEFAULT '000',
+        taxcat VARCHAR(50) DEFAULT '002',
+        stockcost DECIMAL(10,2) DEFAULT 0.00,
+        stockvolume DECIMAL(10,3) DEFAULT 0.000,
+        stockunits DECIMAL(10,3) DEFAULT 0.000,
+        supplier VARCHAR(50) DEFAULT '0',
+        texttip TEXT,
+        warranty TINYINT(1) DEFAULT 0,
+        PRIMARY KEY (tenant_id, id),
+        UNIQUE KEY uk_tenant_code (tenant_id, code),
+        INDEX idx_tenant_reference (tenant_id, reference),
+        INDEX idx_tenant_name (tenant_id, name)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    PARTITION BY HASH (tenant_id) PARTITIONS {particiones}
+"""
+
+# Los INSERT llegan por la vista del cliente sin tenant_id: el trigger lo toma
+# de @tenant_id, que el repositorio fija en la sesión antes de escribir
+DDL_TRIGGER_COMPARTIDO = """
+    CREATE TRIGGER IF NOT EXISTS `{db}`.products_tenant_id
+    BEFORE INSERT ON `{db}`.products FOR EACH ROW
+    SET NEW.tenant_id = IF(NEW.tenant_id = 0, @tenant_id, NEW.tenant_id)
+"""
+
+_NOMBRE_VALIDO = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+def validar_nombre_bd(db_name: str) -> str:
+    """Los nombres de BD se interpolan en DDL: solo letras, números y _"""
+    if not db_name or not _NOMBRE_VALIDO.match(db_name):
+        raise ValueError(f"Nombre de base de datos inválido: {db_name!r}")
+    return db_name
+
+
+def ddl_cliente(db_name: str) -> list:
+    """Sentencias que crean la base de un cliente con el esquema vigente"""
+    db = validar_nombre_bd(db_name)
+    return [DDL_DATABASE.format(db=db), DDL_PRODUCTS.format(db=db)]
+
+
+def script_cliente(db_name: str) -> str:
+    """El DDL de ddl_cliente como script SQL (para los clientes de ejemplo de setup_database.sql)"""
+    return ''.join(textwrap.dedent(sentencia).strip() + ';\n' for sentencia in ddl_cliente(db_name))
+
+
+def sql_copiar_catalogo(origen: str, destino: str) -> str:
+    """INSERT ... SELECT que siembra un cliente desde un catálogo maestro"""
+    columnas = ', '.join(COLUMNAS_PRODUCTS)
+    return (
+        f"INSERT IGNORE INTO `{validar_nombre_bd(destino)}`.products ({columnas}) "
+        f"SELECT {columnas} FROM `{validar_nombre_bd(origen)}`.products"
+    )
+
+
+def ddl_compartido() -> list:
+    """Sentencias que crean la base compartida, su tabla y el trigger"""
+    db = validar_nombre_bd(SHARED_DB)
+    return [
+        DDL_DATABASE.format(db=db),
+        DDL_PRODUCTS_COMPARTIDO.format(db=db, particiones=SHARED_PARTITIONS),
+        DDL_TRIGGER_COMPARTIDO.format(db=db),
+    ]
+
+
+def vista_cliente(tenant_id: int) -> str:
+    """Nombre de la vista de un cliente dentro de la base compartida"""
+    return f"products_{int(tenant_id)}"
+
+
+def ddl_vista_cliente(tenant_id: int) -> str:
+    """
+    Vista actualizable con los productos de un cliente
+    ALGORITHM=MERGE: las consultas usan los índices (tenant_id, ...) de la tabla
+    WITH CHECK OPTION: un cliente no puede escribir filas de otro
+    """
+    columnas = ', '.join(COLUMNAS_PRODUCTS)
+    return (
+        f"CREATE OR REPLACE ALGORITHM=MERGE SQL SECURITY INVOKER "
+        f"VIEW `{validar_nombre_bd(SHARED_DB)}`.{vista_cliente(tenant_id)} AS "
+        f"SELECT {columnas} FROM `{SHARED_DB}`.products "
+        f"WHERE tenant_id = {int(tenant_id)} WITH CHECK OPTION"
+    )
+
+
+def sql_consolidar_cliente(origen: str, tenant_id: int) -> str:
+    """INSERT ... SELECT que mueve los productos de cliente_<x> a la tabla compartida"""
+    columnas = ', '.join(COLUMNAS_PRODUCTS)
+    return (
+        f"INSERT IGNORE INTO `{validar_nombre_bd(SHARED_DB)}`.products (tenant_id, {columnas}) "
+        f"SELECT {int(tenant_id)}, {columnas} FROM `{validar_nombre_bd(origen)}`.products"
+    )
+
@@ -0,0 +1,437 @@
+"""
+Etiquetas de precio en ESC/POS
+Código compartido entre la app web (impresión directa por red) y el puente de
+impresión local (server.py), para que ambos impriman exactamente lo mismo
+"""
+
+import os
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Pillow y multiprocessing se importan recién cuando se usan (cargar_pil y
+# _pool): en modo texto el arranque de cada worker no paga esos imports
+Image = ImageDraw = ImageFont = None
+_pil_disponible = None
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# texto: fuente interna de la impresora | raster: imagen 1-bit con GS v 0
+ETIQUETA_MODO = os.getenv("LABEL_MODE", "texto")
+
+# Ancho imprimible en puntos: 384 para 58mm, 576 para 80mm (203 dpi)
+RASTER_ANCHO = int(os.getenv("LABEL_RASTER_WIDTH", 384)) // 8 * 8
+
+# Recursos por cliente: <dir>/<cliente>/logo.png y <dir>/<cliente>/fuente.ttf
+# (<dir>/fuente.ttf es la fuente por defecto de todos los clientes)
+RECURSOS_DIR = os.getenv("LABEL_ASSETS_DIR", "etiquetas_recursos")
+FUENTE_SISTEMA = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+# Lotes de al menos esta cantidad de etiquetas se renderizan en paralelo
+LOTE_PARALELO_MIN = int(os.getenv("LABEL_PARALLEL_MIN", 500))
+LOTE_PARALELO_TRAMO = int(os.getenv("LABEL_PARALLEL_CHUNK", 200))
+LOTE_PARALELO_PROCESOS = int(os.getenv("LABEL_PARALLEL_WORKERS", 0)) or os.cpu_count() or 1
+
+
+# ============================================
+# ETIQUETAS EN MODO TEXTO
+# ============================================
+
+class ESCPOSCommands:
+    """Comandos ESC/POS para impresoras térmicas"""
+    
+    INIT = b'\x1b\x40'
+    LINE_FEED = b'\x0a'
+    CUT_PAPER = b'\x1d\x56\x41\x00'
+    
+    ALIGN_LEFT = b'\x1b\x61\x00'
+    ALIGN_CENTER = b'\x1b\x61\x01'
+    ALIGN_RIGHT = b'\x1b\x61\x02'
+    
+    TEXT_NORMAL = b'\x1d\x21\x00'
+    TEXT_DOUBLE_HEIGHT = b'\x1d\x21\x01'
+    TEXT_DOUBLE_WIDTH = b'\x1d\x21\x10'
+    TEXT_DOUBLE_BOTH = b'\x1d\x21\x11'
+    TEXT_LARGE = b'\x1d\x21\x22'
+    
+    BOLD_ON = b'\x1b\x45\x01'
+    BOLD_OFF = b'\x1b\x45\x00'
+    
+    BARCODE_HEIGHT = b'\x1d\x68\x50'
+    BARCODE_WIDTH = b'\x1d\x77\x02'
+    BARCODE_TEXT_BELOW = b'\x1d\x48\x02'
+    BARCODE_EAN13 = b'\x1d\x6b\x43'
+    
+    RASTER_IMAGE = b'\x1d\x76\x30\x00'
+
+
+def generar_etiqueta_producto(producto: Dict) -> bytes:
+    """
+    Genera comandos ESC/POS para imprimir etiqueta de producto
+    Optimizado para impresoras de 58mm
+    """
+    cmd = bytearray()
+    
+    # Inicializar
+    cmd.extend(ESCPOSCommands.INIT)
+    
+    # Título centrado
+    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
+    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
+    cmd.extend(ESCPOSCommands.BOLD_ON)
+    cmd.extend("ETIQUETA DE PRECIO\n".encode('utf-8'))
+    cmd.extend(ESCPOSCommands.BOLD_OFF)
+    cmd.extend(ESCPOSCommands.LINE_FEED)
+    
+    # Nombre del producto
+    nombre = producto.get('name', 'Sin nombre')[:28]
+    cmd.extend(ESCPOSCommands.ALIGN_LEFT)
+    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
+    cmd.extend(f"{nombre}\n".encode('utf-8'))
+    cmd.extend(ESCPOSCommands.LINE_FEED)
+    
+    # Precio grande
+    precio = float(producto.get('pricesell', 0))
+    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
+    cmd.extend(ESCPOSCommands.TEXT_LARGE)
+    cmd.extend(ESCPOSCommands.BOLD_ON)
+    cmd.extend(f"$ {precio:,.2f}\n".encode('utf-8'))
+    cmd.extend(ESCPOSCommands.BOLD_OFF)
+    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
+    cmd.extend(ESCPOSCommands.LINE_FEED)
+    
+    # Código de barras
+    codigo = producto.get('code', '')
+    if codigo and len(codigo) in [12, 13]:
+        cmd.extend(ESCPOSCommands.ALIGN_CENTER)
+        cmd.extend(ESCPOSCommands.BARCODE_HEIGHT)
+        cmd.extend(ESCPOSCommands.BARCODE_WIDTH)
+        cmd.extend(ESCPOSCommands.BARCODE_TEXT_BELOW)
+        
+        if len(codigo) == 12:
+            codigo = '0' + codigo
+        
+        cmd.extend(ESCPOSCommands.BARCODE_EAN13)
+        cmd.extend(bytes([len(codigo)]))
+        cmd.extend(codigo.encode('ascii'))
+        cmd.extend(ESCPOSCommands.LINE_FEED)
+    else:
+        cmd.extend(ESCPOSCommands.ALIGN_CENTER)
+        cmd.extend(f"COD: {codigo}\n".encode('utf-8'))
+    
+    cmd.extend(ESCPOSCommands.LINE_FEED)
+    
+    # Fecha
+    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
+    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
+    fecha = datetime.now().strftime('%d/%m/%Y %H:%M')
+    cmd.extend(f"{fecha}\n".encode('utf-8'))
+    
+    # Saltos y corte
+    cmd.extend(ESCPOSCommands.LINE_FEED * 3)
+    cmd.extend(ESCPOSCommands.CUT_PAPER)
+    
+    return bytes(cmd)
+
+
+def generar_etiqueta(producto: Dict, modo: Optional[str] = None) -> bytes:
+    """
+    Etiqueta en el modo configurado (LABEL_MODE)
+    producto['cliente'] elige logo y fuente en modo raster
+    """
+    if (modo or ETIQUETA_MODO) == 'raster' and cargar_pil():
+        return generar_etiqueta_raster(producto)
+    return generar_etiqueta_producto(producto)
+
+
+def cargar_pil() -> bool:
+    """Importa Pillow la primera vez; False si no está instalado"""
+    global Image, ImageDraw, ImageFont, _pil_disponible
+    if _pil_disponible is None:
+        try:
+            from PIL import Image, ImageDraw, ImageFont
+            _pil_disponible = True
+        except ImportError:
+            _pil_disponible = False
+    return _pil_disponible
+
+
+# ============================================
+# ETIQUETAS RASTER (Pillow)
+# ============================================
+# La etiqueta se arma en bandas horizontales (encabezado, nombre, precio,
+# código de barras), cada una ya codificada como GS v 0. Las bandas se cachean
+# por contenido: el encabezado de un cliente se renderiza una vez, y en un lote
+# los precios o nombres repetidos reusan los bytes de la etiqueta anterior.
+
+# Byte invertido: en Pillow 1 = blanco, en ESC/POS 1 = punto negro
+_INVERTIR = bytes(255 - i for i in range(256))
+
+EAN_L = ('0001101', '0011001', '0010011', '0111101', '0100011',
+         '0110001', '0101111', '0111011', '0110111', '0001011')
+EAN_G = tuple(c[::-1].translate(str.maketrans('01', '10')) for c in EAN_L)
+EAN_R = tuple(c.translate(str.maketrans('01', '10')) for c in EAN_L)
+EAN_PARIDAD = ('LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+               'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL')
+
+
+def raster_gs_v0(imagen) -> bytes:
+    """Codifica una imagen modo '1' (ancho múltiplo de 8) como GS v 0"""
+    ancho, alto = imagen.size
+    bytes_fila = ancho // 8
+    return (ESCPOSCommands.RASTER_IMAGE
+            + bytes((bytes_fila & 0xFF, bytes_fila >> 8, alto & 0xFF, alto >> 8))
+            + imagen.tobytes().translate(_INVERTIR))
+
+
+def modulos_ean13(codigo: str) -> str:
+    """Los 95 módulos (1 = barra) de un EAN-13 de 13 dígitos"""
+    izquierda = ''.join((EAN_L if p == 'L' else EAN_G)[int(d)]
+                        for p, d in zip(EAN_PARIDAD[int(codigo[0])], codigo[1:7]))
+    derecha = ''.join(EAN_R[int(d)] for d in codigo[7:13])
+    return '101' + izquierda + '01010' + derecha + '101'
+
+
+def _nueva(alto: int, ancho: int = None):
+    return Image.new('1', (ancho or RASTER_ANCHO, alto), 1)
+
+
+@lru_cache(maxsize=64)
+def _fuente(cliente: Optional[str], tamanio: int):
+    """Fuente del cliente, la general, la del sistema o la interna de Pillow"""
+    candidatas = [os.path.join(RECURSOS_DIR, 'fuente.ttf'), FUENTE_SISTEMA]
+    if cliente:
+        candidatas.insert(0, os.path.join(RECURSOS_DIR, cliente, 'fuente.ttf'))
+    for ruta in candidatas:
+        if os.path.exists(ruta):
+            return ImageFont.truetype(ruta, tamanio)
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def _glifo(cliente: Optional[str], caracter: str, tamanio: int):
+    """Un carácter del precio ya rasterizado"""
+    fuente = _fuente(cliente, tamanio)
+    izquierda, arriba, derecha, abajo = fuente.getbbox('0123456789$')
+    ancho = max(1, int(round(fuente.getlength(caracter))))
+    imagen = _nueva(abajo, ancho)
+    ImageDraw.Draw(imagen).text((0, 0), caracter, font=fuente, fill=0)
+    return imagen.crop((0, arriba, ancho, abajo))
+
+
+@lru_cache(maxsize=32)
+def _logo(cliente: Optional[str]):
+    """Logo del cliente escalado al ancho de la etiqueta y tramado a 1 bit, o None"""
+    if not cliente:
+        return None
+    ruta = os.path.join(RECURSOS_DIR, cliente, 'logo.png')
+    if not os.path.exists(ruta):
+        return None
+    with Image.open(ruta) as original:
+        logo = original.convert('L')
+    ancho = min(RASTER_ANCHO, logo.width)
+    alto = max(1, min(120, round(logo.height * ancho / logo.width)))
+    return logo.resize((ancho, alto)).convert('1')
+
+
+def _texto_centrado(dibujo, y: int, texto: str, fuente):
+    # Sin anchor='mm': la fuente interna de Pillow (sin FreeType) no lo soporta
+    x = max(0, (RASTER_ANCHO - int(fuente.getlength(texto))) // 2)
+    dibujo.text((x, y), texto, font=fuente, fill=0)
+
+
+def _centrar(imagen, alto: int):
+    """Pega la imagen centrada en una banda del ancho de la etiqueta"""
+    banda = _nueva(alto)
+    banda.paste(imagen, ((RASTER_ANCHO - imagen.width) // 2, (alto - imagen.height) // 2))
+    return banda
+
+
+@lru_cache(maxsize=32)
+def banda_encabezado(cliente: Optional[str]) -> bytes:
+    """Logo (si hay) y título; igual para todas las etiquetas del cliente"""
+    fuente = _fuente(cliente, 22)
+    titulo = _nueva(30)
+    _texto_centrado(ImageDraw.Draw(titulo), 3, "ETIQUETA DE PRECIO", fuente)
+    logo = _logo(cliente)
+    if logo is None:
+        return raster_gs_v0(titulo)
+    return raster_gs_v0(_centrar(logo, logo.height + 8)) + raster_gs_v0(titulo)
+
+
+def _partir_nombre(nombre: str, fuente, lineas: int = 3) -> List[str]:
+    """Corta el nombre en palabras que entren en el ancho, hasta `lineas` renglones"""
+    renglones, actual = [], ''
+    for palabra in nombre.split():
+        candidato = f"{actual} {palabra}".strip()
+        if fuente.getlength(candidato) <= RASTER_ANCHO - 8 or not actual:
+            actual = candidato
+        else:
+            renglones.append(actual)
+            actual = palabra
+    if actual:
+        renglones.append(actual)
+    if len(renglones) > lineas:
+        renglones = renglones[:lineas]
+        renglones[-1] = renglones[-1].rstrip() + '…'
+    return renglones or ['Sin nombre']
+
+
+@lru_cache(maxsize=1024)
+def banda_nombre(cliente: Optional[str], nombre: str) -> bytes:
+    fuente = _fuente(cliente, 26)
+    renglones = _partir_nombre(nombre, fuente)
+    alto_linea = 30
+    imagen = _nueva(alto_linea * len(renglones) + 6)
+    dibujo = ImageDraw.Draw(imagen)
+    for i, renglon in enumerate(renglones):
+        dibujo.text((4, 3 + i * alto_linea), renglon, font=fuente, fill=0)
+    return raster_gs_v0(imagen)
+
+
+@lru_cache(maxsize=1024)
+def banda_precio(cliente: Optional[str], precio: str) -> bytes:
+    """Precio compuesto con glifos cacheados (sin volver a rasterizar la fuente)"""
+    glifos = [_glifo(cliente, c, 64) for c in precio]
+    ancho = sum(g.width for g in glifos)
+    alto = max(g.height for g in glifos)
+    if ancho > RASTER_ANCHO:
+        glifos = [_glifo(cliente, c, 44) for c in precio]
+        ancho = sum(g.width for g in glifos)
+        alto = max(g.height for g in glifos)
+    imagen = _nueva(alto + 12)
+    x = max(0, (RASTER_ANCHO - ancho) // 2)
+    for glifo in glifos:
+        imagen.paste(glifo, (x, 6 + alto - glifo.height))
+        x += glifo.width
+    return raster_gs_v0(imagen)
+
+
+@lru_cache(maxsize=1024)
+def banda_codigo(cliente: Optional[str], codigo: str) -> bytes:
+    """EAN-13 dibujado con sus dígitos; otros códigos van como texto"""
+    fuente = _fuente(cliente, 20)
+    if len(codigo) == 12 and codigo.isdigit():
+        codigo = '0' + codigo
+    if len(codigo) != 13 or not codigo.isdigit():
+        imagen = _nueva(28)
+        _texto_centrado(ImageDraw.Draw(imagen), 3, f"COD: {codigo}", fuente)
+        return raster_gs_v0(imagen)
+
+    modulo = max(1, min(3, (RASTER_ANCHO - 24) // 95))
+    alto_barras = 80
+    imagen = _nueva(alto_barras + 28)
+    dibujo = ImageDraw.Draw(imagen)
+    x0 = (RASTER_ANCHO - 95 * modulo) // 2
+    for i, bit in enumerate(modulos_ean13(codigo)):
+        if bit == '1':
+            dibujo.rectangle((x0 + i * modulo, 0, x0 + (i + 1) * modulo - 1, alto_barras - 1), fill=0)
+    _texto_centrado(dibujo, alto_barras + 3, codigo, fuente)
+    return raster_gs_v0(imagen)
+
+
+def generar_etiqueta_raster(producto: Dict) -> bytes:
+    """
+    Misma etiqueta que generar_etiqueta_producto, como imagen: nombre completo
+    en hasta 3 renglones, logo del cliente y fuente propia
+    """
+    if not cargar_pil():
+        raise RuntimeError("El modo raster requiere Pillow (pip install Pillow)")
+    cliente = producto.get('cliente')
+    precio = float(producto.get('pricesell', 0) or 0)
+
+    cmd = bytearray()
+    cmd.extend(ESCPOSCommands.INIT)
+    cmd.extend(ESCPOSCommands.ALIGN_CENTER)
+    cmd.extend(banda_encabezado(cliente))
+    cmd.extend(banda_nombre(cliente, producto.get('name') or 'Sin nombre'))
+    cmd.extend(banda_precio(cliente, f"$ {precio:,.2f}"))
+    cmd.extend(banda_codigo(cliente, str(producto.get('code') or '')))
+
+    # La fecha cambia cada minuto: va en modo texto para no invalidar bandas
+    cmd.extend(ESCPOSCommands.TEXT_NORMAL)
+    cmd.extend(f"{datetime.now().strftime('%d/%m/%Y %H:%M')}\n".encode('utf-8'))
+    cmd.extend(ESCPOSCommands.LINE_FEED * 3)
+    cmd.extend(ESCPOSCommands.CUT_PAPER)
+    return bytes(cmd)
+
+
+def limpiar_cache_raster():
+    """Descarta logos, fuentes y bandas (p. ej. después de cambiar un logo)"""
+    for funcion in (_fuente, _glifo, _logo, banda_encabezado, banda_nombre, banda_precio, banda_codigo):
+        funcion.cache_clear()
+
+
+# ============================================
+# RENDER EN PARALELO (lotes grandes)
+# ============================================
+# Un reetiquetado completo son decenas de miles de etiquetas: se reparten por
+# tramos entre procesos y se devuelven en orden a medida que terminan. Solo
+# hay unos pocos tramos en vuelo a la vez, así la memoria no crece con el lote.
+
+_pool_procesos = None
+_pool_lock = threading.Lock()
+
+
+def _pool():
+    global _pool_procesos
+    if _pool_procesos is None:
+        with _pool_lock:
+            if _pool_procesos is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # forkserver: los workers de gunicorn tienen hilos y un fork
+                # directo podría heredar locks tomados por otro hilo
+                metodo = 'forkserver' if sys.platform.startswith('linux') else 'spawn'
+                _pool_procesos = ProcessPoolExecutor(
+                    max_workers=LOTE_PARALELO_PROCESOS,
+                    mp_context=multiprocessing.get_context(metodo)
+                )
+    return _pool_procesos
+
+
+def cerrar_pool():
+    global _pool_procesos
+    with _pool_lock:
+        if _pool_procesos is not None:
+            _pool_procesos.shutdown(wait=False, cancel_futures=True)
+            _pool_procesos = None
+
+
+def _renderizar_tramo(productos: List[Dict], modo: str) -> List[bytes]:
+    return [generar_etiqueta(p, modo) for p in productos]
+
+
+def generar_etiquetas(productos: Iterable[Dict], modo: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Etiquetas de un lote en el mismo orden que los productos
+    Con menos de LABEL_PARALLEL_MIN se generan en este hilo; con más, en un
+    pool de procesos por tramos, con como mucho 2 tramos por proceso en vuelo
+    """
+    modo = modo or ETIQUETA_MODO
+    productos = list(productos)
+    if len(productos) < LOTE_PARALELO_MIN or LOTE_PARALELO_PROCESOS < 2:
+        for producto in productos:
+            yield generar_etiqueta(producto, modo)
+        return
+
+    pool = _pool()
+    tramos = (productos[i:i + LOTE_PARALELO_TRAMO]
+              for i in range(0, len(productos), LOTE_PARALELO_TRAMO))
+    en_vuelo = deque()
+    try:
+        for tramo in tramos:
+            en_vuelo.append(pool.submit(_renderizar_tramo, tramo, modo))
+            if len(en_vuelo) >= 2 * LOTE_PARALELO_PROCESOS:
+                yield from en_vuelo.popleft().result()
+        while en_vuelo:
+            yield from en_vuelo.popleft().result()
+    finally:
+        # Si el consumidor corta (p. ej. la impresora falló) no se sigue renderizando
+        for futuro in en_vuelo:
+            futuro.cancel()
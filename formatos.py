@@ -0,0 +1,116 @@
+"""
+Formatos de respuesta para listados grandes de productos
+Negociación de contenido entre JSON clásico (una fila = un objeto), JSON
+columnar (un array por columna) y MessagePack columnar para el cliente POS,
+más ETag / If-None-Match y Cache-Control para las consultas de catálogo
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Optional, Sequence
+
+from flask import Response, request
+
+FORMATO_JSON = 'json'
+FORMATO_COLUMNAR = 'columnar'
+FORMATO_MSGPACK = 'msgpack'
+
+# max-age de Cache-Control para respuestas de catálogo (0 = revalidar siempre)
+CACHE_MAX_AGE = int(os.getenv("CACHE_CONTROL_MAX_AGE", 0))
+
+MIMETYPES = {
+    FORMATO_JSON: 'application/json',
+    FORMATO_COLUMNAR: 'application/vnd.comparapp.columnar+json',
+    FORMATO_MSGPACK: 'application/x-msgpack',
+}
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def negociar_formato() -> str:
+    """
+    Elige el formato según ?formato= o el header Accept
+    Si se pide MessagePack y la librería no está instalada se responde columnar
+    """
+    formato = request.args.get('formato', '').lower()
+    if formato not in MIMETYPES:
+        formato = FORMATO_JSON
+        accept = request.accept_mimetypes
+        for candidato in (FORMATO_MSGPACK, FORMATO_COLUMNAR):
+            if accept[MIMETYPES[candidato]] > accept['application/json']:
+                formato = candidato
+                break
+
+    if formato == FORMATO_MSGPACK and msgpack is None:
+        formato = FORMATO_COLUMNAR
+    return formato
+
+
+def columnar(filas: Iterable, columnas: Sequence[str], numericas: Sequence[str] = ()) -> Dict:
+    """
+    Transpone filas (dicts o ProductoCache) a {'columna': [valores...]}
+    Las columnas numéricas se convierten a float y los NULL a 0
+    """
+    datos = {c: [] for c in columnas}
+    agregar = [(c, datos[c].append, c in numericas) for c in columnas]
+    total = 0
+    for fila in filas:
+        total += 1
+        for columna, append, numerica in agregar:
+            valor = fila[columna]
+            if numerica:
+                valor = float(valor) if valor else 0
+            append(valor)
+    return {'total': total, 'columnas': datos}
+
+
+def serializar(cuerpo: Dict, formato: str) -> bytes:
+    """Serializa el cuerpo de la respuesta al formato negociado"""
+    if formato == FORMATO_MSGPACK:
+        return msgpack.packb(cuerpo, use_bin_type=True)
+    return json.dumps(cuerpo, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+
+def etag_de(*partes) -> str:
+    """ETag fuerte a partir de una versión conocida (no requiere el cuerpo)"""
+    return hashlib.sha1('|'.join(str(p) for p in partes).encode('utf-8')).hexdigest()
+
+
+def _cabeceras_cache(resp: Response, etag: str):
+    resp.set_etag(etag)
+    resp.vary.update(('Accept', 'Authorization'))
+    if CACHE_MAX_AGE > 0:
+        # Cacheable por nginx durante max-age; después revalida con If-None-Match
+        resp.cache_control.max_age = CACHE_MAX_AGE
+        resp.cache_control.must_revalidate = True
+    else:
+        resp.cache_control.no_cache = True
+
+
+def no_modificado(etag: str) -> Optional[Response]:
+    """Respuesta 304 si el cliente ya tiene la versión etag; None si no"""
+    if etag not in request.if_none_match:
+        return None
+    resp = Response(status=304)
+    _cabeceras_cache(resp, etag)
+    return resp
+
+
+def condicional(resp: Response, etag: Optional[str] = None) -> Response:
+    """
+    Agrega ETag (por defecto el hash del cuerpo) y Cache-Control, y convierte
+    la respuesta en 304 si coincide con If-None-Match
+    """
+    if etag is None:
+        etag = hashlib.sha1(resp.get_data()).hexdigest()
+    _cabeceras_cache(resp, etag)
+    return resp.make_conditional(request)
+
+
+def respuesta(cuerpo: bytes, formato: str, etag: Optional[str] = None) -> Response:
+    """Arma la respuesta en el formato negociado como respuesta condicional"""
+    return condicional(Response(cuerpo, mimetype=MIMETYPES[formato]), etag)
@@ -0,0 +1,94 @@
+"""
+Configuración de gunicorn para ComparApp
+Workers gthread: una impresora lenta o una consulta larga bloquean un hilo, no
+el worker entero. La app se carga una vez en el master (preload_app) y cada
+worker arranca con pools vacíos y los calienta antes de recibir tráfico.
+"""
+
+import multiprocessing
+import os
+
+# ============================================
+# DIMENSIONAMIENTO
+# ============================================
+# workers = 2 × CPU + 1 (tope GUNICORN_MAX_WORKERS)
+# threads = conexiones ociosas del pool por worker (DB_POOL_SIZE), así cada
+#           hilo tiene una conexión lista sin abrir una nueva por request
+# Si workers × threads supera el presupuesto de conexiones de MariaDB
+# (DB_MAX_CONNECTIONS menos un margen para admin/POS), se reducen los hilos.
+
+CPUS = multiprocessing.cpu_count()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 150))
+DB_MARGEN_CONEXIONES = int(os.getenv("DB_RESERVED_CONNECTIONS", 20))
+
+
+def calcular_workers(cpus: int = CPUS) -> int:
+    maximo = int(os.getenv("GUNICORN_MAX_WORKERS", 9))
+    return max(2, min(2 * cpus + 1, maximo))
+
+
+def calcular_threads(workers: int) -> int:
+    presupuesto = max(1, (DB_MAX_CONNECTIONS - DB_MARGEN_CONEXIONES) // workers)
+    return max(2, min(DB_POOL_SIZE, presupuesto))
+
+
+workers = int(os.getenv("GUNICORN_WORKERS", 0)) or calcular_workers()
+threads = int(os.getenv("GUNICORN_THREADS", 0)) or calcular_threads(workers)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# ============================================
+# SERVIDOR
+# ============================================
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+preload_app = True
+# Con gthread el timeout es del worker (heartbeat), no de cada request
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+# Recicla workers de a poco para acotar fragmentación de memoria
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10 if max_requests else 0
+
+accesslog = "-"
+errorlog = "-"
+
+
+# ============================================
+# HOOKS
+# ============================================
+
+def when_ready(server):
+    server.log.info(f"ComparApp: {workers} workers {worker_class} × {threads} hilos "
+                    f"({CPUS} CPU, pool {DB_POOL_SIZE})")
+    # Los token buckets en memoria son de cada worker: el límite real se multiplica
+    if os.getenv("RATE_LIMIT", "1") == "1" and os.getenv("CACHE_BACKEND", "memoria") != "redis" and workers > 1:
+        server.log.warning(f"RATE_LIMIT sin Redis: cada uno de los {workers} workers lleva su propio "
+                           f"balde, un cliente puede llegar a {workers}× el límite (usar CACHE_BACKEND=redis)")
+
+
+def post_fork(server, worker):
+    """Las conexiones abiertas en el master no se comparten con los workers"""
+    import app as aplicacion
+    aplicacion.reiniciar_conexiones()
+
+
+def post_worker_init(worker):
+    """
+    Retoma trabajos y arranca el agregador de stock; después abre conexiones y
+    carga caches antes de aceptar requests (WORKER_WARMUP=0 omite solo esto último)
+    """
+    import app as aplicacion
+    import limites
+    # Los lotes en espera de turno ocupan hilos: nunca todos los del worker
+    limites.cola_pesada.limitar_hilos(threads, limites.HILOS_RESERVADOS)
+    aplicacion.iniciar_tareas_de_fondo()
+    if os.getenv("WORKER_WARMUP", "1") != "1":
+        return
+    try:
+        tiempos = aplicacion.calentar(conexiones=threads)
+        detalle = ', '.join(f"{fase} {ms:.0f}ms" for fase, ms in tiempos.items())
+        worker.log.info(f"Worker {worker.pid} caliente en {sum(tiempos.values()):.0f}ms ({detalle})")
+    except Exception as e:
+        worker.log.warning(f"Calentamiento incompleto: {e}")
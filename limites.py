@@ -0,0 +1,284 @@
+"""
+Límites de uso por cliente
+Token bucket por cliente con presupuestos separados para consultas baratas
+(escaneos) y operaciones pesadas (listados, exportaciones, lotes), más una
+cola justa ponderada que reparte entre clientes los pocos turnos de trabajo
+pesado de cada worker: los escaneos nunca esperan detrás de un lote de 5000.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from flask import g, jsonify, request
+
+import cache
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+CONSULTA = 'consulta'
+PESADA = 'pesada'
+
+LIMITES_CONFIG = {
+    'habilitado': os.getenv("RATE_LIMIT", "1") == "1",
+    # tasa = tokens por segundo, rafaga = capacidad del balde
+    CONSULTA: {
+        'tasa': float(os.getenv("RATE_CONSULTA_TASA", 20)),
+        'rafaga': float(os.getenv("RATE_CONSULTA_RAFAGA", 60)),
+    },
+    PESADA: {
+        'tasa': float(os.getenv("RATE_PESADA_TASA", 0.5)),
+        'rafaga': float(os.getenv("RATE_PESADA_RAFAGA", 10)),
+    },
+}
+
+COLA_PESADA_CONFIG = {
+    # Trabajos pesados simultáneos por worker
+    'concurrencia': int(os.getenv("HEAVY_CONCURRENCY", 1)),
+    'max_en_espera': int(os.getenv("HEAVY_QUEUE_MAX", 20)),
+    'espera_maxima': float(os.getenv("HEAVY_QUEUE_TIMEOUT", 30)),
+}
+
+# Hilos del worker que los trabajos pesados (corriendo o esperando turno) nunca
+# ocupan, para que los escaneos siempre tengan uno libre (0 = la mitad)
+HILOS_RESERVADOS = int(os.getenv("HEAVY_RESERVED_THREADS", 0))
+
+# Peso de cada cliente en la cola justa: "tienda1=2,tienda2=1" (default 1)
+PESOS = {
+    clave.strip(): float(valor)
+    for clave, _, valor in (p.partition('=') for p in os.getenv("HEAVY_WEIGHTS", "").split(','))
+    if clave.strip() and valor.strip()
+}
+
+
+def clave_cliente() -> str:
+    """Cliente del request: subdominio (o cliente de APP_TOKENS) autenticado, o IP"""
+    cliente = g.get('cliente')
+    if cliente:
+        return cliente['subdominio']
+    return request.remote_addr or 'anonimo'
+
+
+# ============================================
+# MÉTRICAS
+# ============================================
+
+_lock_metricas = threading.Lock()
+_contadores = defaultdict(Counter)      # categoría -> {resultado: n}
+_rechazos_cliente = defaultdict(Counter)    # categoría -> {cliente: n}
+
+
+def _contar(categoria: str, resultado: str, cliente: str = None):
+    with _lock_metricas:
+        _contadores[categoria][resultado] += 1
+        if cliente is not None:
+            _rechazos_cliente[categoria][cliente] += 1
+
+
+def estadisticas() -> Dict:
+    """Permitidas/rechazadas por presupuesto y estado de la cola pesada de este worker"""
+    with _lock_metricas:
+        buckets = {
+            categoria: {
+                **dict(_contadores[categoria]),
+                'rechazos_por_cliente': dict(_rechazos_cliente[categoria].most_common(10))
+            }
+            for categoria in (CONSULTA, PESADA)
+        }
+    return {'habilitado': LIMITES_CONFIG['habilitado'], 'buckets': buckets,
+            'cola_pesada': cola_pesada.estado()}
+
+
+# ============================================
+# TOKEN BUCKET
+# ============================================
+
+def respuesta_limite(mensaje: str, espera: float, estado: int = 429):
+    respuesta = jsonify({'success': False, 'error': mensaje,
+                         'reintentar_en': round(espera, 1)})
+    respuesta.status_code = estado
+    respuesta.headers['Retry-After'] = str(max(1, int(espera + 0.999)))
+    return respuesta
+
+
+def limitar(categoria: str):
+    """
+    Decorador: descuenta un token del presupuesto `categoria` del cliente
+    Va debajo del decorador de autenticación para conocer al cliente
+
+        @app.route('/api/productos')
+        @requiere_auth
+        @limitar(PESADA)
+    """
+    def decorador(f):
+        @wraps(f)
+        def envuelta(*args, **kwargs):
+            if not LIMITES_CONFIG['habilitado']:
+                return f(*args, **kwargs)
+            cliente = clave_cliente()
+            presupuesto = LIMITES_CONFIG[categoria]
+            try:
+                permitido, espera = cache.tomar_token(categoria, cliente, presupuesto['tasa'],
+                                                      presupuesto['rafaga'])
+            except Exception as e:
+                # Sin backend de límites se atiende igual: mejor sin límite que caído
+                print(f"⚠️  Límite {categoria} no disponible: {e}")
+                _contar(categoria, 'errores')
+                return f(*args, **kwargs)
+            if not permitido:
+                _contar(categoria, 'rechazadas', cliente)
+                return respuesta_limite('Demasiadas solicitudes', espera)
+            _contar(categoria, 'permitidas')
+            return f(*args, **kwargs)
+        return envuelta
+    return decorador
+
+
+# ============================================
+# COLA JUSTA PONDERADA
+# ============================================
+
+class ColaSaturada(Exception):
+    """No hay lugar (o se agotó la espera) para un trabajo pesado"""
+
+
+class ColaJusta:
+    """
+    Start-time fair queueing: cada trabajo recibe una etiqueta de fin
+    virtual = inicio + costo / peso y se atiende siempre la menor. Un cliente
+    que encola lotes enormes avanza su reloj propio y deja pasar a los demás.
+    """
+
+    def __init__(self, concurrencia: int, max_en_espera: int, espera_maxima: float):
+        self.concurrencia = max(1, concurrencia)
+        self.max_en_espera = max_en_espera
+        self.espera_maxima = espera_maxima
+        # Hilos que pueden ocupar los trabajos pesados, corriendo o en espera (None = sin tope)
+        self.plazas: Optional[int] = None
+        self._cond = threading.Condition()
+        self._espera = []       # heap de (fin virtual, secuencia, cliente)
+        self._fin_cliente: Dict[str, float] = {}
+        self._virtual = 0.0
+        self._activos = 0
+        self._secuencia = itertools.count()
+        self._metricas = Counter()
+        self._espera_max_ms = 0.0
+
+    def limitar_hilos(self, hilos: int, reservados: int = 0):
+        """
+        Cada trabajo en espera ocupa un hilo del worker: los pesados, corriendo
+        o esperando, se limitan a `hilos - reservados` (default la mitad) y el
+        resto queda siempre libre para los escaneos
+        """
+        reservados = reservados or max(1, hilos // 2)
+        with self._cond:
+            self.plazas = max(1, hilos - reservados)
+            self.concurrencia = min(self.concurrencia, self.plazas)
+            self.max_en_espera = min(self.max_en_espera, self.plazas - self.concurrencia)
+
+    @contextmanager
+    def turno(self, cliente: str, costo: float = 1, peso: float = 1.0):
+        with self._cond:
+            debe_esperar = self._activos >= self.concurrencia or bool(self._espera)
+            lleno = debe_esperar and len(self._espera) >= self.max_en_espera
+            sin_hilos = self.plazas is not None and self._activos + len(self._espera) >= self.plazas
+            if lleno or sin_hilos:
+                self._metricas['rechazados'] += 1
+                raise ColaSaturada(f"{self._activos} trabajos pesados en curso y {len(self._espera)} en espera")
+
+            inicio = max(self._virtual, self._fin_cliente.get(cliente, 0.0))
+            fin = inicio + max(costo, 1) / max(peso, 0.01)
+            self._fin_cliente[cliente] = fin
+            ticket = (fin, next(self._secuencia), cliente)
+            heapq.heappush(self._espera, ticket)
+
+            llegada = time.monotonic()
+            limite = llegada + self.espera_maxima
+            if self._activos >= self.concurrencia or self._espera[0] is not ticket:
+                self._metricas['encolados'] += 1
+            while self._activos >= self.concurrencia or self._espera[0] is not ticket:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._espera.remove(ticket)
+                    heapq.heapify(self._espera)
+                    # Se devuelve el avance del reloj de un trabajo que no corrió
+                    if self._fin_cliente.get(cliente) == fin:
+                        self._fin_cliente[cliente] = inicio
+                    self._metricas['vencidos'] += 1
+                    self._cond.notify_all()
+                    raise ColaSaturada(f"Sin turno tras {self.espera_maxima:.0f}s")
+                self._cond.wait(restante)
+
+            heapq.heappop(self._espera)
+            self._virtual = inicio
+            self._activos += 1
+            espera_ms = (time.monotonic() - llegada) * 1000
+            self._metricas['atendidos'] += 1
+            self._metricas['espera_ms_total'] += espera_ms
+            self._espera_max_ms = max(self._espera_max_ms, espera_ms)
+            # Con trabajo libre, el siguiente de la cola puede entrar
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._activos -= 1
+                if not self._activos and not self._espera:
+                    # Cola vacía: los relojes viejos no deben penalizar al próximo
+                    self._fin_cliente.clear()
+                    self._virtual = 0.0
+                self._cond.notify_all()
+
+    def estado(self) -> Dict:
+        with self._cond:
+            atendidos = self._metricas['atendidos']
+            return {
+                'activos': self._activos,
+                'en_espera': len(self._espera),
+                'concurrencia': self.concurrencia,
+                'max_en_espera': self.max_en_espera,
+                'plazas': self.plazas,
+                'atendidos': atendidos,
+                'encolados': self._metricas['encolados'],
+                'rechazados': self._metricas['rechazados'],
+                'vencidos': self._metricas['vencidos'],
+                'espera_promedio_ms': round(self._metricas['espera_ms_total'] / atendidos, 1) if atendidos else 0,
+                'espera_max_ms': round(self._espera_max_ms, 1),
+            }
+
+
+cola_pesada = ColaJusta(**COLA_PESADA_CONFIG)
+
+
+def turno_pesado(costo: Optional[Callable[[], float]] = None):
+    """
+    Decorador: ejecuta la vista dentro de un turno de la cola justa
+    `costo` se evalúa dentro del request (p. ej. cantidad de códigos del lote)
+
+        @limitar(PESADA)
+        @turno_pesado(costo=lambda: len(request.json.get('codigos', [])))
+    """
+    def decorador(f):
+        @wraps(f)
+        def envuelta(*args, **kwargs):
+            cliente = clave_cliente()
+            try:
+                unidades = costo() if costo else 1
+            except Exception:
+                unidades = 1
+            try:
+                with cola_pesada.turno(cliente, unidades, PESOS.get(cliente, 1.0)):
+                    return f(*args, **kwargs)
+            except ColaSaturada as e:
+                return respuesta_limite(f'Servidor ocupado con trabajos pesados: {e}',
+                                        COLA_PESADA_CONFIG['espera_maxima'], 503)
+        return envuelta
+    return decorador
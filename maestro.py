@@ -0,0 +1,220 @@
+"""
+Catálogo maestro compartido entre clientes
+Los productos de marca nacional (mismo EAN en todas las tiendas) tienen un
+registro de metadatos en comparapp_admin.catalogo_maestro. Una búsqueda que no
+está en el cliente se resuelve contra un índice en memoria del maestro, uno
+por worker y compartido por todos los clientes, así una tienda nueva no
+necesita copiar el catálogo. Lo que el cliente sí carga (con precio o stock)
+sigue siendo una fila completa de su products, que es lo que lee el POS.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import esquema
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+ADMIN_DB = 'comparapp_admin'
+
+MAESTRO_CONFIG = {
+    'habilitado': os.getenv("MASTER_CATALOG", "0") == "1",
+    # Cada cuántos segundos se buscan cambios del maestro en la BD
+    'intervalo_verificacion': float(os.getenv("MASTER_CATALOG_CHECK_INTERVAL", 60)),
+}
+
+COLUMNAS = ('code', 'reference', 'codetype', 'name', 'category', 'taxcat')
+
+DDL_MAESTRO = f"""
+    CREATE TABLE IF NOT EXISTS `{ADMIN_DB}`.catalogo_maestro (
+        code VARCHAR(255) NOT NULL PRIMARY KEY,
+        reference VARCHAR(255) NOT NULL,
+        codetype VARCHAR(50) DEFAULT 'EAN-13',
+        name VARCHAR(255) NOT NULL,
+        category VARCHAR(50) DEFAULT '000',
+        taxcat VARCHAR(50) DEFAULT '002',
+        actualizado DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+        INDEX idx_actualizado (actualizado)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+_SELECT = f"SELECT {', '.join(COLUMNAS)}, actualizado FROM `{ADMIN_DB}`.catalogo_maestro"
+
+QUERY_MAESTRO = _SELECT
+
+# >= y no >: filas escritas en el mismo milisegundo que la última leída
+QUERY_CAMBIOS = _SELECT + " WHERE actualizado >= %s"
+
+QUERY_FIRMA = f"SELECT COUNT(*) AS total, MAX(actualizado) AS hasta FROM `{ADMIN_DB}`.catalogo_maestro"
+
+# Copia sin uso: repite los metadatos del maestro y nunca tuvo precio ni stock
+# propios (restos de un catálogo copiado al dar de alta). Los productos con
+# precio o stock no se tocan: el cliente los guarda completos
+_REDUNDANTE = f"""
+    FROM {{tabla}} p JOIN `{ADMIN_DB}`.catalogo_maestro m ON m.code = p.code
+    WHERE p.name = m.name AND p.reference = m.reference
+      AND COALESCE(p.pricebuy, 0) = 0 AND COALESCE(p.pricesell, 0) = 0
+      AND COALESCE(p.stockunits, 0) = 0
+"""
+
+
+def tabla_cliente(cliente: Dict) -> str:
+    """products del cliente: su BD o su vista en la base compartida"""
+    if esquema.TENANCY_MODE == 'compartido':
+        return f"`{esquema.SHARED_DB}`.{esquema.vista_cliente(cliente['id'])}"
+    return f"`{esquema.validar_nombre_bd(cliente['db_name'])}`.products"
+
+
+def sql_importar(origen: str) -> str:
+    """
+    INSERT ... SELECT que agrega al maestro los productos de una BD de cliente
+    Los códigos que ya están en el maestro no se pisan
+    """
+    columnas = ', '.join(COLUMNAS)
+    return (
+        f"INSERT IGNORE INTO `{ADMIN_DB}`.catalogo_maestro ({columnas}) "
+        f"SELECT {columnas} FROM `{esquema.validar_nombre_bd(origen)}`.products WHERE code <> ''"
+    )
+
+
+def sql_contar_redundantes(cliente: Dict) -> str:
+    return "SELECT COUNT(*) AS total " + _REDUNDANTE.format(tabla=tabla_cliente(cliente))
+
+
+def sql_borrar_redundantes(cliente: Dict) -> str:
+    return "DELETE p " + _REDUNDANTE.format(tabla=tabla_cliente(cliente))
+
+
+# ============================================
+# ÍNDICE EN MEMORIA
+# ============================================
+
+class ProductoMaestro:
+    """Metadatos de un producto del maestro; se accede como un dict de DictCursor"""
+
+    __slots__ = COLUMNAS
+
+    def __init__(self, fila: Dict):
+        for columna in COLUMNAS:
+            setattr(self, columna, fila.get(columna))
+
+    def __getitem__(self, columna: str):
+        return getattr(self, columna)
+
+    def get(self, columna: str, default=None):
+        return getattr(self, columna, default)
+
+
+class IndiceMaestro:
+    """
+    Copia del maestro en un dict code -> ProductoMaestro que se reemplaza
+    entera al cambiar (copy-on-write): las lecturas no toman locks. Las
+    verificaciones traen solo las filas con `actualizado` nuevo; si la
+    cantidad de filas no cierra (hubo borrados), se recarga todo.
+    """
+
+    def __init__(self, consultar: Callable[..., Any]):
+        # consultar tiene la firma de Repositorio.consultar(query, params, fetch_one)
+        self._consultar = consultar
+        self._lock = threading.Lock()
+        self._ultima_verificacion = 0.0
+        self._hasta = None
+        self.productos: Optional[Dict[str, ProductoMaestro]] = None
+        self.recargas = 0
+        self.actualizaciones = 0
+
+    def recargar(self):
+        filas = self._consultar(QUERY_MAESTRO, None)
+        self.productos = {f['code']: ProductoMaestro(f) for f in filas}
+        self._hasta = max((f['actualizado'] for f in filas), default=None)
+        self._ultima_verificacion = time.monotonic()
+        self.recargas += 1
+
+    def _actualizar(self):
+        firma = self._consultar(QUERY_FIRMA, None, fetch_one=True)
+        if firma['hasta'] != self._hasta and self._hasta is not None:
+            cambios = self._consultar(QUERY_CAMBIOS, (self._hasta,))
+            productos = dict(self.productos)
+            for f in cambios:
+                productos[f['code']] = ProductoMaestro(f)
+            self.productos = productos
+            self._hasta = max([self._hasta] + [f['actualizado'] for f in cambios])
+            self.actualizaciones += 1
+        if int(firma['total']) != len(self.productos):
+            self.recargar()
+        self._ultima_verificacion = time.monotonic()
+
+    def vigente(self) -> Dict[str, ProductoMaestro]:
+        ahora = time.monotonic()
+        if self.productos is not None and \
+                ahora - self._ultima_verificacion < MAESTRO_CONFIG['intervalo_verificacion']:
+            return self.productos
+
+        # Un solo hilo verifica; el resto sigue leyendo la copia anterior
+        if not self._lock.acquire(blocking=self.productos is None):
+            return self.productos
+        try:
+            if self.productos is None:
+                self.recargar()
+            elif time.monotonic() - self._ultima_verificacion >= MAESTRO_CONFIG['intervalo_verificacion']:
+                self._actualizar()
+        finally:
+            self._lock.release()
+        return self.productos
+
+    def obtener(self, codigo: str) -> Optional[ProductoMaestro]:
+        return self.vigente().get(codigo)
+
+    def estado(self) -> Dict:
+        return {'productos': len(self.productos or ()), 'recargas': self.recargas,
+                'actualizaciones': self.actualizaciones,
+                'hasta': str(self._hasta) if self._hasta else None}
+
+
+_indice: Optional[IndiceMaestro] = None
+_indice_lock = threading.Lock()
+
+
+def obtener_indice(consultar: Callable[..., Any]) -> IndiceMaestro:
+    """Índice del maestro de este worker (uno solo para todos los clientes)"""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndiceMaestro(consultar)
+    return _indice
+
+
+# ============================================
+# RESOLUCIÓN CLIENTE + MAESTRO
+# ============================================
+
+def desde_maestro(producto: ProductoMaestro) -> Dict:
+    """
+    Producto del maestro que el cliente todavía no cargó: metadatos compartidos,
+    sin id, precio ni stock propios. `maestro` le avisa al escáner que al
+    guardarle un precio se crea en el catálogo del cliente.
+    """
+    return {
+        'id': None, 'code': producto.code, 'reference': producto.reference,
+        'codetype': producto.codetype, 'name': producto.name,
+        'category': producto.category, 'taxcat': producto.taxcat,
+        'pricebuy': 0, 'pricesell': 0, 'stockunits': 0,
+        'supplier': None, 'texttip': None, 'warranty': 0,
+        'maestro': True,
+    }
+
+
+def resolver(codigo: str, del_cliente: Optional[Dict], consultar: Callable[..., Any]) -> Optional[Dict]:
+    """
+    Lo del cliente primero (su precio, su stock, sus nombres); si no lo tiene,
+    el maestro. Con MASTER_CATALOG=0 retorna lo del cliente tal cual.
+    """
+    if del_cliente or not MAESTRO_CONFIG['habilitado']:
+        return del_cliente
+    producto = obtener_indice(consultar).obtener(codigo)
+    return desde_maestro(producto) if producto else None
@@ -0,0 +1,194 @@
+"""
+Migraciones de esquema para todas las bases de clientes
+Lleva cada cliente_<subdominio> desde la versión base de esquema.py hasta la
+última migración, registrando la versión aplicada por cliente en
+comparapp_admin.esquema_clientes para poder retomar después de un fallo
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import pymysql
+
+import esquema
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+ADMIN_DB = 'comparapp_admin'
+
+# Segundos máximos esperando el metadata lock: si hay transacciones largas la
+# migración falla y se reintenta después, en vez de frenar el tráfico de la tienda
+LOCK_WAIT_TIMEOUT = int(os.getenv("MIGRATION_LOCK_WAIT_TIMEOUT", 5))
+
+# Errores que indican que la sentencia ya se había aplicado (reintento tras fallo)
+YA_APLICADA = {
+    1050,   # Table already exists
+    1060,   # Duplicate column name
+    1061,   # Duplicate key name
+    1091,   # Can't DROP; check that column/key exists
+}
+
+DDL_ESQUEMA_CLIENTES = f"""
+    CREATE TABLE IF NOT EXISTS `{ADMIN_DB}`.esquema_clientes (
+        cliente_id INT PRIMARY KEY,
+        version INT NOT NULL,
+        actualizado DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        error TEXT NULL,
+        FOREIGN KEY (cliente_id) REFERENCES clientes(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# ============================================
+# MIGRACIONES
+# ============================================
+# Cada sentencia recibe {db}. Usar ALGORITHM=INPLACE, LOCK=NONE siempre que
+# MariaDB lo permita para no bloquear lecturas ni escrituras en horario comercial.
+
+MIGRACIONES = [
+    {
+        'version': 2,
+        'descripcion': 'Índice por nombre para ORDER BY name del listado',
+        'sql': [
+            "ALTER TABLE `{db}`.products ADD INDEX idx_name (name), ALGORITHM=INPLACE, LOCK=NONE",
+        ],
+    },
+]
+
+VERSION_ACTUAL = max([esquema.SCHEMA_VERSION] + [m['version'] for m in MIGRACIONES])
+
+
+def pendientes(version: int) -> List[Dict]:
+    """Migraciones posteriores a la versión dada, en orden"""
+    return sorted((m for m in MIGRACIONES if m['version'] > version), key=lambda m: m['version'])
+
+
+# ============================================
+# EJECUCIÓN
+# ============================================
+
+def asegurar_tabla_versiones(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(DDL_ESQUEMA_CLIENTES)
+    conn.commit()
+
+
+def version_cliente(cursor, cliente_id: int) -> int:
+    """Versión registrada; los clientes sin registro están en la versión base"""
+    cursor.execute(
+        f"SELECT version FROM `{ADMIN_DB}`.esquema_clientes WHERE cliente_id = %s",
+        (cliente_id,)
+    )
+    fila = cursor.fetchone()
+    return fila['version'] if fila else esquema.SCHEMA_VERSION
+
+
+def registrar_version(cursor, cliente_id: int, version: int, error: Optional[str] = None):
+    cursor.execute(
+        f"INSERT INTO `{ADMIN_DB}`.esquema_clientes (cliente_id, version, error) "
+        "VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE version = VALUES(version), error = VALUES(error)",
+        (cliente_id, version, error)
+    )
+
+
+def migrar_cliente(conn, cliente: Dict, dry_run: bool = False) -> Dict:
+    """
+    Aplica las migraciones pendientes de un cliente, una por una
+    La versión se registra después de cada migración: si algo falla, la
+    próxima corrida retoma desde la última aplicada
+    """
+    db = esquema.validar_nombre_bd(cliente['db_name'])
+    with conn.cursor() as cursor:
+        cursor.execute("SET SESSION lock_wait_timeout = %s", (LOCK_WAIT_TIMEOUT,))
+        version = version_cliente(cursor, cliente['id'])
+        faltan = pendientes(version)
+
+        if dry_run or not faltan:
+            return {'subdominio': cliente['subdominio'], 'desde': version,
+                    'hasta': version, 'pendientes': len(faltan), 'error': None}
+
+        desde = version
+        try:
+            for migracion in faltan:
+                for sentencia in migracion['sql']:
+                    try:
+                        cursor.execute(sentencia.format(db=db))
+                    except (pymysql.err.OperationalError, pymysql.err.InternalError) as e:
+                        if e.args[0] not in YA_APLICADA:
+                            raise
+                version = migracion['version']
+                registrar_version(cursor, cliente['id'], version)
+                conn.commit()
+            error = None
+        except Exception as e:
+            error = str(e)
+            conn.rollback()
+            registrar_version(cursor, cliente['id'], version, error)
+            conn.commit()
+
+    return {'subdominio': cliente['subdominio'], 'desde': desde, 'hasta': version,
+            'pendientes': len(pendientes(version)), 'error': error}
+
+
+def _descartar(conn):
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def migrar_todos(conectar: Callable[[], 'pymysql.Connection'], paralelo: int = 4,
+                 subdominio: Optional[str] = None, dry_run: bool = False) -> List[Dict]:
+    """
+    Migra todos los clientes de comparapp_admin.clientes, hasta `paralelo` a la vez
+    conectar() debe retornar una conexión nueva con DictCursor
+    """
+    conn = conectar()
+    try:
+        asegurar_tabla_versiones(conn)
+        with conn.cursor() as cursor:
+            query = f"SELECT id, subdominio, db_name FROM `{ADMIN_DB}`.clientes"
+            params = None
+            if subdominio:
+                query += " WHERE subdominio = %s"
+                params = (subdominio,)
+            cursor.execute(query + " ORDER BY id", params)
+            clientes = cursor.fetchall()
+    finally:
+        conn.close()
+
+    hilo = threading.local()
+    conexiones = []
+    conexiones_lock = threading.Lock()
+
+    def tarea(cliente):
+        conn = getattr(hilo, 'conn', None)
+        if conn is None or not conn.open:
+            conn = hilo.conn = conectar()
+            with conexiones_lock:
+                conexiones.append(conn)
+        try:
+            return migrar_cliente(conn, cliente, dry_run)
+        except Exception as e:
+            # La conexión puede haber quedado rota o dentro de una transacción:
+            # el próximo cliente de este hilo usa una nueva
+            _descartar(conn)
+            hilo.conn = None
+            return {'subdominio': cliente['subdominio'], 'desde': None, 'hasta': None,
+                    'pendientes': None, 'error': str(e)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=paralelo) as executor:
+            return list(executor.map(tarea, clientes))
+    finally:
+        for c in conexiones:
+            if c.open:
+                c.close()
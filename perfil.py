@@ -0,0 +1,279 @@
+"""
+Perfil por request
+Cada request acumula sus consultas (huella SQL, filas, tiempo de conexión y
+de ejecución) y el tiempo de auth, impresión y render de etiquetas. Los
+requests lentos van a un log rotativo y, si se habilita, la respuesta lleva
+un header Server-Timing visible en las devtools del navegador. Con
+REQUEST_TRACE_PATH cada request deja además una traza anonimizada que
+reproducir.py puede volver a ejecutar contra una instancia local.
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+PERFIL_CONFIG = {
+    'habilitado': os.getenv("REQUEST_PROFILE", "1") == "1",
+    # Requests más lentos que esto se escriben en el log de lentos (0 = nunca)
+    'lento_ms': float(os.getenv("REQUEST_SLOW_MS", 1000)),
+    'server_timing': os.getenv("SERVER_TIMING", "0") == "1",
+    'log_path': os.getenv("SLOW_LOG_PATH", os.path.join("logs", "requests_lentos.log")),
+    'log_max_bytes': int(os.getenv("SLOW_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    'log_copias': int(os.getenv("SLOW_LOG_BACKUPS", 5)),
+    # Consultas que se guardan por request (las demás solo suman al total)
+    'max_consultas': 50,
+    # Trazas para reproducir el tráfico (vacío = no se capturan)
+    'trazas_path': os.getenv("REQUEST_TRACE_PATH", ""),
+    # Sal del seudónimo de cliente en las trazas
+    'trazas_sal': os.getenv("REQUEST_TRACE_SALT", ""),
+}
+
+SEGMENTOS = ('db', 'auth', 'print', 'render')
+
+
+# ============================================
+# HUELLAS SQL
+# ============================================
+
+_CADENAS = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMEROS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTAS = re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)')
+_ESPACIOS = re.compile(r'\s+')
+
+
+def huella(query: str) -> str:
+    """SQL normalizado: literales como ?, listas IN colapsadas y espacios simples"""
+    sql = _CADENAS.sub('?', query)
+    sql = _NUMEROS.sub('?', sql)
+    sql = _LISTAS.sub('(?+)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()[:200]
+
+
+# ============================================
+# PERFIL DEL REQUEST
+# ============================================
+
+class Perfil:
+    """Mediciones de un request; vive en un ContextVar del hilo que lo atiende"""
+
+    __slots__ = ('inicio', 'segmentos', 'consultas', 'total_consultas')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.segmentos: Dict[str, float] = dict.fromkeys(SEGMENTOS, 0.0)
+        self.consultas: List[Dict] = []
+        self.total_consultas = 0
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.inicio) * 1000
+
+    def server_timing(self) -> str:
+        partes = []
+        for nombre, ms in self.segmentos.items():
+            if nombre == 'db' and self.total_consultas:
+                partes.append(f'db;dur={ms:.1f};desc="{self.total_consultas} consultas"')
+            elif ms:
+                partes.append(f"{nombre};dur={ms:.1f}")
+        partes.append(f"total;dur={self.total_ms():.1f}")
+        return ', '.join(partes)
+
+
+_actual: contextvars.ContextVar[Optional[Perfil]] = contextvars.ContextVar('perfil', default=None)
+
+
+def actual() -> Optional[Perfil]:
+    return _actual.get()
+
+
+def registrar_consulta(query: str, filas: int, conectar_ms: float, ejecutar_ms: float):
+    """Lo llama repositorio en cada consulta/escritura; sin request activo no hace nada"""
+    perfil = _actual.get()
+    if perfil is None:
+        return
+    perfil.segmentos['db'] += conectar_ms + ejecutar_ms
+    perfil.total_consultas += 1
+    if len(perfil.consultas) < PERFIL_CONFIG['max_consultas']:
+        perfil.consultas.append({
+            'sql': huella(query),
+            'filas': filas,
+            'conectar_ms': round(conectar_ms, 2),
+            'ejecutar_ms': round(ejecutar_ms, 2),
+        })
+
+
+@contextmanager
+def medir(segmento: str):
+    """Suma al segmento (auth, print, render) el tiempo del bloque"""
+    perfil = _actual.get()
+    if perfil is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        perfil.segmentos[segmento] += (time.perf_counter() - inicio) * 1000
+
+
+# ============================================
+# LOG DE REQUESTS LENTOS
+# ============================================
+
+_log_lentos = None
+
+
+def log_lentos() -> logging.Logger:
+    global _log_lentos
+    if _log_lentos is None:
+        logger = logging.getLogger('comparapp.lentos')
+        logger.propagate = False
+        if not logger.handlers:
+            os.makedirs(os.path.dirname(PERFIL_CONFIG['log_path']) or '.', exist_ok=True)
+            handler = RotatingFileHandler(PERFIL_CONFIG['log_path'],
+                                          maxBytes=PERFIL_CONFIG['log_max_bytes'],
+                                          backupCount=PERFIL_CONFIG['log_copias'],
+                                          encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        _log_lentos = logger
+    return _log_lentos
+
+
+def escribir_lento(perfil: Perfil, metodo: str, ruta: str, estado: int, cliente: Optional[str]):
+    consultas = sorted(perfil.consultas, key=lambda c: -(c['conectar_ms'] + c['ejecutar_ms']))
+    log_lentos().info(json.dumps({
+        'metodo': metodo,
+        'ruta': ruta,
+        'estado': estado,
+        'cliente': cliente,
+        'pid': os.getpid(),
+        'total_ms': round(perfil.total_ms(), 1),
+        'segmentos_ms': {k: round(v, 1) for k, v in perfil.segmentos.items()},
+        'total_consultas': perfil.total_consultas,
+        'consultas': consultas,
+    }, ensure_ascii=False, default=str))
+
+
+# ============================================
+# TRAZAS PARA REPRODUCCIÓN
+# ============================================
+# Del cuerpo solo se guardan códigos y cantidades: nunca precios, nombres,
+# tokens ni la configuración de la impresora
+
+CAMPOS_TRAZA = ('codigo', 'codigos', 'code', 'cantidad', 'copias', 'movimientos')
+PARAMETROS_TRAZA = ('formato', 'desde', 'hasta', 'agrupar', 'limite')
+
+_log_trazas = None
+
+
+def seudonimo(valor: Optional[str]) -> Optional[str]:
+    """Identificador estable de un cliente que no revela cuál es"""
+    if valor is None:
+        return None
+    return hashlib.sha256(f"{PERFIL_CONFIG['trazas_sal']}{valor}".encode('utf-8')).hexdigest()[:12]
+
+
+def cuerpo_traza(cuerpo) -> Optional[Dict]:
+    if not isinstance(cuerpo, dict):
+        return None
+    limpio = {k: cuerpo[k] for k in CAMPOS_TRAZA if k in cuerpo and k != 'movimientos'}
+    if isinstance(cuerpo.get('movimientos'), list):
+        limpio['movimientos'] = [{k: m[k] for k in ('codigo', 'cantidad') if k in m}
+                                 for m in cuerpo['movimientos'] if isinstance(m, dict)]
+    return limpio or None
+
+
+def log_trazas() -> logging.Logger:
+    global _log_trazas
+    if _log_trazas is None:
+        logger = logging.getLogger('comparapp.trazas')
+        logger.propagate = False
+        if not logger.handlers:
+            os.makedirs(os.path.dirname(PERFIL_CONFIG['trazas_path']) or '.', exist_ok=True)
+            handler = RotatingFileHandler(PERFIL_CONFIG['trazas_path'],
+                                          maxBytes=PERFIL_CONFIG['log_max_bytes'],
+                                          backupCount=PERFIL_CONFIG['log_copias'],
+                                          encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        _log_trazas = logger
+    return _log_trazas
+
+
+def escribir_traza(perfil: Perfil, request, estado: int, cliente: Optional[str]):
+    total_ms = perfil.total_ms()
+    parametros = {k: request.args[k] for k in PARAMETROS_TRAZA if k in request.args}
+    log_trazas().info(json.dumps({
+        'ts': round(time.time() - total_ms / 1000, 3),
+        'metodo': request.method,
+        'ruta': request.url_rule.rule if request.url_rule else None,
+        'path': request.path,
+        'parametros': parametros or None,
+        'cliente': seudonimo(cliente),
+        'cuerpo': cuerpo_traza(request.get_json(silent=True)) if request.method != 'GET' else None,
+        'estado': estado,
+        'ms': round(total_ms, 1),
+    }, ensure_ascii=False, default=str))
+
+
+# ============================================
+# INTEGRACIÓN CON FLASK
+# ============================================
+
+def instalar(app, cliente=None):
+    """
+    Abre un perfil al empezar cada request y lo cierra al responder
+    `cliente` es una función opcional que identifica al cliente para el log
+    """
+    if not PERFIL_CONFIG['habilitado']:
+        return
+
+    from flask import request
+
+    @app.before_request
+    def _abrir_perfil():
+        _actual.set(Perfil())
+
+    @app.after_request
+    def _cerrar_perfil(respuesta):
+        perfil = _actual.get()
+        if perfil is None:
+            return respuesta
+        if PERFIL_CONFIG['server_timing']:
+            respuesta.headers['Server-Timing'] = perfil.server_timing()
+        lento = PERFIL_CONFIG['lento_ms'] and perfil.total_ms() > PERFIL_CONFIG['lento_ms']
+        if not lento and not PERFIL_CONFIG['trazas_path']:
+            return respuesta
+        try:
+            quien = cliente() if cliente else None
+        except Exception:
+            quien = None
+        if lento:
+            try:
+                escribir_lento(perfil, request.method, request.path, respuesta.status_code, quien)
+            except Exception as e:
+                print(f"⚠️  No se pudo escribir el log de lentos: {e}")
+        if PERFIL_CONFIG['trazas_path']:
+            try:
+                escribir_traza(perfil, request, respuesta.status_code, quien)
+            except Exception as e:
+                print(f"⚠️  No se pudo escribir la traza: {e}")
+        return respuesta
+
+    @app.teardown_request
+    def _soltar_perfil(_error=None):
+        # Los hilos de gthread se reusan: el próximo request no hereda este perfil
+        _actual.set(None)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Perfil de arranque de un worker
+Importa la app en un proceso nuevo con `python -X importtime` y muestra los
+módulos que más tardan (tiempo acumulado, incluye sus dependencias). Con
+--calentar mide además cada fase de app.calentar() como lo hace gunicorn.
+
+Uso:
+    python3 perfil_arranque.py                  # top 20 de imports de app
+    python3 perfil_arranque.py --modulo etiquetas --top 10
+    python3 perfil_arranque.py --calentar       # requiere BD accesible
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+def medir_imports(modulo: str):
+    """Lista de (módulo, propio_us, acumulado_us, profundidad) y el total en µs"""
+    proceso = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        capture_output=True, text=True
+    )
+    if proceso.returncode != 0:
+        raise SystemExit(f"❌ No se pudo importar {modulo}:\n{proceso.stderr.strip().splitlines()[-1]}")
+
+    filas = []
+    for linea in proceso.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        propio, acumulado, nombre = linea[len('import time:'):].split('|', 2)
+        profundidad = (len(nombre) - len(nombre.lstrip(' '))) // 2
+        filas.append((nombre.strip(), int(propio), int(acumulado), profundidad))
+
+    # La salida está en post-orden: el módulo pedido va después de todo lo que importó.
+    # Lo anterior a ese subárbol (site, encodings) es el arranque del intérprete.
+    fin = max((i for i, f in enumerate(filas) if f[0] == modulo and f[3] == 0), default=None)
+    if fin is None:
+        return filas, sum(f[1] for f in filas)
+    inicio = fin
+    while inicio > 0 and filas[inicio - 1][3] > 0:
+        inicio -= 1
+    return filas[inicio:fin], filas[fin][2]
+
+
+def medir_calentamiento(conexiones: int):
+    """Tiempos por fase de app.calentar(), en un proceso aparte para no heredar imports"""
+    codigo = (
+        "import json, time\n"
+        "inicio = time.perf_counter()\n"
+        "import app\n"
+        "importar = (time.perf_counter() - inicio) * 1000\n"
+        f"fases = app.calentar(conexiones={conexiones})\n"
+        "print(json.dumps({'import': round(importar, 1), **fases}))\n"
+    )
+    proceso = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True)
+    if proceso.returncode != 0:
+        raise SystemExit(f"❌ Falló el calentamiento:\n{proceso.stderr.strip()}")
+    return json.loads(proceso.stdout.strip().splitlines()[-1])
+
+
+def ejecutar(args):
+    filas, total = medir_imports(args.modulo)
+    print(f"\n⏱️  import {args.modulo}: {total / 1000:.1f} ms ({len(filas)} módulos)\n")
+
+    # Solo los imports directos del módulo: los de más abajo ya están en su acumulado
+    principales = filas if args.todos else [f for f in filas if f[3] == 1]
+    principales.sort(key=lambda f: -f[2])
+    print(f"{'MÓDULO':<40} {'ACUM ms':>9} {'PROPIO ms':>10} {'%':>6}")
+    print("=" * 68)
+    for nombre, propio, acumulado, _ in principales[:args.top]:
+        print(f"{nombre[:40]:<40} {acumulado / 1000:>9.1f} {propio / 1000:>10.1f} "
+              f"{acumulado * 100 / total if total else 0:>5.1f}%")
+    print("=" * 68)
+
+    if args.calentar:
+        tiempos = medir_calentamiento(args.conexiones)
+        print(f"\n🔥 Arranque completo: {sum(tiempos.values()):.0f} ms")
+        for fase, ms in tiempos.items():
+            print(f"   {fase:<12} {ms:>9.1f} ms")
+    print()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Perfil de imports y calentamiento del worker")
+    parser.add_argument('--modulo', default='app', help="Módulo a importar (default: app)")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--todos', action='store_true', help="Incluye submódulos, no solo el primer nivel")
+    parser.add_argument('--calentar', action='store_true', help="Mide también app.calentar()")
+    parser.add_argument('--conexiones', type=int, default=4)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ejecutar(parse_args())
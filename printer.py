@@ -1,8 +1,151 @@
-def print_ticket(producto):
-    try:
-        import win32print
-    except ImportError:
-        raise RuntimeError("Impresión solo disponible en Windows")
+"""
+Salidas de impresión del puente local
+Una impresora se identifica con un destino de texto:
+    usb:/dev/usb/lp0            impresora USB (clase printer de Linux)
+    serial:/dev/ttyUSB0@9600    impresora serie (baudios opcionales)
+    tcp:192.168.1.100:9100      impresora de red (RAW / JetDirect)
+"""
+
+import asyncio
+import glob
+import os
+import platform
+import re
+from typing import List
+
+# Segundos máximos para conectar y enviar un trabajo
+PRINT_TIMEOUT = float(os.getenv("PRINT_TIMEOUT", 10))
+
+# Destinos configurados a mano, separados por coma (además de los detectados)
+PRINTERS = [p.strip() for p in os.getenv("PRINTERS", "").split(",") if p.strip()]
+
+# Únicos dispositivos en los que se escribe, ya resueltos los enlaces y los ".."
+DISPOSITIVOS = {
+    'usb': re.compile(r'^/dev/usb/lp\d+$'),
+    'serial': re.compile(r'^/dev/tty[A-Za-z]*\d+$'),
+}
+
+try:
+    import serial   # pyserial, opcional: permite fijar baudios
+except ImportError:
+    serial = None
+
+
+def listar_impresoras() -> List[str]:
+    """Destinos configurados más los dispositivos USB y serie presentes"""
+    encontradas = list(PRINTERS)
+    for ruta in sorted(glob.glob('/dev/usb/lp*')):
+        encontradas.append(f"usb:{ruta}")
+    for ruta in sorted(glob.glob('/dev/ttyUSB*') + glob.glob('/dev/ttyACM*')):
+        encontradas.append(f"serial:{ruta}")
+    return list(dict.fromkeys(encontradas))
+
+
+def impresora_por_defecto() -> str:
+    disponibles = listar_impresoras()
+    return os.getenv("PRINTER_DEFAULT") or (disponibles[0] if disponibles else "tcp:192.168.1.100:9100")
+
+
+def plataforma() -> str:
+    return f"{platform.system()} {platform.release()}"
+
+
+def _normalizar(destino: str) -> str:
+    """Destino con la ruta del dispositivo canónica; ValueError si el formato no es válido"""
+    tipo, _, resto = destino.partition(':')
+    if tipo in DISPOSITIVOS:
+        ruta, arroba, baudios = resto.partition('@')
+        ruta = os.path.realpath(ruta)
+        if not DISPOSITIVOS[tipo].match(ruta) or (baudios and not baudios.isdigit()):
+            raise ValueError(f"Dispositivo inválido: {destino}")
+        return f"{tipo}:{ruta}{arroba}{baudios}"
+    if tipo == 'tcp':
+        host, _, puerto = resto.rpartition(':')
+        if not host or not puerto.isdigit():
+            raise ValueError(f"Destino TCP inválido: {destino} (usar tcp:host:puerto)")
+        return destino
+    raise ValueError(f"Tipo de impresora desconocido: {destino}")
+
 
-    PRINTER_NAME = "Xprinter XP-58"
-    ...
+def _sin_baudios(destino: str) -> str:
+    return destino.partition('@')[0]
+
+
+def validar_destino(destino: str) -> str:
+    """
+    Destino normalizado, solo si es una de las impresoras configuradas o
+    detectadas (o la por defecto); ValueError si no. Los baudios de un puerto
+    serie se pueden elegir libremente.
+    """
+    destino = _normalizar(destino)
+    permitidos = listar_impresoras() + [impresora_por_defecto()]
+    conocidos = set()
+    for permitido in permitidos:
+        try:
+            conocidos.add(_sin_baudios(_normalizar(permitido)))
+        except ValueError:
+            continue
+    if _sin_baudios(destino) not in conocidos:
+        raise ValueError(f"Impresora no configurada: {destino} (agregarla a PRINTERS)")
+    return destino
+
+
+def _abrir_serie(ruta: str, baudios: int):
+    if serial is None:
+        # Sin pyserial se escribe directo; los baudios se configuran con stty
+        return open(ruta, 'wb', buffering=0)
+    return serial.Serial(ruta, baudrate=baudios, timeout=PRINT_TIMEOUT, write_timeout=PRINT_TIMEOUT)
+
+
+class Salida:
+    """Conexión abierta a una impresora; permite enviar etiqueta por etiqueta"""
+
+    def __init__(self, writer=None, dispositivo=None):
+        self._writer = writer
+        self._dispositivo = dispositivo
+
+    async def escribir(self, datos: bytes):
+        if self._writer is not None:
+            self._writer.write(datos)
+            await asyncio.wait_for(self._writer.drain(), PRINT_TIMEOUT)
+        else:
+            # USB y serie son escrituras bloqueantes: van a un hilo del executor
+            await asyncio.wait_for(asyncio.to_thread(self._escribir_dispositivo, datos), PRINT_TIMEOUT)
+
+    def _escribir_dispositivo(self, datos: bytes):
+        self._dispositivo.write(datos)
+        self._dispositivo.flush()
+
+    async def cerrar(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        elif self._dispositivo is not None:
+            await asyncio.to_thread(self._dispositivo.close)
+
+
+async def abrir(destino: str) -> Salida:
+    """Abre la conexión al destino; lanza excepción si no está disponible"""
+    tipo, _, resto = validar_destino(destino).partition(':')
+    if tipo == 'tcp':
+        host, _, puerto = resto.rpartition(':')
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, int(puerto)), PRINT_TIMEOUT)
+        return Salida(writer=writer)
+    if tipo == 'usb':
+        dispositivo = await asyncio.to_thread(open, resto, 'wb', buffering=0)
+    else:
+        ruta, _, baudios = resto.partition('@')
+        dispositivo = await asyncio.to_thread(_abrir_serie, ruta, int(baudios or 9600))
+    return Salida(dispositivo=dispositivo)
+
+
+async def enviar(destino: str, datos: bytes):
+    """Envía los bytes ESC/POS al destino en una sola escritura"""
+    salida = await abrir(destino)
+    try:
+        await salida.escribir(datos)
+    finally:
+        await salida.cerrar()
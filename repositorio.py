@@ -0,0 +1,537 @@
+"""
+Capa única de acceso a datos de productos
+Todas las rutas (app.py y las de auth_middleware) pasan por acá: pool de
+conexiones pymysql por destino, sentencias SQL con nombre, tiempos por
+sentencia y variantes en lote. Una mejora en esta capa aplica a todas las rutas.
+"""
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import pymysql
+
+import esquema
+import perfil
+from config import CLIENTS, POOL_TIERS
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+POOL_CONFIG = {
+    # Conexiones ociosas que se guardan por destino; las demás se cierran al devolverlas
+    'max_libres': int(os.getenv("DB_POOL_SIZE", 8)),
+    # Segundos de vida de una conexión antes de reabrirla (wait_timeout de MariaDB)
+    'reciclar': int(os.getenv("DB_POOL_RECYCLE", 3600)),
+    # Segundos ociosa a partir de los cuales se hace ping antes de reusarla
+    'ping_despues': int(os.getenv("DB_POOL_PING_AFTER", 30)),
+    # Segundos que se espera una conexión cuando el pool del cliente llegó a su tope
+    'espera': float(os.getenv("DB_POOL_TIMEOUT", 10)),
+    # Segundos sin uso tras los cuales se cierra el pool de un destino
+    'inactivo_seg': int(os.getenv("DB_POOL_IDLE_TIMEOUT", 900)),
+}
+
+# Cada cuántos segundos como máximo se buscan pools inactivos
+INTERVALO_DESALOJO = 60
+
+# Sentencias más lentas que esto se informan por consola (0 = nunca)
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 500))
+
+
+def nivel_de(cliente: Optional[str]) -> Optional[Dict]:
+    """Nivel de pool del cliente según config.CLIENTS (None = valores globales, sin tope)"""
+    if not cliente or cliente not in CLIENTS:
+        return None
+    return POOL_TIERS[CLIENTS[cliente].get('tier', 'basico')]
+
+
+# ============================================
+# POOL DE CONEXIONES
+# ============================================
+
+class PoolAgotado(pymysql.err.OperationalError):
+    """Todas las conexiones del pool están prestadas y no se liberó ninguna a tiempo"""
+
+
+class PoolConexiones:
+    """
+    Conexiones reutilizables a un destino (host, port, user, database)
+    Las conexiones se abren en autocommit: las lecturas nunca quedan dentro de
+    una transacción vieja y las escrituras abren la suya explícitamente.
+    Con un nivel (config.POOL_TIERS) se guardan hasta pool_size ociosas y se
+    prestan hasta pool_size + max_overflow a la vez; sin nivel, DB_POOL_SIZE
+    ociosas y sin tope de prestadas.
+    """
+
+    def __init__(self, config: Dict):
+        self._config = dict(config, autocommit=True)
+        self._config.setdefault('cursorclass', pymysql.cursors.DictCursor)
+        self._libres: List = []     # (conexión, creada, último uso)
+        self._lock = threading.Lock()
+        self._liberada = threading.Condition(self._lock)
+        self.max_libres = POOL_CONFIG['max_libres']
+        self.max_prestadas: Optional[int] = None
+        self.reciclar = POOL_CONFIG['reciclar']
+        self.nivel: Optional[Dict] = None
+        self.clientes = set()
+        self.cerrado = False
+        self.abiertas = 0
+        self.prestadas = 0
+        self.esperas = 0
+        self.agotado = 0
+        self.usos = 0
+        self.ultimo_uso = time.monotonic()
+
+    def ajustar(self, nivel: Dict):
+        """
+        Aplica un nivel de pool; si varios clientes comparten el destino se
+        queda con el mayor de sus niveles
+        """
+        with self._lock:
+            if self.nivel is not None:
+                nivel = {
+                    'pool_size': max(self.nivel['pool_size'], nivel['pool_size']),
+                    'max_overflow': max(self.nivel['max_overflow'], nivel['max_overflow']),
+                    'pool_recycle': min(self.nivel['pool_recycle'], nivel['pool_recycle']),
+                }
+            self.nivel = nivel
+            self.max_libres = nivel['pool_size']
+            self.max_prestadas = nivel['pool_size'] + nivel['max_overflow']
+            self.reciclar = nivel['pool_recycle']
+            self._liberada.notify_all()
+
+    def _abrir(self):
+        conn = pymysql.connect(**self._config)
+        with self._lock:
+            self.abiertas += 1
+        return conn, time.monotonic()
+
+    def _cerrar(self, conn):
+        with self._lock:
+            self.abiertas -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _soltar(self):
+        with self._lock:
+            self.prestadas -= 1
+            self._liberada.notify()
+
+    def _reservar(self):
+        """Cuenta una conexión prestada; con tope, espera a que se libere una"""
+        with self._lock:
+            if self.max_prestadas is not None and self.prestadas >= self.max_prestadas:
+                self.esperas += 1
+                if not self._liberada.wait_for(
+                        lambda: self.max_prestadas is None or self.prestadas < self.max_prestadas,
+                        POOL_CONFIG['espera']):
+                    self.agotado += 1
+                    raise PoolAgotado(2013, f"Pool agotado ({self.max_prestadas} conexiones en uso)")
+            self.prestadas += 1
+            return self._libres.pop() if self._libres else None
+
+    def tomar(self):
+        """Retorna (conexión, creada); reusa la última devuelta si sigue viva"""
+        while True:
+            entrada = self._reservar()
+            if entrada is None:
+                try:
+                    return self._abrir()
+                except Exception:
+                    self._soltar()
+                    raise
+
+            conn, creada, usada = entrada
+            ahora = time.monotonic()
+            try:
+                if ahora - creada > self.reciclar:
+                    raise pymysql.err.OperationalError(0, 'reciclada')
+                if ahora - usada > POOL_CONFIG['ping_despues']:
+                    conn.ping(reconnect=False)
+                return conn, creada
+            except Exception:
+                self._soltar()
+                self._cerrar(conn)
+
+    def devolver(self, conn, creada: float, rota: bool = False):
+        with self._lock:
+            self.prestadas -= 1
+            self._liberada.notify()
+            # Un pool desalojado ya no está en el registro: sus conexiones no se guardan
+            guardar = not rota and not self.cerrado and len(self._libres) < self.max_libres
+            if guardar:
+                self._libres.append((conn, creada, time.monotonic()))
+        if not guardar:
+            self._cerrar(conn)
+
+    def vaciar(self):
+        """Cierra las conexiones ociosas"""
+        with self._lock:
+            libres, self._libres = self._libres, []
+        for conn, _, _ in libres:
+            self._cerrar(conn)
+
+    def estado(self) -> Dict:
+        with self._lock:
+            return {'clientes': sorted(self.clientes), 'max_libres': self.max_libres,
+                    'max_prestadas': self.max_prestadas, 'abiertas': self.abiertas,
+                    'prestadas': self.prestadas, 'libres': len(self._libres),
+                    'esperas': self.esperas, 'agotado': self.agotado, 'usos': self.usos,
+                    'inactivo_seg': round(time.monotonic() - self.ultimo_uso, 1)}
+
+
+# ============================================
+# REGISTRO DE POOLS
+# ============================================
+# Un pool por destino: los clientes que comparten base comparten pool. La
+# búsqueda y el desalojo de pools inactivos van bajo el mismo lock, así un
+# pool recién entregado nunca es uno que se está cerrando.
+
+_pools: Dict[tuple, PoolConexiones] = {}
+_pools_lock = threading.Lock()
+_ultimo_desalojo = time.monotonic()
+
+
+def _clave_destino(config: Dict) -> tuple:
+    return (config.get('host'), config.get('port', 3306), config.get('user'), config.get('database'))
+
+
+def destino(config: Dict, cliente: Optional[str] = None) -> str:
+    """
+    Identifica los datos que ve un repositorio: host:puerto/bd, más el cliente
+    cuando comparte la tabla con otros (modo compartido, vista por tenant)
+    """
+    base = '%s:%s/%s' % (config.get('host'), config.get('port', 3306), config.get('database'))
+    return f"{base}/{cliente}" if cliente else base
+
+
+def get_pool(config: Dict, cliente: Optional[str] = None) -> PoolConexiones:
+    """Pool del destino de config, compartido por todos los repositorios que lo usan"""
+    clave = _clave_destino(config)
+    ahora = time.monotonic()
+    with _pools_lock:
+        pool = _pools.get(clave)
+        if pool is None:
+            pool = PoolConexiones(config)
+            _pools[clave] = pool
+        if cliente and cliente not in pool.clientes:
+            pool.clientes.add(cliente)
+            nivel = nivel_de(cliente)
+            if nivel:
+                pool.ajustar(nivel)
+        pool.ultimo_uso = ahora
+        pool.usos += 1
+        desalojar = ahora - _ultimo_desalojo > INTERVALO_DESALOJO
+    if desalojar:
+        desalojar_inactivos()
+    return pool
+
+
+@contextmanager
+def conexion(config: Dict, cliente: Optional[str] = None):
+    """Conexión prestada del pool; se descarta si la operación falló"""
+    pool = get_pool(config, cliente)
+    conn, creada = pool.tomar()
+    rota = False
+    try:
+        yield conn
+    except Exception:
+        rota = True
+        raise
+    finally:
+        pool.devolver(conn, creada, rota)
+
+
+def desalojar_inactivos(inactividad: Optional[float] = None) -> int:
+    """Cierra los pools sin uso hace más de `inactividad` segundos y sin conexiones prestadas"""
+    global _ultimo_desalojo
+    limite = POOL_CONFIG['inactivo_seg'] if inactividad is None else inactividad
+    ahora = time.monotonic()
+    with _pools_lock:
+        _ultimo_desalojo = ahora
+        cerrados = [clave for clave, pool in _pools.items()
+                    if ahora - pool.ultimo_uso > limite and pool.prestadas == 0]
+        cerrados = [_pools.pop(clave) for clave in cerrados]
+        for pool in cerrados:
+            pool.cerrado = True
+    for pool in cerrados:
+        pool.vaciar()
+    return len(cerrados)
+
+
+def cerrar_todos():
+    """
+    Descarta todos los pools; en un worker recién forkeado nada del master
+    se comparte (preload_app). El lock se reemplaza porque pudo quedar tomado
+    por un hilo del master en el momento del fork.
+    """
+    global _pools, _pools_lock
+    pools, _pools, _pools_lock = list(_pools.values()), {}, threading.Lock()
+    for pool in pools:
+        pool.cerrado = True
+        pool.vaciar()
+
+
+def estado_pools() -> Dict[str, Dict]:
+    """Estado de cada pool, sin credenciales: clientes, topes, prestadas, esperas e inactividad"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {f"{u}@{h}:{p}/{d}": pool.estado() for (h, p, u, d), pool in pools}
+
+
+def calentar(config: Dict, cantidad: int, cliente: Optional[str] = None):
+    """Abre `cantidad` conexiones y las deja ociosas en el pool"""
+    pool = get_pool(config, cliente)
+    prestadas = []
+    try:
+        for _ in range(min(cantidad, pool.max_libres)):
+            prestadas.append(pool.tomar())
+    finally:
+        for conn, creada in prestadas:
+            pool.devolver(conn, creada)
+
+
+# ============================================
+# TIEMPOS POR SENTENCIA
+# ============================================
+
+_tiempos: Dict[str, List[float]] = {}     # nombre -> [cantidad, total_ms, max_ms]
+_tiempos_lock = threading.Lock()
+
+_ESPACIOS = re.compile(r'\s+')
+
+
+def _nombre_de(query: str) -> str:
+    return _ESPACIOS.sub(' ', query).strip()[:80]
+
+
+def registrar_tiempo(nombre: str, ms: float):
+    with _tiempos_lock:
+        t = _tiempos.get(nombre)
+        if t is None:
+            _tiempos[nombre] = [1, ms, ms]
+        else:
+            t[0] += 1
+            t[1] += ms
+            if ms > t[2]:
+                t[2] = ms
+    if SLOW_QUERY_MS and ms > SLOW_QUERY_MS:
+        print(f"🐢 Consulta lenta ({ms:.0f} ms): {nombre}")
+
+
+def estadisticas() -> Dict[str, Dict]:
+    """Cantidad, promedio y máximo en ms de cada sentencia desde que arrancó el worker"""
+    with _tiempos_lock:
+        copia = {n: list(t) for n, t in _tiempos.items()}
+    return {
+        nombre: {'cantidad': c, 'promedio_ms': round(total / c, 2), 'max_ms': round(maximo, 2)}
+        for nombre, (c, total, maximo) in sorted(copia.items(), key=lambda x: -x[1][1])
+    }
+
+
+# ============================================
+# REPOSITORIO BASE
+# ============================================
+
+class Repositorio:
+    """
+    Ejecuta SQL contra un destino con pool y medición de tiempos
+    Con tenant_id (modo compartido) `tabla` es la vista del cliente en lugar de
+    products y las escrituras fijan @tenant_id en la sesión
+    """
+
+    def __init__(self, config: Dict, tenant_id: Optional[int] = None, cliente: Optional[str] = None):
+        self.config = config
+        self.tenant_id = tenant_id
+        # Subdominio: el pool toma el nivel del cliente (config.CLIENTS)
+        self.cliente = cliente
+
+    @property
+    def destino(self) -> str:
+        """Clave de sus datos: repositorios de distintos clientes sobre la misma BD la comparten"""
+        return destino(self.config, self.cliente if self.tenant_id is not None else None)
+
+    @property
+    def tabla(self) -> str:
+        """Tabla de productos del cliente: products, o su vista en modo compartido"""
+        return 'products' if self.tenant_id is None else esquema.vista_cliente(self.tenant_id)
+
+    def consultar(self, query: str, params=None, fetch_one: bool = False,
+                  nombre: Optional[str] = None) -> Any:
+        """SELECT; retorna una fila (fetch_one) o la lista de filas"""
+        inicio = time.perf_counter()
+        with conexion(self.config, self.cliente) as conn:
+            conectado = time.perf_counter()
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                resultado = cursor.fetchone() if fetch_one else cursor.fetchall()
+        fin = time.perf_counter()
+        registrar_tiempo(nombre or _nombre_de(query), (fin - inicio) * 1000)
+        filas = (1 if resultado else 0) if fetch_one else len(resultado)
+        perfil.registrar_consulta(query, filas, (conectado - inicio) * 1000, (fin - conectado) * 1000)
+        return resultado
+
+    def _escribir(self, query: str, filas, lote: bool, nombre: Optional[str]) -> int:
+        inicio = time.perf_counter()
+        with conexion(self.config, self.cliente) as conn:
+            conectado = time.perf_counter()
+            conn.begin()
+            try:
+                with conn.cursor() as cursor:
+                    if self.tenant_id is not None:
+                        # Lo usa el trigger de INSERT para completar tenant_id
+                        cursor.execute("SET @tenant_id = %s", (self.tenant_id,))
+                    if lote:
+                        filas_afectadas = cursor.executemany(query, filas) or 0
+                    else:
+                        filas_afectadas = cursor.execute(query, filas)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        fin = time.perf_counter()
+        registrar_tiempo(nombre or _nombre_de(query), (fin - inicio) * 1000)
+        perfil.registrar_consulta(query, filas_afectadas, (conectado - inicio) * 1000, (fin - conectado) * 1000)
+        return filas_afectadas
+
+    def escribir(self, query: str, params=None, nombre: Optional[str] = None) -> int:
+        """INSERT/UPDATE/DELETE en su propia transacción; retorna filas afectadas"""
+        return self._escribir(query, params, False, nombre)
+
+    def escribir_lote(self, query: str, filas: Sequence, nombre: Optional[str] = None) -> int:
+        """La misma sentencia para muchas filas en una sola transacción (executemany)"""
+        if not filas:
+            return 0
+        return self._escribir(query, filas, True, nombre)
+
+    def version_servidor(self) -> str:
+        return self.consultar(SQL['version'], fetch_one=True, nombre='version')['version']
+
+
+# ============================================
+# REPOSITORIO DE PRODUCTOS
+# ============================================
+# pymysql no tiene sentencias preparadas del lado del servidor: cada operación
+# usa una sentencia fija con nombre, así el texto SQL es siempre el mismo
+# (plan y query cache de MariaDB) y los tiempos se agrupan por operación.
+# {tabla} es products o la vista del cliente (Repositorio.tabla).
+
+COLUMNAS_PRODUCTO = ('id', 'reference', 'code', 'codetype', 'name', 'pricebuy', 'pricesell',
+                     'category', 'taxcat', 'stockunits', 'supplier', 'texttip', 'warranty')
+
+_SELECT = f"SELECT {', '.join(COLUMNAS_PRODUCTO)} FROM {{tabla}}"
+
+SQL = {
+    'buscar': _SELECT + " WHERE code = %s OR reference = %s LIMIT 1",
+    'por_codigo': _SELECT + " WHERE code = %s LIMIT 1",
+    'listar': _SELECT + " ORDER BY name ASC LIMIT %s",
+    'precio_actual': "SELECT id, pricesell FROM {tabla} WHERE code = %s",
+    'insertar': (
+        "INSERT INTO {tabla} (id, reference, code, name, pricebuy, pricesell) "
+        "VALUES (%s, %s, %s, %s, %s, %s)"
+    ),
+    'actualizar': "UPDATE {tabla} SET reference=%s, name=%s, pricebuy=%s, pricesell=%s WHERE code=%s",
+    'guardar_lote': (
+        "INSERT INTO {tabla} (id, reference, code, name, pricebuy, pricesell) "
+        "VALUES (%s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE reference=VALUES(reference), name=VALUES(name), "
+        "pricebuy=VALUES(pricebuy), pricesell=VALUES(pricesell)"
+    ),
+    'eliminar': "DELETE FROM {tabla} WHERE code = %s",
+    'total': "SELECT COUNT(*) AS total FROM {tabla}",
+    'categorias': "SELECT id, name FROM categories ORDER BY name",
+    'version': "SELECT VERSION() AS version",
+}
+
+# Códigos por sentencia IN en las variantes en lote
+LOTE_IN = int(os.getenv("DB_BATCH_IN_SIZE", 500))
+
+
+def _tramos(valores: Sequence, tamanio: int) -> Iterable[Sequence]:
+    for i in range(0, len(valores), tamanio):
+        yield valores[i:i + tamanio]
+
+
+class RepositorioProductos(Repositorio):
+    """Operaciones de productos que usan las rutas"""
+
+    def _sentencia(self, nombre: str) -> str:
+        """Sentencia con nombre de SQL apuntada a la tabla de este cliente"""
+        return SQL[nombre].format(tabla=self.tabla)
+
+    def buscar(self, codigo: str) -> Optional[Dict]:
+        """Producto por código o referencia"""
+        return self.consultar(self._sentencia('buscar'), (codigo, codigo), fetch_one=True, nombre='buscar')
+
+    def por_codigo(self, codigo: str) -> Optional[Dict]:
+        return self.consultar(self._sentencia('por_codigo'), (codigo,), fetch_one=True, nombre='por_codigo')
+
+    def buscar_lote(self, codigos: Sequence[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Muchos códigos (o referencias) en una consulta IN por tramo
+        Retorna {codigo: producto | None} respetando el orden recibido
+        """
+        por_codigo, por_referencia = {}, {}
+        for tramo in _tramos(list(codigos), LOTE_IN):
+            placeholders = ','.join(['%s'] * len(tramo))
+            filas = self.consultar(
+                _SELECT.format(tabla=self.tabla) +
+                f" WHERE code IN ({placeholders}) OR reference IN ({placeholders})",
+                tuple(tramo) * 2, nombre='buscar_lote'
+            )
+            for f in filas:
+                por_codigo[f['code']] = f
+                por_referencia.setdefault(f['reference'], f)
+        return {c: por_codigo.get(c) or por_referencia.get(c) for c in codigos}
+
+    def por_codigos(self, codigos: Sequence[str]) -> List[Dict]:
+        """Productos con esos códigos exactos (sin repetir), en el orden recibido"""
+        codigos = list(dict.fromkeys(codigos))
+        encontrados = {}
+        for tramo in _tramos(codigos, LOTE_IN):
+            placeholders = ','.join(['%s'] * len(tramo))
+            for f in self.consultar(_SELECT.format(tabla=self.tabla) + f" WHERE code IN ({placeholders})",
+                                    tuple(tramo), nombre='por_codigos'):
+                encontrados[f['code']] = f
+        return [encontrados[c] for c in codigos if c in encontrados]
+
+    def listar(self, limite: int = 1000) -> List[Dict]:
+        return self.consultar(self._sentencia('listar'), (limite,), nombre='listar')
+
+    def exportar(self, columnas: Sequence[str]) -> List[Dict]:
+        """Todas las filas con las columnas pedidas (deben estar en COLUMNAS_PRODUCTO)"""
+        columnas = [c for c in columnas if c in COLUMNAS_PRODUCTO]
+        return self.consultar(f"SELECT {', '.join(columnas)} FROM {self.tabla}", nombre='exportar')
+
+    def precio_actual(self, codigo: str) -> Optional[Dict]:
+        """{'id', 'pricesell'} del producto, para detectar conflictos al guardar"""
+        return self.consultar(self._sentencia('precio_actual'), (codigo,), fetch_one=True, nombre='precio_actual')
+
+    def insertar(self, id: str, reference: str, code: str, name: str,
+                 pricebuy: float, pricesell: float) -> int:
+        return self.escribir(self._sentencia('insertar'), (id, reference, code, name, pricebuy, pricesell),
+                             nombre='insertar')
+
+    def actualizar(self, code: str, reference: str, name: str,
+                   pricebuy: float, pricesell: float) -> int:
+        return self.escribir(self._sentencia('actualizar'), (reference, name, pricebuy, pricesell, code),
+                             nombre='actualizar')
+
+    def guardar_lote(self, filas: Sequence[tuple]) -> int:
+        """Alta o actualización de muchos productos: (id, reference, code, name, pricebuy, pricesell)"""
+        return self.escribir_lote(self._sentencia('guardar_lote'), filas, nombre='guardar_lote')
+
+    def eliminar(self, codigo: str) -> int:
+        return self.escribir(self._sentencia('eliminar'), (codigo,), nombre='eliminar')
+
+    def total(self) -> int:
+        return self.consultar(self._sentencia('total'), fetch_one=True, nombre='total')['total']
+
+    def categorias(self) -> List[Dict]:
+        return self.consultar(self._sentencia('categorias'), nombre='categorias')
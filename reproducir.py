@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Captura y reproducción de tráfico real
+Convierte el tráfico de producción en una traza anonimizada y la vuelve a
+ejecutar, con los mismos tiempos entre requests (o N veces más rápido),
+contra una instancia local con una BD sembrada y una impresora falsa. Así un
+pico de un sábado se puede repetir antes y después de un cambio y comparar
+las latencias por ruta.
+
+Fuentes de la traza:
+    - Trazas de la app (REQUEST_TRACE_PATH, ver perfil.py): ruta, cliente,
+      códigos del cuerpo y tiempo de respuesta original
+    - Access log de nginx con el formato `main` de nginx.conf: sin cuerpos ni
+      cliente; la IP (seudonimizada) hace de cliente
+
+Uso:
+    python3 reproducir.py capturar --flask logs/trazas.jsonl -o sabado.jsonl
+    python3 reproducir.py capturar --nginx access.log --desde "2024-06-01 10:00" --hasta "2024-06-01 13:00" -o sabado.jsonl
+    python3 reproducir.py sembrar sabado.jsonl > semilla.sql
+    python3 reproducir.py impresora --puerto 9100 --demora-ms 40
+    python3 reproducir.py reproducir sabado.jsonl --velocidad 2 --impresora-falsa 9100 -o despues.json
+    python3 reproducir.py comparar antes.json despues.json
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from carga import pedir, percentil
+
+# ============================================
+# FORMATOS DE ENTRADA
+# ============================================
+
+# log_format main de nginx.conf; "$host" y $request_time al final son opcionales
+LINEA_NGINX = re.compile(
+    r'^(?P<ip>\S+) - \S+ \[(?P<fecha>[^\]]+)\] "(?P<metodo>[A-Z]+) (?P<url>\S+)[^"]*" '
+    r'(?P<estado>\d{3}) (?:\d+|-) "[^"]*" "[^"]*" "(?P<reenviado>[^"]*)"'
+    r'(?: "(?P<host>[^"]*)")?(?: (?P<segundos>[\d.]+))?'
+)
+
+FORMATO_FECHA_NGINX = '%d/%b/%Y:%H:%M:%S %z'
+
+PARAMETROS = ('formato', 'desde', 'hasta', 'agrupar', 'limite')
+
+# Rutas de la app con parámetro, para agrupar las del access log
+RUTAS = [
+    (re.compile(r'^/api/producto/[^/]+$'), '/api/producto/<codigo>'),
+    (re.compile(r'^/api/stock/(?!escaneo$|estado$)[^/]+$'), '/api/stock/<codigo>'),
+    (re.compile(r'^/api/pos/precio/[^/]+$'), '/api/pos/precio/<codigo>'),
+    (re.compile(r'^/api/imprimir/trabajos/[^/]+/reintentar$'), '/api/imprimir/trabajos/<trabajo_id>/reintentar'),
+    (re.compile(r'^/api/imprimir/trabajos/[^/]+$'), '/api/imprimir/trabajos/<trabajo_id>'),
+]
+
+# Rutas que no se reproducen nunca: cambiarían la configuración de la instancia
+EXCLUIDAS = {('POST', '/api/imprimir/config')}
+
+# Rutas cuyo último segmento es un código de producto
+RUTAS_CON_CODIGO = {'/api/producto/<codigo>', '/api/stock/<codigo>', '/api/pos/precio/<codigo>'}
+
+
+def ruta_de(path: str) -> str:
+    for patron, ruta in RUTAS:
+        if patron.match(path):
+            return ruta
+    return path
+
+
+def seudonimo(valor: str, sal: str) -> str:
+    return hashlib.sha256(f"{sal}{valor}".encode('utf-8')).hexdigest()[:12]
+
+
+def leer_nginx(archivo: str, sal: str):
+    with open(archivo, encoding='utf-8', errors='replace') as f:
+        for linea in f:
+            m = LINEA_NGINX.match(linea)
+            if not m:
+                continue
+            partes = urlsplit(m['url'])
+            if not partes.path.startswith('/api/'):
+                continue
+            parametros = {k: v for k, v in parse_qsl(partes.query) if k in PARAMETROS}
+            # Detrás de otro proxy la IP real es la primera de X-Forwarded-For
+            origen = m['reenviado'].split(',')[0].strip() if m['reenviado'] not in ('', '-') else m['ip']
+            cliente = m['host'].split('.')[0] if m['host'] else origen
+            yield {
+                'ts': datetime.strptime(m['fecha'], FORMATO_FECHA_NGINX).timestamp(),
+                'metodo': m['metodo'],
+                'ruta': ruta_de(partes.path),
+                'path': partes.path,
+                'parametros': parametros or None,
+                'cliente': seudonimo(cliente, sal),
+                'cuerpo': None,
+                'estado': int(m['estado']),
+                'ms': float(m['segundos']) * 1000 if m['segundos'] else None,
+            }
+
+
+def leer_flask(archivo: str, sal: str):
+    # Ya vienen anonimizadas por perfil.py; la sal extra permite rotar seudónimos al compartir
+    with open(archivo, encoding='utf-8') as f:
+        for linea in f:
+            try:
+                traza = json.loads(linea)
+            except ValueError:
+                continue
+            if not (traza.get('path') or '').startswith('/api/'):
+                continue
+            if sal and traza.get('cliente'):
+                traza['cliente'] = seudonimo(traza['cliente'], sal)
+            traza['ruta'] = traza.get('ruta') or ruta_de(traza['path'])
+            yield traza
+
+
+def leer_traza(archivo: str):
+    with open(archivo, encoding='utf-8') as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+# ============================================
+# CAPTURAR
+# ============================================
+
+def capturar(args):
+    if bool(args.nginx) == bool(args.flask):
+        raise SystemExit("❌ Indicá una fuente: --nginx o --flask")
+    fuente = leer_nginx(args.nginx, args.sal) if args.nginx else leer_flask(args.flask, args.sal)
+
+    desde = datetime.fromisoformat(args.desde).timestamp() if args.desde else None
+    hasta = datetime.fromisoformat(args.hasta).timestamp() if args.hasta else None
+    trazas = [t for t in fuente
+              if (desde is None or t['ts'] >= desde) and (hasta is None or t['ts'] < hasta)]
+    if not trazas:
+        raise SystemExit("❌ No hay requests /api/ en el rango indicado")
+
+    # Orden estable por tiempo; el offset t es lo único que se usa al reproducir
+    trazas.sort(key=lambda t: t['ts'])
+    inicio = trazas[0]['ts']
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        for traza in trazas:
+            traza = {'t': round(traza['ts'] - inicio, 3), **{k: v for k, v in traza.items() if k != 'ts'}}
+            f.write(json.dumps(traza, ensure_ascii=False) + '\n')
+
+    duracion = trazas[-1]['ts'] - inicio
+    print(f"📼 {len(trazas)} requests en {duracion / 60:.1f} min "
+          f"({len(trazas) / max(duracion, 1):.1f} req/s promedio) → {args.salida}")
+    for ruta, n in Counter(t['ruta'] for t in trazas).most_common(10):
+        print(f"   {n:>8}  {ruta}")
+
+
+# ============================================
+# SEMBRAR LA BD LOCAL
+# ============================================
+
+def codigos_de(traza) -> list:
+    codigos = []
+    if traza['ruta'] in RUTAS_CON_CODIGO:
+        codigos.append(traza['path'].rsplit('/', 1)[1])
+    cuerpo = traza.get('cuerpo') or {}
+    for clave in ('codigo', 'code'):
+        if cuerpo.get(clave):
+            codigos.append(str(cuerpo[clave]))
+    codigos.extend(str(c) for c in cuerpo.get('codigos') or [])
+    codigos.extend(str(m['codigo']) for m in cuerpo.get('movimientos') or [] if m.get('codigo'))
+    return codigos
+
+
+def codigos_a_sembrar(trazas) -> list:
+    """
+    Códigos que la traza encontró alguna vez; los que siempre dieron 404 se
+    dejan afuera para que la reproducción también los encuentre inexistentes
+    """
+    vistos, encontrados = {}, set()
+    for traza in trazas:
+        for codigo in codigos_de(traza):
+            vistos.setdefault(codigo, None)
+            if traza.get('estado') != 404 or traza['ruta'] not in RUTAS_CON_CODIGO:
+                encontrados.add(codigo)
+    return [c for c in vistos if c in encontrados]
+
+
+def _sql_texto(valor: str) -> str:
+    return "'" + valor.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def sembrar(args):
+    codigos = codigos_a_sembrar(leer_traza(args.archivo))
+    azar = random.Random(args.semilla)
+    print(f"-- Semilla para reproducir {args.archivo}: {len(codigos)} productos")
+    print("-- Cargar en la BD local: mysql -u unicenta -p unicentaopos < semilla.sql")
+    for i in range(0, len(codigos), 500):
+        filas = []
+        for codigo in codigos[i:i + 500]:
+            # Mismo código -> mismo id en cada siembra
+            id_producto = str(uuid.uuid5(uuid.NAMESPACE_OID, codigo))
+            compra = round(azar.uniform(50, 5000), 2)
+            filas.append(
+                f"({_sql_texto(id_producto)}, {_sql_texto(codigo[:255])}, {_sql_texto(codigo[:255])}, "
+                f"{_sql_texto(f'Producto {codigo}'[:255])}, {compra:.2f}, {compra * 1.35:.2f}, "
+                f"{azar.randint(0, 200)})"
+            )
+        print("INSERT IGNORE INTO products (id, reference, code, name, pricebuy, pricesell, stockunits) VALUES")
+        print(",\n".join(filas) + ";")
+
+
+# ============================================
+# IMPRESORA FALSA
+# ============================================
+
+class ImpresoraFalsa(socketserver.ThreadingTCPServer):
+    """Acepta conexiones ESC/POS en el puerto indicado y descarta los bytes"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, puerto: int, demora_ms: float = 0):
+        self.demora = demora_ms / 1000
+        self.conexiones = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        super().__init__(('0.0.0.0', puerto), _ManejadorImpresora)
+
+    def iniciar(self):
+        threading.Thread(target=self.serve_forever, name='impresora-falsa', daemon=True).start()
+        return self
+
+
+class _ManejadorImpresora(socketserver.BaseRequestHandler):
+    def handle(self):
+        recibidos = 0
+        while True:
+            datos = self.request.recv(65536)
+            if not datos:
+                break
+            recibidos += len(datos)
+        # Lo que tarda el cabezal: la app no ve el cierre hasta que "terminó de imprimir"
+        if self.server.demora:
+            time.sleep(self.server.demora)
+        with self.server._lock:
+            self.server.conexiones += 1
+            self.server.bytes += recibidos
+
+
+def impresora(args):
+    servidor = ImpresoraFalsa(args.puerto, args.demora_ms)
+    print(f"🖨️  Impresora falsa en :{args.puerto} (demora {args.demora_ms:.0f} ms); Ctrl+C para salir")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{servidor.conexiones} trabajos, {servidor.bytes} bytes")
+
+
+# ============================================
+# REPRODUCIR
+# ============================================
+
+def asignar_tokens(trazas, tokens: list) -> dict:
+    """Cada cliente de la traza usa siempre el mismo token local (orden estable)"""
+    clientes = sorted({t.get('cliente') or '' for t in trazas})
+    return {c: tokens[i % len(tokens)] for i, c in enumerate(clientes)}
+
+
+def cuerpo_de(traza, indice: int, codigos: list, semilla: int):
+    """
+    Cuerpo del request: el capturado más los campos que la traza no guarda
+    (nombres y precios se generan). Determinístico por posición en la traza.
+    """
+    if traza['metodo'] == 'GET':
+        return None
+    azar = random.Random(semilla * 1_000_003 + indice)
+    cuerpo = dict(traza.get('cuerpo') or {})
+    elegir = lambda: azar.choice(codigos) if codigos else '0000000000000'
+    ruta = traza['ruta']
+    if ruta == '/api/producto':
+        cuerpo.setdefault('code', elegir())
+        cuerpo.setdefault('name', f"Producto {cuerpo['code']}")
+        cuerpo.setdefault('pricebuy', round(azar.uniform(50, 5000), 2))
+        cuerpo.setdefault('pricesell', round(cuerpo['pricebuy'] * 1.35, 2))
+    elif ruta in ('/api/productos/lote', '/api/imprimir/lote'):
+        cuerpo.setdefault('codigos', [elegir() for _ in range(azar.randint(5, 50))])
+    elif ruta in ('/api/imprimir/etiqueta', '/api/stock/escaneo'):
+        if 'movimientos' not in cuerpo:
+            cuerpo.setdefault('codigo', elegir())
+    return cuerpo
+
+
+def reproducir(args):
+    trazas = [t for t in leer_traza(args.archivo)
+              if (t['metodo'], t['ruta']) not in EXCLUIDAS
+              and (not args.solo_lecturas or t['metodo'] == 'GET')]
+    if args.limite:
+        trazas = trazas[:args.limite]
+    if not trazas:
+        raise SystemExit("❌ La traza no tiene requests para reproducir")
+
+    tokens = asignar_tokens(trazas, args.token)
+    codigos = codigos_a_sembrar(trazas)
+    servidor = ImpresoraFalsa(args.impresora_falsa, args.demora_impresora_ms).iniciar() \
+        if args.impresora_falsa else None
+
+    resultados = [None] * len(trazas)
+
+    def enviar(i, traza, objetivo):
+        comienzo = time.monotonic()
+        url = args.url + traza['path']
+        if traza.get('parametros'):
+            url += '?' + urlencode(traza['parametros'])
+        inicio = time.perf_counter()
+        try:
+            estado = pedir(url, tokens[traza.get('cliente') or ''], traza['metodo'],
+                           cuerpo_de(traza, i, codigos, args.semilla), timeout=args.timeout)
+        except Exception as e:
+            estado = type(e).__name__
+        resultados[i] = (traza['ruta'], estado, (time.perf_counter() - inicio) * 1000,
+                         (comienzo - objetivo) * 1000)
+
+    duracion_original = trazas[-1]['t']
+    print(f"▶️  {len(trazas)} requests, {duracion_original / 60:.1f} min de tráfico a {args.velocidad}x "
+          f"contra {args.url} ({len(tokens)} clientes, hasta {args.concurrencia} en vuelo)")
+
+    # Lazo abierto: cada request sale en su momento aunque los anteriores no hayan vuelto
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as ejecutor:
+        inicio = time.monotonic()
+        for i, traza in enumerate(trazas):
+            objetivo = inicio + traza['t'] / args.velocidad
+            espera = objetivo - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            ejecutor.submit(enviar, i, traza, objetivo)
+    total = time.monotonic() - inicio
+
+    reporte = armar_reporte(trazas, resultados, total, args)
+    if servidor:
+        reporte['impresora'] = {'trabajos': servidor.conexiones, 'bytes': servidor.bytes}
+        servidor.shutdown()
+    imprimir_reporte(reporte)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+        print(f"💾 Resultados en {args.salida}\n")
+
+
+def resumen(latencias: list) -> dict:
+    return {
+        'p50': round(percentil(latencias, 50), 1),
+        'p95': round(percentil(latencias, 95), 1),
+        'p99': round(percentil(latencias, 99), 1),
+        'max': round(max(latencias), 1) if latencias else 0.0,
+    }
+
+
+def armar_reporte(trazas, resultados, total: float, args) -> dict:
+    por_ruta = defaultdict(list)
+    originales = defaultdict(list)
+    estados = defaultdict(Counter)
+    for traza, (ruta, estado, ms, _) in zip(trazas, resultados):
+        por_ruta[ruta].append(ms)
+        estados[ruta][str(estado)] += 1
+        if traza.get('ms') is not None:
+            originales[ruta].append(traza['ms'])
+
+    rutas = {}
+    for ruta, latencias in sorted(por_ruta.items(), key=lambda r: -len(r[1])):
+        errores = sum(n for e, n in estados[ruta].items() if not e.isdigit() or int(e) >= 500)
+        rutas[ruta] = {'requests': len(latencias), 'errores': errores,
+                       'estados': dict(estados[ruta]), **resumen(latencias)}
+        if originales[ruta]:
+            rutas[ruta]['original'] = resumen(originales[ruta])
+
+    todas = [r[2] for r in resultados]
+    return {
+        'traza': args.archivo,
+        'url': args.url,
+        'velocidad': args.velocidad,
+        'requests': len(resultados),
+        'segundos': round(total, 1),
+        'req_s': round(len(resultados) / total, 1) if total else 0,
+        'req_s_objetivo': round(len(trazas) / (trazas[-1]['t'] / args.velocidad), 1) if trazas[-1]['t'] else None,
+        'total': resumen(todas),
+        # Si el atraso crece, el cuello de botella es el reproductor (subir --concurrencia)
+        'atraso': resumen([max(0.0, r[3]) for r in resultados]),
+        'rutas': rutas,
+    }
+
+
+def imprimir_reporte(reporte: dict):
+    print("\n" + "=" * 96)
+    print(f"Requests: {reporte['requests']} en {reporte['segundos']}s "
+          f"({reporte['req_s']} req/s, objetivo {reporte['req_s_objetivo']})")
+    t, a = reporte['total'], reporte['atraso']
+    print(f"Total:    p50 {t['p50']} ms · p95 {t['p95']} ms · p99 {t['p99']} ms · máx {t['max']} ms")
+    print(f"Atraso del reproductor: p95 {a['p95']} ms · máx {a['max']} ms")
+    if 'impresora' in reporte:
+        print(f"Impresora falsa: {reporte['impresora']['trabajos']} trabajos, {reporte['impresora']['bytes']} bytes")
+    print("=" * 96)
+    print(f"{'RUTA':<42} {'REQS':>7} {'ERR':>5} {'P50':>8} {'P95':>8} {'P99':>8} {'ORIG P95':>10}")
+    print("=" * 96)
+    for ruta, r in reporte['rutas'].items():
+        original = f"{r['original']['p95']:.1f}" if 'original' in r else '-'
+        print(f"{ruta[:42]:<42} {r['requests']:>7} {r['errores']:>5} {r['p50']:>8.1f} "
+              f"{r['p95']:>8.1f} {r['p99']:>8.1f} {original:>10}")
+    print("=" * 96 + "\n")
+
+
+# ============================================
+# COMPARAR CORRIDAS
+# ============================================
+
+def comparar(args):
+    with open(args.antes, encoding='utf-8') as f:
+        antes = json.load(f)
+    with open(args.despues, encoding='utf-8') as f:
+        despues = json.load(f)
+
+    def delta(a, d):
+        return f"{(d - a) / a * 100:+.0f}%" if a else '-'
+
+    print(f"\n{'RUTA':<42} {'P50 ANTES':>10} {'P50 DESP':>10} {'Δ':>6} {'P95 ANTES':>10} {'P95 DESP':>10} {'Δ':>6}")
+    print("=" * 100)
+    filas = [('(total)', antes['total'], despues['total'])]
+    filas += [(ruta, antes['rutas'][ruta], r) for ruta, r in despues['rutas'].items() if ruta in antes['rutas']]
+    for ruta, a, d in filas:
+        print(f"{ruta[:42]:<42} {a['p50']:>10.1f} {d['p50']:>10.1f} {delta(a['p50'], d['p50']):>6} "
+              f"{a['p95']:>10.1f} {d['p95']:>10.1f} {delta(a['p95'], d['p95']):>6}")
+    print("=" * 100)
+    if antes.get('traza') != despues.get('traza') or antes.get('velocidad') != despues.get('velocidad'):
+        print("⚠️  Las corridas no usan la misma traza o velocidad: la comparación no es directa")
+    print()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Captura y reproducción de tráfico de ComparApp")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    cap = sub.add_parser('capturar', help="Armar una traza desde el access log o las trazas de la app")
+    cap.add_argument('--nginx', help="Access log con el formato main de nginx.conf")
+    cap.add_argument('--flask', help="Trazas de la app (REQUEST_TRACE_PATH)")
+    cap.add_argument('--desde', help="Inicio, p. ej. '2024-06-01 10:00' (hora local)")
+    cap.add_argument('--hasta', help="Fin (exclusivo)")
+    cap.add_argument('--sal', default='', help="Sal de los seudónimos de cliente")
+    cap.add_argument('-o', '--salida', required=True, help="Archivo JSONL de la traza")
+
+    sem = sub.add_parser('sembrar', help="SQL con los productos que usa la traza (a stdout)")
+    sem.add_argument('archivo')
+    sem.add_argument('--semilla', type=int, default=1)
+
+    imp = sub.add_parser('impresora', help="Impresora ESC/POS falsa")
+    imp.add_argument('--puerto', type=int, default=9100)
+    imp.add_argument('--demora-ms', type=float, default=0, help="Demora por trabajo (tiempo de impresión)")
+
+    rep = sub.add_parser('reproducir', help="Ejecutar una traza contra una instancia local")
+    rep.add_argument('archivo')
+    rep.add_argument('--url', default='http://localhost:5000')
+    rep.add_argument('--token', action='append', default=None,
+                     help="Token local; repetirlo para repartir clientes entre varios")
+    rep.add_argument('--velocidad', type=float, default=1.0, help="1 = tiempo real, 2 = el doble de rápido")
+    rep.add_argument('--concurrencia', type=int, default=64, help="Requests en vuelo como máximo")
+    rep.add_argument('--timeout', type=float, default=30)
+    rep.add_argument('--limite', type=int, help="Reproducir solo los primeros N requests")
+    rep.add_argument('--solo-lecturas', action='store_true', help="Omitir todo lo que no sea GET")
+    rep.add_argument('--semilla', type=int, default=1, help="Semilla de los cuerpos generados")
+    rep.add_argument('--impresora-falsa', type=int, metavar='PUERTO',
+                     help="Levantar una impresora falsa (la app debe tener PRINTER_IP apuntando acá)")
+    rep.add_argument('--demora-impresora-ms', type=float, default=0)
+    rep.add_argument('-o', '--salida', help="JSON con los resultados, para 'comparar'")
+
+    comp = sub.add_parser('comparar', help="Latencias por ruta entre dos corridas")
+    comp.add_argument('antes')
+    comp.add_argument('despues')
+
+    args = parser.parse_args()
+    if args.comando == 'reproducir':
+        args.token = args.token or ['tk_prod_abc123def456ghi789jkl012mno345']
+        if args.velocidad <= 0:
+            parser.error("--velocidad debe ser mayor que 0")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    {'capturar': capturar, 'sembrar': sembrar, 'impresora': impresora,
+     'reproducir': reproducir, 'comparar': comparar}[args.comando](args)
+    sys.exit(0)
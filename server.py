@@ -1,12 +1,240 @@
+#!/usr/bin/env python3
+"""
+Puente de impresión local
+Recibe trabajos de la app web (PrinterManager / Printer.print), los guarda en
+una cola persistente y un spooler asyncio los imprime en impresoras USB, serie
+o de red con las mismas etiquetas ESC/POS que app.py.
+
+Uso:
+    python3 server.py                       # escucha en 127.0.0.1:8080
+    PRINTERS=tcp:192.168.1.100:9100 PRINT_BRIDGE_HOST=0.0.0.0 python3 server.py
+"""
+
+import asyncio
+import os
+import threading
+from typing import Dict
+
 from flask import Flask, request, jsonify
-from printer import print_ticket
+from flask_cors import CORS
+
+import printer
+from etiquetas import generar_etiqueta
+from trabajos import (COLA_PATH, ColaTrabajos, PENDIENTE, IMPRESO, ERROR,
+                      ENVIADA, CONFIRMADA, FALLIDA)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+BRIDGE_HOST = os.getenv("PRINT_BRIDGE_HOST", "127.0.0.1")
+BRIDGE_PORT = int(os.getenv("PRINT_BRIDGE_PORT", 8080))
+
+# Orígenes web que pueden usar el puente: la app y sus subdominios, y la app
+# local. Cualquier otra página no puede mandar trabajos desde el navegador.
+BRIDGE_ORIGINS = [o.strip() for o in os.getenv(
+    "PRINT_BRIDGE_ORIGINS",
+    r"^https://([a-z0-9-]+\.)?comparappargentina\.com$,http://localhost:5000,http://127.0.0.1:5000"
+).split(",") if o.strip()]
+
+MAX_COPIAS = 50
+MAX_INTENTOS = int(os.getenv("PRINT_MAX_RETRIES", 3))
+REINTENTO_SEG = float(os.getenv("PRINT_RETRY_DELAY", 2))
+
+
+# ============================================
+# SPOOLER
+# ============================================
+
+class Spooler:
+    """
+    Event loop asyncio en un hilo propio con una cola por impresora:
+    una impresora lenta o desconectada no frena a las demás
+    """
+
+    def __init__(self, cola: ColaTrabajos):
+        self.cola = cola
+        self.loop = asyncio.new_event_loop()
+        self._colas: Dict[str, asyncio.Queue] = {}
+        self._pid = os.getpid()
+
+    def iniciar(self):
+        threading.Thread(target=self._correr, name='spooler', daemon=True).start()
+
+    def _correr(self):
+        asyncio.set_event_loop(self.loop)
+        # Trabajos que quedaron sin terminar en la corrida anterior
+        for trabajo_id in self.cola.recuperar():
+            trabajo = self.cola.obtener(trabajo_id)
+            self._poner(trabajo_id, trabajo['impresora'])
+        self.loop.run_forever()
+
+    def encolar(self, trabajo: Dict):
+        """Llamado desde los hilos de Flask"""
+        self.loop.call_soon_threadsafe(self._poner, trabajo['id'], trabajo['impresora'])
+
+    def _poner(self, trabajo_id: str, impresora: str):
+        cola = self._colas.get(impresora)
+        if cola is None:
+            cola = asyncio.Queue()
+            self._colas[impresora] = cola
+            self.loop.create_task(self._consumir(impresora, cola))
+        cola.put_nowait(trabajo_id)
+
+    async def _consumir(self, impresora: str, cola: asyncio.Queue):
+        while True:
+            trabajo_id = await cola.get()
+            # tomar() es atómico: un id repetido en la cola no se imprime dos veces
+            if self.cola.tomar(trabajo_id, self._pid):
+                await self._imprimir(trabajo_id, impresora)
+
+    async def _imprimir(self, trabajo_id: str, impresora: str):
+        error = None
+        for intento in range(1, MAX_INTENTOS + 1):
+            pendientes = self.cola.etiquetas_pendientes(trabajo_id)
+            if not pendientes:
+                break
+            n = None
+            try:
+                salida = await printer.abrir(impresora)
+                try:
+                    # Etiqueta por etiqueta: un corte deja registrado hasta dónde se llegó
+                    for n, producto in pendientes:
+                        self.cola.marcar_etiqueta(trabajo_id, n, ENVIADA)
+                        await salida.escribir(generar_etiqueta(producto))
+                        self.cola.marcar_etiqueta(trabajo_id, n, CONFIRMADA)
+                        n = None
+                finally:
+                    await self._cerrar(trabajo_id, salida)
+                error = None
+                break
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                if n is not None:
+                    self.cola.marcar_etiqueta(trabajo_id, n, FALLIDA, error)
+                print(f"⚠️  Trabajo {trabajo_id} intento {intento}/{MAX_INTENTOS}: {error}")
+                if intento < MAX_INTENTOS:
+                    await asyncio.sleep(REINTENTO_SEG * intento)
+
+        self.cola.finalizar(trabajo_id, error)
+
+    async def _cerrar(self, trabajo_id: str, salida: printer.Salida):
+        """Un error al cerrar no cambia el estado de etiquetas ya confirmadas (no se reimprimen)"""
+        try:
+            await salida.cerrar()
+        except Exception as e:
+            print(f"⚠️  Trabajo {trabajo_id}: error al cerrar la impresora: {type(e).__name__}: {e}")
+
+
+cola = ColaTrabajos()
+spooler = Spooler(cola)
 
 app = Flask(__name__)
+CORS(app, origins=BRIDGE_ORIGINS)
+
+
+# ============================================
+# RUTAS
+# ============================================
 
 @app.route("/print", methods=["POST"])
 def print_product():
-    data = request.json
-    print_ticket(data)
-    return jsonify({"success": True})
+    """
+    Encola una etiqueta
+
+    Body JSON (el que envía Printer.print):
+    {
+        "name": "Coca Cola 2.25L",
+        "code": "7790001234567",
+        "price": 1250.50,           // o "pricesell"
+        "printer": "usb:/dev/usb/lp0",
+        "copies": 2
+    }
+    Con el header Idempotency-Key, un reenvío no crea otro trabajo: si el
+    anterior falló se reimprimen solo las etiquetas que faltaron
+    """
+    data = request.json or {}
+    if not data.get('code') and not data.get('name'):
+        return jsonify({'success': False, 'error': 'Faltan datos del producto'}), 400
+
+    try:
+        impresora = printer.validar_destino(data.get('printer') or printer.impresora_por_defecto())
+        copias = int(data.get('copies') or 1)
+        precio = float(data.get('pricesell', data.get('price')) or 0)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if not 1 <= copias <= MAX_COPIAS:
+        return jsonify({'success': False, 'error': f'Copias: entre 1 y {MAX_COPIAS}'}), 400
+
+    producto = {'name': data.get('name') or 'Sin nombre', 'code': str(data.get('code') or ''),
+                'pricesell': precio}
+    clave = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    trabajo, nuevo = cola.encolar(impresora, [producto], copias, clave)
+
+    if not nuevo and trabajo['estado'] == IMPRESO:
+        return jsonify({'success': True, 'message': 'Ya impreso', 'job_id': trabajo['id'],
+                        'estado': trabajo['estado']})
+    if not nuevo and trabajo['estado'] == ERROR:
+        cola.reintentar(trabajo['id'])
+    if trabajo['estado'] in (ERROR, PENDIENTE):
+        spooler.encolar(trabajo)
+
+    return jsonify({
+        'success': True,
+        'message': f'Trabajo encolado ({copias} copia{"s" if copias > 1 else ""})' if nuevo
+                   else 'Trabajo reenviado: se imprimen solo las etiquetas faltantes',
+        'job_id': trabajo['id'],
+        'estado': cola.obtener(trabajo['id'])['estado']
+    }), 202
+
+
+@app.route("/jobs/<trabajo_id>", methods=["GET"])
+def estado_trabajo(trabajo_id):
+    trabajo = cola.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': trabajo})
+
+
+@app.route("/jobs/<trabajo_id>/retry", methods=["POST"])
+def reintentar_trabajo(trabajo_id):
+    """Reimprime solo las etiquetas no confirmadas de un trabajo con error"""
+    trabajo = cola.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    if not cola.reintentar(trabajo_id):
+        return jsonify({'success': False, 'error': f"El trabajo está {trabajo['estado']}"}), 409
+    spooler.encolar(trabajo)
+    return jsonify({'success': True, 'job': cola.obtener(trabajo_id)}), 202
+
+
+@app.route("/printers", methods=["GET"])
+def impresoras():
+    return jsonify({'success': True, 'printers': printer.listar_impresoras(),
+                    'default': printer.impresora_por_defecto()})
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({
+        'status': 'ok',
+        'platform': printer.plataforma(),
+        'printers': len(printer.listar_impresoras()),
+        'jobs': cola.contar()
+    })
+
 
-app.run(port=9100)
+if __name__ == '__main__':
+    print("=" * 70)
+    print("🖨️  PUENTE DE IMPRESIÓN LOCAL")
+    print("=" * 70)
+    print(f"🌐 Escuchando: http://{BRIDGE_HOST}:{BRIDGE_PORT}")
+    print(f"📍 Impresoras: {', '.join(printer.listar_impresoras()) or 'ninguna detectada'}")
+    print(f"🗃️  Cola: {os.path.abspath(COLA_PATH)}")
+    print("=" * 70)
+    purgados = cola.purgar()
+    if purgados:
+        print(f"🧹 {purgados} trabajos viejos eliminados")
+    spooler.iniciar()
+    app.run(host=BRIDGE_HOST, port=BRIDGE_PORT, threaded=True)
@@ -17,7 +17,7 @@ CREATE TABLE IF NOT EXISTS clientes (
     nombre VARCHAR(200) NOT NULL,
     subdominio VARCHAR(100) NOT NULL UNIQUE,
     db_name VARCHAR(100) NOT NULL UNIQUE,
-    token VARCHAR(64) NOT NULL UNIQUE,
+    token VARCHAR(64) NULL UNIQUE,          -- obsoleto: los tokens viven hasheados en tokens_clientes
     activo TINYINT(1) DEFAULT 1,
     fecha_alta DATETIME DEFAULT CURRENT_TIMESTAMP,
     fecha_vencimiento DATE NULL,
@@ -29,6 +29,22 @@ CREATE TABLE IF NOT EXISTS clientes (
     INDEX idx_activo (activo)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================
+-- TOKENS DE ACCESO (solo el SHA-256; ver tokens.py)
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS tokens_clientes (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    cliente_id INT NOT NULL,
+    token_hash CHAR(64) NOT NULL,
+    prefijo VARCHAR(12) NOT NULL,
+    creado DATETIME DEFAULT CURRENT_TIMESTAMP,
+    expira DATETIME NULL,
+    UNIQUE KEY uk_token_hash (token_hash),
+    INDEX idx_cliente (cliente_id),
+    FOREIGN KEY (cliente_id) REFERENCES clientes(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ============================================
 -- TABLA DE LOGS DE ACCESO (opcional)
 -- ============================================
@@ -44,26 +60,72 @@ CREATE TABLE IF NOT EXISTS logs_acceso (
     INDEX idx_timestamp (timestamp)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================
+-- REQUESTS POR CLIENTE, ENDPOINT Y HORA (uso.py)
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS uso_por_hora (
+    cliente_id INT NOT NULL,
+    hora DATETIME NOT NULL,
+    endpoint VARCHAR(255) NOT NULL,
+    requests INT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (cliente_id, hora, endpoint),
+    INDEX idx_hora (hora),
+    FOREIGN KEY (cliente_id) REFERENCES clientes(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================
+-- CATÁLOGO MAESTRO COMPARTIDO (maestro.py)
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS catalogo_maestro (
+    code VARCHAR(255) NOT NULL PRIMARY KEY,
+    reference VARCHAR(255) NOT NULL,
+    codetype VARCHAR(50) DEFAULT 'EAN-13',
+    name VARCHAR(255) NOT NULL,
+    category VARCHAR(50) DEFAULT '000',
+    taxcat VARCHAR(50) DEFAULT '002',
+    actualizado DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+    INDEX idx_actualizado (actualizado)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================
+-- VERSIÓN DE ESQUEMA POR CLIENTE (migraciones.py)
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS esquema_clientes (
+    cliente_id INT PRIMARY KEY,
+    version INT NOT NULL,
+    actualizado DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    error TEXT NULL,
+    FOREIGN KEY (cliente_id) REFERENCES clientes(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ============================================
 -- INSERTAR CLIENTE DE EJEMPLO
 -- ============================================
 
-INSERT INTO clientes (nombre, subdominio, db_name, token, activo)
+INSERT INTO clientes (nombre, subdominio, db_name, activo)
 VALUES 
-    ('Comercio Demo', 'demo', 'cliente_demo', 'demo_token_12345abcdef', 1),
-    ('Supermercado Los Andes', 'losandes', 'cliente_losandes', 'token_losandes_xyz789', 1);
+    ('Comercio Demo', 'demo', 'cliente_demo', 1),
+    ('Supermercado Los Andes', 'losandes', 'cliente_losandes', 1);
+
+-- Tokens de ejemplo: demo_token_12345abcdef y token_losandes_xyz789
+-- (SHA2 sirve solo sin TOKEN_PEPPER; con pepper, emitirlos con admin_cliente.py rotar-token)
+INSERT INTO tokens_clientes (cliente_id, token_hash, prefijo)
+SELECT id, SHA2('demo_token_12345abcdef', 256), 'demo_t' FROM clientes WHERE subdominio = 'demo';
+INSERT INTO tokens_clientes (cliente_id, token_hash, prefijo)
+SELECT id, SHA2('token_losandes_xyz789', 256), 'token_' FROM clientes WHERE subdominio = 'losandes';
 
 -- ============================================
 -- CREAR BASE DE DATOS PARA CLIENTE DEMO
 -- ============================================
 
-CREATE DATABASE IF NOT EXISTS cliente_demo
-CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
-
-USE cliente_demo;
-
--- Tabla de productos (compatible con Unicenta/Chromis)
-CREATE TABLE IF NOT EXISTS products (
+-- Base y tabla de productos generadas desde esquema.py (único DDL de clientes);
+-- no editar a mano: python3 admin_cliente.py esquema-sql
+-- >>> esquema.py: cliente_demo
+CREATE DATABASE IF NOT EXISTS `cliente_demo` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+CREATE TABLE IF NOT EXISTS `cliente_demo`.products (
     id VARCHAR(36) PRIMARY KEY,
     reference VARCHAR(255) NOT NULL,
     code VARCHAR(255) NOT NULL UNIQUE,
@@ -82,6 +144,9 @@ CREATE TABLE IF NOT EXISTS products (
     INDEX idx_code (code),
     INDEX idx_reference (reference)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+-- <<< esquema.py
+
+USE cliente_demo;
 
 -- Insertar productos de ejemplo
 INSERT INTO products (id, reference, code, name, pricebuy, pricesell)
@@ -90,16 +155,18 @@ VALUES
     (UUID(), 'PAN-LAC', '7790310012345', 'Pan Lactal', 800.00, 1200.00),
     (UUID(), 'LECHE-1L', '7798024950013', 'Leche Entera 1L', 600.00, 900.00);
 
+-- Los productos de marca nacional van también al maestro: las demás tiendas
+-- los resuelven desde ahí sin copiarlos (MASTER_CATALOG=1)
+INSERT IGNORE INTO comparapp_admin.catalogo_maestro (code, reference, codetype, name, category, taxcat)
+SELECT code, reference, codetype, name, category, taxcat FROM products;
+
 -- ============================================
 -- CREAR BASE DE DATOS PARA CLIENTE 2
 -- ============================================
 
-CREATE DATABASE IF NOT EXISTS cliente_losandes
-CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
-
-USE cliente_losandes;
-
-CREATE TABLE IF NOT EXISTS products (
+-- >>> esquema.py: cliente_losandes
+CREATE DATABASE IF NOT EXISTS `cliente_losandes` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+CREATE TABLE IF NOT EXISTS `cliente_losandes`.products (
     id VARCHAR(36) PRIMARY KEY,
     reference VARCHAR(255) NOT NULL,
     code VARCHAR(255) NOT NULL UNIQUE,
@@ -118,6 +185,7 @@ CREATE TABLE IF NOT EXISTS products (
     INDEX idx_code (code),
     INDEX idx_reference (reference)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+-- <<< esquema.py
 
 -- ============================================
 -- VERIFICACIÓN
@@ -0,0 +1,302 @@
+"""
+Conteo de stock con libro de movimientos
+Cada escaneo agrega una fila (+/- cantidad) a stock_movimientos: un INSERT que
+no toca products, así varios escáneres de la misma tienda pueden contar los
+mismos artículos sin esperar locks. Un hilo por worker toma los movimientos
+pendientes con FOR UPDATE SKIP LOCKED, los suma por producto y aplica un solo
+UPDATE por producto a stockunits en la misma transacción que los marca como
+aplicados: ningún movimiento se pierde ni se aplica dos veces.
+Hay un libro (y un agregador) por BD de productos: ver libro_de().
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import repositorio
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+STOCK_CONFIG = {
+    # Cada cuántos segundos se aplican los movimientos pendientes
+    'intervalo_seg': float(os.getenv("STOCK_APPLY_SECONDS", 2)),
+    # Movimientos por transacción del agregador
+    'lote': int(os.getenv("STOCK_APPLY_BATCH", 2000)),
+    # Días que se guardan los movimientos ya aplicados
+    'retencion_dias': int(os.getenv("STOCK_LEDGER_RETENTION_DAYS", 90)),
+    # Cantidad máxima (en valor absoluto) de un movimiento
+    'max_cantidad': float(os.getenv("STOCK_SCAN_MAX_QTY", 10000)),
+    # Movimientos por request de escaneo (sincronización de un escáner offline)
+    'max_movimientos': int(os.getenv("STOCK_SCAN_BATCH_MAX", 500)),
+}
+
+# Segundos entre podas del libro (se hacen cuando no hay pendientes)
+PODA_CADA_SEG = 3600
+
+DDL_MOVIMIENTOS = """
+    CREATE TABLE IF NOT EXISTS stock_movimientos (
+        id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        producto_id VARCHAR(36) NOT NULL,
+        cantidad DECIMAL(10,3) NOT NULL,
+        cliente VARCHAR(64) NOT NULL,
+        dispositivo VARCHAR(64) NULL,
+        clave VARCHAR(64) NULL,
+        creado DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        aplicado DATETIME(3) NULL,
+        UNIQUE KEY uk_clave (cliente, clave),
+        INDEX idx_pendientes (aplicado, id),
+        INDEX idx_producto (producto_id, aplicado)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# INSERT IGNORE + uk_clave: un escáner que reenvía el mismo movimiento no lo duplica
+SQL_REGISTRAR = """
+    INSERT IGNORE INTO stock_movimientos (producto_id, cantidad, cliente, dispositivo, clave)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+SQL_TOMAR_PENDIENTES = """
+    SELECT id, producto_id, cantidad, cliente FROM stock_movimientos
+    WHERE aplicado IS NULL ORDER BY id LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+SQL_SUMAR_STOCK = "UPDATE products SET stockunits = stockunits + %s WHERE id = %s"
+
+SQL_PENDIENTE_PRODUCTO = """
+    SELECT COALESCE(SUM(cantidad), 0) AS pendiente FROM stock_movimientos
+    WHERE producto_id = %s AND aplicado IS NULL
+"""
+
+SQL_PODAR = """
+    DELETE FROM stock_movimientos
+    WHERE aplicado IS NOT NULL AND aplicado < NOW() - INTERVAL %s DAY
+    ORDER BY aplicado LIMIT %s
+"""
+
+
+def validar_cantidad(valor) -> Decimal:
+    """Cantidad de un movimiento: distinta de 0, hasta 3 decimales; ValueError si no"""
+    try:
+        cantidad = Decimal(str(valor)).quantize(Decimal('0.001'))
+    except Exception:
+        raise ValueError(f"Cantidad inválida: {valor!r}")
+    if not cantidad.is_finite() or not cantidad or abs(cantidad) > Decimal(str(STOCK_CONFIG['max_cantidad'])):
+        raise ValueError(f"Cantidad inválida: {valor!r}")
+    return cantidad
+
+
+# ============================================
+# LIBRO DE MOVIMIENTOS
+# ============================================
+
+class LibroStock:
+    """
+    Movimientos de stock de un destino (la misma BD que su tabla products)
+    `al_aplicar(clientes)` se llama después de cada lote aplicado, para
+    invalidar caches de los clientes que escanearon
+    """
+
+    def __init__(self, config: Dict, al_aplicar: Optional[Callable] = None):
+        self.repo = repositorio.Repositorio(config)
+        self._al_aplicar = al_aplicar
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._pid = None
+        self._tabla_lista = False
+        self._ultima_poda = time.monotonic()
+        self.metricas = {'registrados': 0, 'duplicados': 0, 'aplicados': 0, 'lotes': 0,
+                         'productos_actualizados': 0, 'errores': 0, 'ultimo_lote_ms': 0.0}
+
+    def asegurar_tabla(self):
+        if not self._tabla_lista:
+            self.repo.escribir(DDL_MOVIMIENTOS, nombre='stock_ddl')
+            self._tabla_lista = True
+
+    def registrar(self, movimientos: Sequence[Dict], cliente: str,
+                  dispositivo: Optional[str] = None) -> int:
+        """
+        Agrega movimientos {'producto_id', 'cantidad', 'clave'} al libro
+        Retorna cuántos eran nuevos (los reenvíos con la misma clave se ignoran)
+        """
+        if not movimientos:
+            return 0
+        self.asegurar_tabla()
+        filas = [(m['producto_id'], m['cantidad'], cliente, dispositivo, m.get('clave'))
+                 for m in movimientos]
+        nuevos = self.repo.escribir_lote(SQL_REGISTRAR, filas, nombre='stock_registrar')
+        with self._lock:
+            self.metricas['registrados'] += nuevos
+            self.metricas['duplicados'] += len(filas) - nuevos
+        self.iniciar()
+        self._despertar.set()
+        return nuevos
+
+    def pendiente(self, producto_id: str) -> float:
+        """Suma de los movimientos del producto que el agregador todavía no aplicó"""
+        self.asegurar_tabla()
+        fila = self.repo.consultar(SQL_PENDIENTE_PRODUCTO, (producto_id,), fetch_one=True,
+                                   nombre='stock_pendiente')
+        return float(fila['pendiente'])
+
+    # ============================================
+    # AGREGADOR
+    # ============================================
+
+    def iniciar(self):
+        """Arranca el hilo agregador de este proceso (una vez por PID, también tras un fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._correr, name='stock-agregador', daemon=True).start()
+
+    def _correr(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._despertar.wait(STOCK_CONFIG['intervalo_seg'])
+            self._despertar.clear()
+            try:
+                # Con un lote lleno puede haber más: se sigue sin esperar
+                while self.aplicar() >= STOCK_CONFIG['lote']:
+                    pass
+                if time.monotonic() - self._ultima_poda >= PODA_CADA_SEG:
+                    self._ultima_poda = time.monotonic()
+                    self.podar()
+            except Exception as e:
+                with self._lock:
+                    self.metricas['errores'] += 1
+                print(f"⚠️  No se pudo aplicar el stock: {e}")
+
+    def aplicar(self) -> int:
+        """
+        Aplica un lote de movimientos pendientes; retorna cuántos aplicó
+        SKIP LOCKED: los agregadores de otros workers toman otros movimientos en
+        vez de esperar. Los UPDATE van en orden de id de producto, así dos lotes
+        concurrentes toman los locks de products en el mismo orden.
+        """
+        self.asegurar_tabla()
+        inicio = time.perf_counter()
+        with repositorio.conexion(self.repo.config) as conn:
+            conn.begin()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_TOMAR_PENDIENTES, (STOCK_CONFIG['lote'],))
+                    movimientos = cursor.fetchall()
+                    if not movimientos:
+                        conn.commit()
+                        return 0
+
+                    deltas = defaultdict(Decimal)
+                    for m in movimientos:
+                        deltas[m['producto_id']] += m['cantidad']
+                    cambios = [(delta, producto_id) for producto_id, delta in sorted(deltas.items()) if delta]
+                    if cambios:
+                        cursor.executemany(SQL_SUMAR_STOCK, cambios)
+
+                    ids = [m['id'] for m in movimientos]
+                    cursor.execute(
+                        f"UPDATE stock_movimientos SET aplicado = NOW(3) "
+                        f"WHERE id IN ({','.join(['%s'] * len(ids))})",
+                        ids
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        ms = (time.perf_counter() - inicio) * 1000
+        repositorio.registrar_tiempo('stock_aplicar', ms)
+        with self._lock:
+            self.metricas['aplicados'] += len(movimientos)
+            self.metricas['lotes'] += 1
+            self.metricas['productos_actualizados'] += len(cambios)
+            self.metricas['ultimo_lote_ms'] = round(ms, 1)
+        if self._al_aplicar:
+            try:
+                self._al_aplicar({m['cliente'] for m in movimientos})
+            except Exception as e:
+                print(f"⚠️  Stock aplicado, pero no se pudo invalidar la cache: {e}")
+        return len(movimientos)
+
+    def podar(self, pausa: float = 0.2) -> int:
+        """Borra en lotes los movimientos aplicados más viejos que la retención"""
+        total = 0
+        while True:
+            borradas = self.repo.escribir(SQL_PODAR, (STOCK_CONFIG['retencion_dias'], STOCK_CONFIG['lote']),
+                                          nombre='stock_podar')
+            total += borradas
+            if borradas < STOCK_CONFIG['lote']:
+                return total
+            time.sleep(pausa)
+
+    def estado(self) -> Dict:
+        with self._lock:
+            metricas = dict(self.metricas)
+        try:
+            fila = self.repo.consultar(
+                "SELECT COUNT(*) AS pendientes FROM stock_movimientos WHERE aplicado IS NULL",
+                fetch_one=True, nombre='stock_estado'
+            )
+            metricas['pendientes'] = int(fila['pendientes'])
+        except Exception:
+            metricas['pendientes'] = None
+        metricas['agregador_activo'] = self._pid == os.getpid()
+        return metricas
+
+
+# ============================================
+# UN LIBRO POR BD
+# ============================================
+# Cada BD de productos tiene su stock_movimientos; los clientes que comparten
+# BD (modo compartido o unico) comparten libro y agregador.
+
+_libros: Dict[tuple, LibroStock] = {}
+_libros_lock = threading.Lock()
+
+
+def libro_de(config: Dict, al_aplicar: Optional[Callable] = None) -> LibroStock:
+    """Libro de la BD de `config`; arranca su agregador en este proceso si no corre"""
+    clave = (config.get('host'), config.get('port', 3306), config.get('database'))
+    with _libros_lock:
+        libro = _libros.get(clave)
+        if libro is None:
+            libro = LibroStock(config, al_aplicar)
+            _libros[clave] = libro
+    libro.iniciar()
+    return libro
+
+
+def resolver_movimientos(crudos: List[Dict], buscar_lote: Callable) -> Tuple[List[Dict], List[str]]:
+    """
+    Valida los movimientos del request y resuelve cada código a su producto
+    `buscar_lote(codigos)` retorna {codigo: producto | None}
+    Retorna (movimientos listos para el libro, códigos no encontrados)
+    """
+    if len(crudos) > STOCK_CONFIG['max_movimientos']:
+        raise ValueError(f"Máximo {STOCK_CONFIG['max_movimientos']} movimientos por request")
+    validados = []
+    for m in crudos:
+        codigo = str(m.get('codigo') or '').strip()
+        if not codigo:
+            raise ValueError("Cada movimiento necesita un código")
+        clave = m.get('clave')
+        if clave is not None and (not str(clave) or len(str(clave)) > 64):
+            raise ValueError("La clave de un movimiento debe tener entre 1 y 64 caracteres")
+        validados.append((codigo, validar_cantidad(m.get('cantidad', 1)), clave and str(clave)))
+
+    productos = buscar_lote(list(dict.fromkeys(c for c, _, _ in validados)))
+    movimientos, faltantes = [], []
+    for codigo, cantidad, clave in validados:
+        producto = productos.get(codigo)
+        if producto is None:
+            faltantes.append(codigo)
+            continue
+        movimientos.append({'producto_id': producto['id'], 'codigo': producto['code'],
+                            'cantidad': cantidad, 'clave': clave})
+    return movimientos, list(dict.fromkeys(faltantes))
@@ -0,0 +1,226 @@
+"""
+Tokens de acceso de los clientes
+En la BD solo se guarda el SHA-256 (HMAC con TOKEN_PEPPER si está definido)
+de cada token. Un token presentado se resuelve directo a su cliente buscando
+su hash por índice; no hace falta traer el cliente por subdominio y comparar.
+Cada cliente puede tener varios tokens activos: al rotar, los anteriores
+siguen valiendo durante un período de gracia y los escáneres se actualizan
+sin cortes.
+
+Uso:
+    python3 tokens.py <token>       # imprime el hash (para APP_TOKENS)
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import cache
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+ADMIN_DB = 'comparapp_admin'
+
+TOKEN_CONFIG = {
+    # Secreto del HMAC; cambiarlo invalida todos los tokens emitidos
+    'pepper': os.getenv("TOKEN_PEPPER", "").encode('utf-8'),
+    # Segundos que siguen valiendo los tokens anteriores después de rotar
+    'gracia': int(os.getenv("TOKEN_ROTATION_GRACE", 86400)),
+    # Segundos que se cachea token -> cliente (0 = consultar siempre)
+    'cache_ttl': int(os.getenv(
+        "TOKENS_CACHE_TTL", 60 if cache.CACHE_CONFIG['backend'] == 'redis' else 10
+    )),
+}
+
+# Caracteres del token que se guardan en claro para reconocerlo en listados
+LARGO_PREFIJO = 6
+
+DDL_TOKENS = f"""
+    CREATE TABLE IF NOT EXISTS `{ADMIN_DB}`.tokens_clientes (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        cliente_id INT NOT NULL,
+        token_hash CHAR(64) NOT NULL,
+        prefijo VARCHAR(12) NOT NULL,
+        creado DATETIME DEFAULT CURRENT_TIMESTAMP,
+        expira DATETIME NULL,
+        UNIQUE KEY uk_token_hash (token_hash),
+        INDEX idx_cliente (cliente_id),
+        FOREIGN KEY (cliente_id) REFERENCES `{ADMIN_DB}`.clientes(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+SQL_RESOLVER = f"""
+    SELECT c.id, c.nombre, c.subdominio, c.db_name, c.activo,
+           t.token_hash, UNIX_TIMESTAMP(t.expira) AS expira_ts
+    FROM `{ADMIN_DB}`.tokens_clientes t
+    JOIN `{ADMIN_DB}`.clientes c ON c.id = t.cliente_id
+    WHERE t.token_hash = %s AND (t.expira IS NULL OR t.expira > NOW())
+    LIMIT 1
+"""
+
+
+# ============================================
+# HASH Y COMPARACIÓN
+# ============================================
+
+def generar() -> str:
+    """Token nuevo de 43 caracteres (256 bits)"""
+    return secrets.token_urlsafe(32)
+
+
+def limpiar(token: Optional[str]) -> str:
+    """Acepta el valor del header Authorization con o sin 'Bearer '"""
+    token = (token or '').strip()
+    return token[7:].strip() if token.startswith('Bearer ') else token
+
+
+def hash_token(token: str) -> str:
+    """
+    SHA-256 del token (HMAC con el pepper si hay)
+    Los tokens son aleatorios de 256 bits: un hash rápido alcanza y se puede indexar
+    """
+    datos = token.encode('utf-8')
+    if TOKEN_CONFIG['pepper']:
+        return hmac.new(TOKEN_CONFIG['pepper'], datos, hashlib.sha256).hexdigest()
+    return hashlib.sha256(datos).hexdigest()
+
+
+def coincide(hash_presentado: str, hash_guardado: str) -> bool:
+    """Comparación en tiempo constante"""
+    return hmac.compare_digest(hash_presentado.encode('ascii'), (hash_guardado or '').encode('ascii'))
+
+
+# ============================================
+# RESOLUCIÓN TOKEN -> CLIENTE
+# ============================================
+
+def resolver(token: Optional[str], consultar: Callable) -> Optional[Dict]:
+    """
+    Cliente dueño del token, o None si no existe o venció
+    `consultar(query, params, fetch_one)` es el de un repositorio de comparapp_admin
+    El resultado se cachea en el espacio 'clientes': admin_cliente lo invalida
+    al rotar tokens o activar/desactivar
+    """
+    token = limpiar(token)
+    if not token:
+        return None
+    presentado = hash_token(token)
+
+    def buscar():
+        return consultar(SQL_RESOLVER, (presentado,), True)
+
+    if TOKEN_CONFIG['cache_ttl'] > 0:
+        cliente = cache.obtener_o_calcular('clientes', f"token:{presentado}", buscar,
+                                           ttl=TOKEN_CONFIG['cache_ttl'])
+    else:
+        cliente = buscar()
+
+    if not cliente or not coincide(presentado, cliente['token_hash']):
+        return None
+    # El vencimiento se controla también sobre lo cacheado (período de gracia)
+    if cliente.get('expira_ts') is not None and time.time() >= float(cliente['expira_ts']):
+        return None
+    return cliente
+
+
+def tabla_tokens(especificacion: str) -> Dict[str, Dict]:
+    """
+    Tabla hash -> cliente para la app standalone
+    Formato: "<hash>=<cliente>:<nombre>,<hash>=<cliente>:<nombre>"
+    """
+    tabla = {}
+    for entrada in especificacion.split(','):
+        hash_guardado, _, resto = entrada.strip().partition('=')
+        if not hash_guardado or not resto:
+            continue
+        cliente, _, nombre = resto.partition(':')
+        hash_guardado = hash_guardado.lower()
+        tabla[hash_guardado] = {'cliente': cliente, 'nombre': nombre or cliente, 'hash': hash_guardado}
+    return tabla
+
+
+def buscar_en_tabla(tabla: Dict[str, Dict], token: Optional[str]) -> Optional[Dict]:
+    """Busca por hash y confirma en tiempo constante"""
+    token = limpiar(token)
+    if not token:
+        return None
+    presentado = hash_token(token)
+    info = tabla.get(presentado)
+    if info is None or not coincide(presentado, info['hash']):
+        return None
+    return info
+
+
+# ============================================
+# ADMINISTRACIÓN (cursor de admin_cliente)
+# ============================================
+
+def emitir(cursor, cliente_id: int) -> str:
+    """Crea un token nuevo para el cliente; retorna el token en claro (única vez)"""
+    token = generar()
+    cursor.execute(
+        f"INSERT INTO `{ADMIN_DB}`.tokens_clientes (cliente_id, token_hash, prefijo) VALUES (%s, %s, %s)",
+        (cliente_id, hash_token(token), token[:LARGO_PREFIJO])
+    )
+    return token
+
+
+def rotar(cursor, cliente_id: int, gracia: Optional[int] = None) -> str:
+    """
+    Emite un token nuevo y programa el vencimiento de los anteriores
+    Con gracia=0 los anteriores dejan de valer de inmediato
+    """
+    gracia = TOKEN_CONFIG['gracia'] if gracia is None else gracia
+    cursor.execute(
+        f"UPDATE `{ADMIN_DB}`.tokens_clientes "
+        "SET expira = NOW() + INTERVAL %s SECOND "
+        "WHERE cliente_id = %s AND (expira IS NULL OR expira > NOW() + INTERVAL %s SECOND)",
+        (gracia, cliente_id, gracia)
+    )
+    return emitir(cursor, cliente_id)
+
+
+def listar(cursor, cliente_id: int) -> List[Dict]:
+    """Tokens vigentes del cliente (solo prefijo, nunca el token)"""
+    cursor.execute(
+        f"SELECT prefijo, creado, expira FROM `{ADMIN_DB}`.tokens_clientes "
+        "WHERE cliente_id = %s AND (expira IS NULL OR expira > NOW()) ORDER BY creado",
+        (cliente_id,)
+    )
+    return cursor.fetchall()
+
+
+def purgar_vencidos(cursor) -> int:
+    cursor.execute(f"DELETE FROM `{ADMIN_DB}`.tokens_clientes WHERE expira <= NOW()")
+    return cursor.rowcount
+
+
+def migrar_texto_plano(cursor) -> int:
+    """
+    Pasa los tokens en claro de clientes.token a tokens_clientes y los borra
+    Es repetible; retorna la cantidad de tokens migrados
+    """
+    cursor.execute(DDL_TOKENS)
+    cursor.execute(f"ALTER TABLE `{ADMIN_DB}`.clientes MODIFY token VARCHAR(64) NULL")
+    cursor.execute(f"SELECT id, token FROM `{ADMIN_DB}`.clientes WHERE token IS NOT NULL AND token <> ''")
+    filas = [(c['id'], hash_token(c['token']), c['token'][:LARGO_PREFIJO]) for c in cursor.fetchall()]
+    if filas:
+        cursor.executemany(
+            f"INSERT IGNORE INTO `{ADMIN_DB}`.tokens_clientes (cliente_id, token_hash, prefijo) "
+            "VALUES (%s, %s, %s)",
+            filas
+        )
+        cursor.execute(f"UPDATE `{ADMIN_DB}`.clientes SET token = NULL WHERE token IS NOT NULL")
+    return len(filas)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise SystemExit("Uso: python3 tokens.py <token>")
+    print(hash_token(limpiar(sys.argv[1])))
@@ -0,0 +1,334 @@
+"""
+Registro persistente de trabajos de impresión
+SQLite en modo WAL, usado por el puente local (server.py) y por la impresión
+directa de app.py. Cada trabajo tiene sus etiquetas con estado propio, así un
+corte a mitad de lote deja registrado qué se imprimió y al reintentar solo se
+envían las etiquetas que faltan. Los reenvíos con la misma clave de
+idempotencia devuelven el trabajo existente en vez de crear otro.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+COLA_PATH = os.getenv("PRINT_QUEUE_PATH", "trabajos_impresion.db")
+
+# Un trabajo en curso sin novedades por más de esto se da por abandonado
+TRABAJO_ABANDONADO_SEG = int(os.getenv("PRINT_JOB_STALE_SECONDS", 120))
+
+# Estados de un trabajo
+PENDIENTE = 'pendiente'
+IMPRIMIENDO = 'imprimiendo'
+IMPRESO = 'impreso'
+ERROR = 'error'
+
+# Estados de una etiqueta
+EN_COLA = 'en_cola'
+ENVIADA = 'enviada'         # se empezó a escribir en la impresora
+CONFIRMADA = 'confirmada'   # la impresora aceptó todos los bytes
+FALLIDA = 'fallida'
+
+SCHEMA_VERSION = 2
+
+DDL_TRABAJOS = """
+    CREATE TABLE IF NOT EXISTS trabajos (
+        id TEXT PRIMARY KEY,
+        clave TEXT,
+        impresora TEXT NOT NULL,
+        productos TEXT NOT NULL,
+        copias INTEGER NOT NULL DEFAULT 1,
+        estado TEXT NOT NULL,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        propietario INTEGER,
+        creado REAL NOT NULL,
+        actualizado REAL NOT NULL
+    )
+"""
+
+DDL_ETIQUETAS = """
+    CREATE TABLE IF NOT EXISTS etiquetas (
+        trabajo_id TEXT NOT NULL REFERENCES trabajos(id) ON DELETE CASCADE,
+        n INTEGER NOT NULL,
+        producto TEXT NOT NULL,
+        estado TEXT NOT NULL,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        actualizado REAL NOT NULL,
+        PRIMARY KEY (trabajo_id, n)
+    )
+"""
+
+DDL_INDICES = (
+    "CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, creado)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uk_trabajos_clave ON trabajos (clave)",
+)
+
+
+def proceso_vivo(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ColaTrabajos:
+    """Acceso al registro; una conexión SQLite por instancia protegida por lock"""
+
+    def __init__(self, ruta: str = COLA_PATH):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        # timeout: espera al lock de escritura de otro worker en vez de fallar
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._migrar()
+
+    # ============================================
+    # ESQUEMA
+    # ============================================
+
+    def _migrar(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        existe = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trabajos'"
+        ).fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if existe and version < 2:
+                self._migrar_v1()
+            else:
+                self._conn.execute(DDL_TRABAJOS)
+                self._conn.execute(DDL_ETIQUETAS)
+            for ddl in DDL_INDICES:
+                self._conn.execute(ddl)
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _migrar_v1(self):
+        """Primera versión del puente: un producto por trabajo, sin etiquetas"""
+        self._conn.execute("ALTER TABLE trabajos RENAME COLUMN producto TO productos")
+        self._conn.execute("ALTER TABLE trabajos ADD COLUMN clave TEXT")
+        self._conn.execute("ALTER TABLE trabajos ADD COLUMN propietario INTEGER")
+        self._conn.execute("UPDATE trabajos SET productos = '[' || productos || ']'")
+        self._conn.execute(DDL_ETIQUETAS)
+        estado_etiqueta = {IMPRESO: CONFIRMADA, ERROR: FALLIDA}
+        for fila in self._conn.execute("SELECT id, productos, copias, estado, actualizado FROM trabajos").fetchall():
+            producto = json.loads(fila['productos'])[0]
+            self._conn.executemany(
+                "INSERT INTO etiquetas (trabajo_id, n, producto, estado, actualizado) VALUES (?, ?, ?, ?, ?)",
+                [(fila['id'], n, json.dumps(producto), estado_etiqueta.get(fila['estado'], EN_COLA),
+                  fila['actualizado']) for n in range(fila['copias'])]
+            )
+
+    # ============================================
+    # TRABAJOS
+    # ============================================
+
+    @staticmethod
+    def _a_dict(fila) -> Optional[Dict]:
+        if fila is None:
+            return None
+        trabajo = dict(fila)
+        trabajo['productos'] = json.loads(trabajo['productos'])
+        return trabajo
+
+    def encolar(self, impresora: str, productos: List[Dict], copias: int = 1,
+                clave: Optional[str] = None) -> Tuple[Dict, bool]:
+        """
+        Registra un trabajo con una etiqueta por producto y copia
+        Retorna (trabajo, nuevo); si la clave ya existía, nuevo es False y no
+        se crea nada
+        """
+        ahora = time.time()
+        trabajo_id = uuid.uuid4().hex
+        etiquetas = [(trabajo_id, n, json.dumps(producto), EN_COLA, ahora)
+                     for n, producto in enumerate(p for p in productos for _ in range(copias))]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if clave:
+                    fila = self._conn.execute("SELECT id FROM trabajos WHERE clave = ?", (clave,)).fetchone()
+                    if fila:
+                        self._conn.execute("COMMIT")
+                        return self._obtener(fila['id']), False
+                self._conn.execute(
+                    "INSERT INTO trabajos (id, clave, impresora, productos, copias, estado, creado, actualizado) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (trabajo_id, clave, impresora, json.dumps(productos), copias, PENDIENTE, ahora, ahora)
+                )
+                self._conn.executemany(
+                    "INSERT INTO etiquetas (trabajo_id, n, producto, estado, actualizado) VALUES (?, ?, ?, ?, ?)",
+                    etiquetas
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._obtener(trabajo_id), True
+
+    def _obtener(self, trabajo_id: str) -> Optional[Dict]:
+        trabajo = self._a_dict(self._conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone())
+        if trabajo is not None:
+            filas = self._conn.execute(
+                "SELECT estado, COUNT(*) AS n FROM etiquetas WHERE trabajo_id = ? GROUP BY estado", (trabajo_id,)
+            ).fetchall()
+            trabajo['etiquetas'] = {f['estado']: f['n'] for f in filas}
+            trabajo['total_etiquetas'] = sum(trabajo['etiquetas'].values())
+        return trabajo
+
+    def obtener(self, trabajo_id: str) -> Optional[Dict]:
+        """Trabajo con el conteo de etiquetas por estado"""
+        with self._lock:
+            return self._obtener(trabajo_id)
+
+    def tomar(self, trabajo_id: str, propietario: int) -> bool:
+        """
+        Reserva un trabajo pendiente para imprimirlo; False si otro proceso ya
+        lo tiene o si no queda nada por imprimir
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE trabajos SET estado = ?, propietario = ?, actualizado = ?, intentos = intentos + 1 "
+                "WHERE id = ? AND estado = ?",
+                (IMPRIMIENDO, propietario, time.time(), trabajo_id, PENDIENTE)
+            )
+            return cursor.rowcount == 1
+
+    def reintentar(self, trabajo_id: str) -> bool:
+        """
+        Vuelve a poner en cola solo las etiquetas que no llegaron a confirmarse
+        No hace nada si el trabajo está imprimiéndose o ya se completó
+        """
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "UPDATE trabajos SET estado = ?, error = NULL, actualizado = ? WHERE id = ? AND estado = ?",
+                    (PENDIENTE, ahora, trabajo_id, ERROR)
+                )
+                if cursor.rowcount:
+                    self._conn.execute(
+                        "UPDATE etiquetas SET estado = ?, actualizado = ? WHERE trabajo_id = ? AND estado != ?",
+                        (EN_COLA, ahora, trabajo_id, CONFIRMADA)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount == 1
+
+    def finalizar(self, trabajo_id: str, error: Optional[str] = None) -> Dict:
+        """Cierra el trabajo: impreso si todas las etiquetas se confirmaron, error si no"""
+        with self._lock:
+            faltan = self._conn.execute(
+                "SELECT COUNT(*) FROM etiquetas WHERE trabajo_id = ? AND estado != ?", (trabajo_id, CONFIRMADA)
+            ).fetchone()[0]
+            estado = IMPRESO if faltan == 0 else ERROR
+            self._conn.execute(
+                "UPDATE trabajos SET estado = ?, error = ?, propietario = NULL, actualizado = ? WHERE id = ?",
+                (estado, None if estado == IMPRESO else (error or f"{faltan} etiquetas sin imprimir"),
+                 time.time(), trabajo_id)
+            )
+            return self._obtener(trabajo_id)
+
+    # ============================================
+    # ETIQUETAS
+    # ============================================
+
+    def etiquetas_pendientes(self, trabajo_id: str) -> List[Tuple[int, Dict]]:
+        """(n, producto) de las etiquetas sin confirmar, en orden"""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT n, producto FROM etiquetas WHERE trabajo_id = ? AND estado != ? ORDER BY n",
+                (trabajo_id, CONFIRMADA)
+            ).fetchall()
+        return [(f['n'], json.loads(f['producto'])) for f in filas]
+
+    def marcar_etiqueta(self, trabajo_id: str, n: int, estado: str, error: Optional[str] = None):
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE etiquetas SET estado = ?, error = ?, actualizado = ?, "
+                "intentos = intentos + ? WHERE trabajo_id = ? AND n = ?",
+                (estado, error, ahora, 1 if estado == ENVIADA else 0, trabajo_id, n)
+            )
+            # Latido del trabajo: evita que otro proceso lo dé por abandonado
+            self._conn.execute("UPDATE trabajos SET actualizado = ? WHERE id = ?", (ahora, trabajo_id))
+
+    # ============================================
+    # RECUPERACIÓN Y MANTENIMIENTO
+    # ============================================
+
+    def recuperar(self, vivo: Callable[[Optional[int]], bool] = proceso_vivo) -> List[str]:
+        """
+        Devuelve a pendiente los trabajos cuyo proceso murió a mitad de impresión
+        Una etiqueta que quedó 'enviada' no se sabe si salió: se vuelve a enviar
+        (una etiqueta repetida es preferible a un estante sin precio)
+        Retorna los ids de todos los trabajos pendientes, en orden de llegada
+        """
+        limite = time.time() - TRABAJO_ABANDONADO_SEG
+        ahora = time.time()
+        with self._lock:
+            en_curso = self._conn.execute(
+                "SELECT id, propietario, actualizado FROM trabajos WHERE estado = ?", (IMPRIMIENDO,)
+            ).fetchall()
+            for fila in en_curso:
+                if vivo(fila['propietario']) and fila['actualizado'] >= limite:
+                    continue
+                self._conn.execute(
+                    "UPDATE etiquetas SET estado = ?, actualizado = ? WHERE trabajo_id = ? AND estado = ?",
+                    (EN_COLA, ahora, fila['id'], ENVIADA)
+                )
+                self._conn.execute(
+                    "UPDATE trabajos SET estado = ?, propietario = NULL, actualizado = ? WHERE id = ? AND estado = ?",
+                    (PENDIENTE, ahora, fila['id'], IMPRIMIENDO)
+                )
+            filas = self._conn.execute(
+                "SELECT id FROM trabajos WHERE estado = ? ORDER BY creado", (PENDIENTE,)
+            ).fetchall()
+        return [f['id'] for f in filas]
+
+    def contar(self) -> Dict[str, int]:
+        with self._lock:
+            filas = self._conn.execute("SELECT estado, COUNT(*) AS n FROM trabajos GROUP BY estado").fetchall()
+        return {f['estado']: f['n'] for f in filas}
+
+    def purgar(self, dias: int = 7) -> int:
+        """Borra trabajos terminados hace más de `dias` días (y sus etiquetas)"""
+        limite = time.time() - dias * 86400
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM trabajos WHERE estado IN (?, ?) AND actualizado < ?",
+                (IMPRESO, ERROR, limite)
+            )
+        return cursor.rowcount
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,225 @@
+"""
+Estadísticas de uso por cliente
+En lugar de consultar logs_acceso (una fila por request, para siempre), cada
+worker acumula en memoria los requests por (cliente, endpoint, hora) y los
+suma cada pocos segundos a comparapp_admin.uso_por_hora con un solo
+INSERT ... ON DUPLICATE KEY UPDATE. Los reportes leen solo esa tabla y las
+filas crudas se podan según la retención configurada.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+USO_CONFIG = {
+    # Cada cuántos segundos se vuelcan los contadores a la BD
+    'volcado_seg': float(os.getenv("USAGE_FLUSH_SECONDS", 10)),
+    # Claves acumuladas a partir de las cuales se vuelca sin esperar
+    'max_claves': int(os.getenv("USAGE_BUFFER_MAX", 5000)),
+    # Además, una fila por request en logs_acceso (opt-in, para auditoría por IP)
+    'logs_crudos': os.getenv("ACCESS_LOG_RAW", "0") == "1",
+    'retencion_crudos_dias': int(os.getenv("ACCESS_LOG_RETENTION_DAYS", 30)),
+    'retencion_uso_dias': int(os.getenv("USAGE_RETENTION_DAYS", 730)),
+    # Filas por DELETE al podar: transacciones cortas, sin frenar los inserts
+    'lote_poda': int(os.getenv("ACCESS_LOG_PRUNE_BATCH", 5000)),
+}
+
+DDL_USO_POR_HORA = """
+    CREATE TABLE IF NOT EXISTS uso_por_hora (
+        cliente_id INT NOT NULL,
+        hora DATETIME NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        requests INT UNSIGNED NOT NULL DEFAULT 0,
+        PRIMARY KEY (cliente_id, hora, endpoint),
+        INDEX idx_hora (hora),
+        FOREIGN KEY (cliente_id) REFERENCES clientes(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+SQL_SUMAR = """
+    INSERT INTO uso_por_hora (cliente_id, hora, endpoint, requests)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE requests = requests + VALUES(requests)
+"""
+
+# El PK (cliente_id, hora, endpoint) resuelve cada reporte con un range scan
+SQL_REPORTE = {
+    'endpoint': """
+        SELECT endpoint, SUM(requests) AS requests FROM uso_por_hora
+        WHERE cliente_id = %s AND hora >= %s AND hora < %s
+        GROUP BY endpoint ORDER BY requests DESC
+    """,
+    'hora': """
+        SELECT hora AS periodo, SUM(requests) AS requests FROM uso_por_hora
+        WHERE cliente_id = %s AND hora >= %s AND hora < %s
+        GROUP BY hora ORDER BY hora
+    """,
+    'dia': """
+        SELECT DATE(hora) AS periodo, SUM(requests) AS requests FROM uso_por_hora
+        WHERE cliente_id = %s AND hora >= %s AND hora < %s
+        GROUP BY DATE(hora) ORDER BY periodo
+    """,
+}
+
+SQL_REPORTE_CLIENTES = """
+    SELECT u.cliente_id, c.subdominio, SUM(u.requests) AS requests
+    FROM uso_por_hora u JOIN clientes c ON c.id = u.cliente_id
+    WHERE u.hora >= %s AND u.hora < %s
+    GROUP BY u.cliente_id, c.subdominio ORDER BY requests DESC
+"""
+
+SQL_MAS_ACTIVOS = """
+    SELECT c.id, c.subdominio, c.db_name, SUM(u.requests) AS requests
+    FROM uso_por_hora u JOIN clientes c ON c.id = u.cliente_id
+    WHERE u.hora >= %s AND c.activo = 1
+    GROUP BY c.id, c.subdominio, c.db_name ORDER BY requests DESC LIMIT %s
+"""
+
+AGRUPACIONES = tuple(SQL_REPORTE)
+
+
+def hora_de(momento: datetime) -> datetime:
+    return momento.replace(minute=0, second=0, microsecond=0)
+
+
+# ============================================
+# ACUMULADOR
+# ============================================
+
+class AcumuladorUso:
+    """
+    Contadores en memoria de este worker, volcados por un hilo propio
+    `escribir_lote(query, filas)` es el de un repositorio de comparapp_admin
+    """
+
+    def __init__(self, escribir_lote):
+        self._escribir_lote = escribir_lote
+        self._pendientes = Counter()
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._pid = None
+        self.volcados = 0
+        self.perdidos = 0
+        atexit.register(self.volcar)
+
+    def registrar(self, cliente_id: int, endpoint: str, momento: Optional[datetime] = None):
+        clave = (cliente_id, hora_de(momento or datetime.now()), endpoint[:255])
+        with self._lock:
+            if self._pid != os.getpid():
+                # Primer uso en este proceso (o después de un fork): hilo propio
+                self._pendientes.clear()
+                self._pid = os.getpid()
+                threading.Thread(target=self._correr, name='uso-volcado', daemon=True).start()
+            self._pendientes[clave] += 1
+            lleno = len(self._pendientes) >= USO_CONFIG['max_claves']
+        if lleno:
+            self._despertar.set()
+
+    def _correr(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._despertar.wait(USO_CONFIG['volcado_seg'])
+            self._despertar.clear()
+            self.volcar()
+
+    def volcar(self) -> int:
+        """Suma los contadores pendientes a uso_por_hora; retorna las claves volcadas"""
+        with self._lock:
+            if not self._pendientes or self._pid != os.getpid():
+                return 0
+            pendientes, self._pendientes = self._pendientes, Counter()
+
+        # Orden del PK: los lotes de distintos workers toman los locks en el mismo orden
+        filas = [(c, h, e, n) for (c, h, e), n in sorted(pendientes.items())]
+        try:
+            self._escribir_lote(SQL_SUMAR, filas)
+            self.volcados += len(filas)
+            return len(filas)
+        except Exception as e:
+            print(f"⚠️  No se pudo volcar el uso ({len(filas)} claves): {e}")
+            with self._lock:
+                if len(self._pendientes) + len(pendientes) <= USO_CONFIG['max_claves'] * 10:
+                    # Se reintenta en el próximo volcado
+                    self._pendientes.update(pendientes)
+                else:
+                    self.perdidos += sum(pendientes.values())
+            return 0
+
+    def estado(self) -> Dict:
+        with self._lock:
+            return {'pendientes': len(self._pendientes), 'volcados': self.volcados,
+                    'perdidos': self.perdidos}
+
+
+# ============================================
+# REPORTES
+# ============================================
+
+def rango(desde: Optional[str], hasta: Optional[str], dias_default: int = 7):
+    """Fechas YYYY-MM-DD (hasta inclusive) a [desde, hasta) en datetime; ValueError si son inválidas"""
+    fin = date.fromisoformat(hasta) if hasta else date.today()
+    inicio = date.fromisoformat(desde) if desde else fin - timedelta(days=dias_default - 1)
+    if inicio > fin:
+        raise ValueError("'desde' es posterior a 'hasta'")
+    return datetime.combine(inicio, datetime.min.time()), datetime.combine(fin + timedelta(days=1), datetime.min.time())
+
+
+def reporte(consultar, cliente_id: int, desde: datetime, hasta: datetime, agrupar: str = 'dia') -> List[Dict]:
+    """Requests del cliente por día, hora o endpoint, solo desde la tabla de uso"""
+    if agrupar not in SQL_REPORTE:
+        raise ValueError(f"agrupar debe ser uno de: {', '.join(AGRUPACIONES)}")
+    filas = consultar(SQL_REPORTE[agrupar], (cliente_id, desde, hasta))
+    return [{**f, 'requests': int(f['requests'])} for f in filas]
+
+
+def reporte_clientes(consultar, desde: datetime, hasta: datetime) -> List[Dict]:
+    """Requests por cliente en el rango, para el panel de administración"""
+    return [{**f, 'requests': int(f['requests'])} for f in consultar(SQL_REPORTE_CLIENTES, (desde, hasta))]
+
+
+def clientes_mas_activos(consultar, cantidad: int, horas: int = 24) -> List[Dict]:
+    """Clientes activos con más requests en las últimas `horas` (calentamiento de workers)"""
+    desde = hora_de(datetime.now() - timedelta(hours=horas))
+    return consultar(SQL_MAS_ACTIVOS, (desde, cantidad))
+
+
+# ============================================
+# RETENCIÓN
+# ============================================
+
+def _borrar_en_lotes(escribir, tabla: str, columna: str, limite: datetime, pausa: float) -> int:
+    total = 0
+    while True:
+        borradas = escribir(
+            f"DELETE FROM {tabla} WHERE {columna} < %s ORDER BY {columna} LIMIT %s",
+            (limite, USO_CONFIG['lote_poda'])
+        )
+        total += borradas
+        if borradas < USO_CONFIG['lote_poda']:
+            return total
+        time.sleep(pausa)
+
+
+def podar(escribir, ahora: Optional[datetime] = None, pausa: float = 0.2) -> Dict[str, int]:
+    """
+    Borra filas de logs_acceso y uso_por_hora más viejas que su retención
+    En lotes de ACCESS_LOG_PRUNE_BATCH por el índice de fecha, con una pausa
+    entre lotes para no competir con los inserts en horario comercial
+    """
+    ahora = ahora or datetime.now()
+    return {
+        'logs_acceso': _borrar_en_lotes(
+            escribir, 'logs_acceso', 'timestamp',
+            ahora - timedelta(days=USO_CONFIG['retencion_crudos_dias']), pausa),
+        'uso_por_hora': _borrar_en_lotes(
+            escribir, 'uso_por_hora', 'hora',
+            hora_de(ahora - timedelta(days=USO_CONFIG['retencion_uso_dias'])), pausa),
+    }